@@ -1,175 +1,406 @@
 """
 Sistema di Autenticazione e Database Utenti
-SQLite + bcrypt per password hashing
+SQLite + argon2 per password hashing (bcrypt solo per hash legacy)
 Con supporto sincronizzazione (updated_at)
 """
 
 import sqlite3
 import bcrypt
-from datetime import datetime, timedelta
-import secrets
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+import base64
 import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 
+# Ruoli ammessi (la CHECK sulla tabella users resta la fonte di verità)
+_RUOLI = frozenset(('paziente', 'medico', 'admin'))
+
+# Durata di validità di una sessione (secondi); expires_at è un epoch INTEGER
+SESSION_DURATION = 40 * 60
+
+# Cache in-process di verify_session: numero massimo di token e durata
+# massima di un'entry (limita la staleness se gli utenti cambiano via sync)
+SESSION_CACHE_MAX = 4096
+SESSION_CACHE_TTL = 60
+
+# Parametri argon2id raccomandati da OWASP (19 MiB, 2 iterazioni)
+_PASSWORD_HASHER = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+# ========== HASHING IN THREAD POOL ==========
+# argon2-cffi e bcrypt rilasciano il GIL durante l'hash: un pool di thread
+# usa più core per login/registrazioni concorrenti senza fare fork di un
+# processo che ha già altri thread attivi (MQTT, SocketIO, watcher, sync),
+# e limita la memoria di argon2 (19 MiB per hash) a un hash per core.
+#
+# Con eventlet (dashboard con DASHBOARD_ASYNC_MODE=eventlet, monkey patching
+# già fatto) i worker del pool sarebbero green thread: un thread nativo del
+# tpool (login/register via run_blocking) non può attenderne il risultato.
+# In quel caso l'hash passa dal tpool di eventlet (diretto se si è già su un
+# suo thread) e i lock di AuthDB sono nativi
+
+_eventlet_patcher = sys.modules.get('eventlet.patcher')
+_GREEN = _eventlet_patcher is not None and _eventlet_patcher.is_monkey_patched('thread')
+
+if _GREEN:
+    from eventlet import tpool as _tpool
+    _native_threading = _eventlet_patcher.original('threading')
+    _hash_pool = None
+else:
+    _native_threading = threading
+    _hash_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='auth-hash')
+
+def _run_in_hash_pool(fn, *args):
+    """Esegue fn nel pool di hashing (tpool con eventlet) e ne attende il risultato"""
+    if _GREEN:
+        return _tpool.execute(fn, *args)
+    return _hash_pool.submit(fn, *args).result()
+
+def _argon2_hash(password):
+    return _PASSWORD_HASHER.hash(password)
+
+def _argon2_verify(password, password_hash):
+    try:
+        return _PASSWORD_HASHER.verify(password_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+def _bcrypt_verify(password, password_hash):
+    return bcrypt.checkpw(password, password_hash)
+
+# Campi utente restituiti da verify_session (ordine di SQL_VERIFY_SESSION)
+SESSION_USER_KEYS = ('id', 'username', 'nome', 'cognome', 'ruolo')
+
+# Colonne scambiate con l'altra istanza durante la sincronizzazione
+SYNC_COLUMNS = (
+    'id', 'username', 'password_hash', 'nome', 'cognome', 'ruolo',
+    'created_at', 'last_login', 'updated_at'
+)
+
 class AuthDB:
+    # Query hot path: testo SQL costante, così la statement cache di
+    # sqlite3 riusa lo statement già preparato invece di ricompilarlo
+    SQL_FIND_USER = "SELECT * FROM users WHERE username = ?"
+    SQL_INSERT_SESSION = '''
+        INSERT INTO sessions (user_id, session_token, expires_at)
+        VALUES (?, ?, ?)
+    '''
+    SQL_TOUCH_LAST_LOGIN = "UPDATE users SET last_login = datetime('now') WHERE id = ?"
+    SQL_REHASH_PASSWORD = "UPDATE users SET password_hash = ?, updated_at = datetime('now') WHERE id = ?"
+    SQL_VERIFY_SESSION = '''
+        SELECT s.expires_at, u.id as user_id, u.username, u.nome, u.cognome, u.ruolo
+        FROM sessions s
+        JOIN users u ON s.user_id = u.id
+        WHERE s.session_token = ? AND s.expires_at > ?
+    '''
+    SQL_DELETE_SESSION = "DELETE FROM sessions WHERE session_token = ?"
+    SQL_DELETE_EXPIRED_BATCH = '''
+        DELETE FROM sessions WHERE rowid IN (
+            SELECT rowid FROM sessions WHERE expires_at < ? LIMIT ?
+        )
+    '''
+    CLEANUP_BATCH_SIZE = 1000
+    SQL_LIST_USERS = '''
+        SELECT id, username, nome, cognome, ruolo, created_at, last_login, updated_at
+        FROM users
+        ORDER BY created_at DESC
+    '''
+    SQL_UPDATE_USER = '''
+        UPDATE users SET
+            nome = COALESCE(?, nome),
+            cognome = COALESCE(?, cognome),
+            ruolo = COALESCE(?, ruolo),
+            password_hash = COALESCE(?, password_hash),
+            updated_at = datetime('now')
+        WHERE id = ?
+    '''
+    SQL_DELETE_USER = '''
+        DELETE FROM users
+        WHERE id = ?
+          AND NOT (ruolo = 'admin' AND (SELECT COUNT(*) FROM users WHERE ruolo = 'admin') <= 1)
+    '''
+    SQL_SYNC_USERS = f"SELECT {', '.join(SYNC_COLUMNS)} FROM users"
+    SQL_GET_USER_BY_ID = '''
+        SELECT id, username, nome, cognome, ruolo, created_at, last_login, updated_at
+        FROM users WHERE id = ?
+    '''
+    
+    # DB (path assoluto) su cui fix_null_updated_at è già stato eseguito
+    _migrated_dbs = set()
+    
     def __init__(self, db_path='users.db'):
         self.db_path = db_path
+        
+        # Connessione RW unica (serializzata da lock) + una connessione
+        # read-only (mode=ro) per thread: in WAL i reader non bloccano il writer
+        # Lock nativi anche con eventlet: presi sia da green thread sia dai
+        # thread nativi del tpool (sezioni brevi, senza I/O green all'interno)
+        self._write_lock = _native_threading.Lock()
+        self._local = threading.local()
+        self._conn = self._open_connection()
+        
+        # LRU token -> (scadenza epoch, dati utente) per verify_session
+        self._session_cache = OrderedDict()
+        self._session_cache_lock = _native_threading.Lock()
+        
         self.init_database()
         self.fix_null_updated_at() 
     
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
+    def _open_connection(self, readonly=False):
+        """Apre una connessione configurata (WAL + PRAGMA di tuning)"""
+        if readonly:
+            # Connessione di sola lettura a livello SQLite: in WAL legge
+            # senza lock e qualsiasi scrittura accidentale fallisce
+            uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
         conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-20000")
+        # Letture via mmap della page cache del kernel (niente copia in read())
+        conn.execute("PRAGMA mmap_size=268435456")
+        # Attiva ON DELETE CASCADE di sessions (busy timeout: 5s di default di sqlite3)
+        conn.execute("PRAGMA foreign_keys=ON")
         return conn
     
+    @contextmanager
+    def get_connection(self, write=False):
+        """
+        Restituisce una connessione long-lived
+        
+        Args:
+            write: True per operazioni che modificano il DB (usa la
+                   connessione RW sotto lock), False per sola lettura
+        """
+        if write:
+            with self._write_lock:
+                try:
+                    yield self._conn
+                finally:
+                    # Early return senza commit: non lasciare transazioni aperte
+                    if self._conn.in_transaction:
+                        self._conn.rollback()
+        else:
+            conn = getattr(self._local, 'conn', None)
+            if conn is None:
+                conn = self._local.conn = self._open_connection(readonly=True)
+            yield conn
+    
+    def close(self):
+        """Chiude la connessione RW e quella di lettura del thread corrente"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        self._conn.close()
+    
     def init_database(self):
         """Inizializza database con tabelle utenti e sessioni"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Tabella utenti
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                nome TEXT NOT NULL,
-                cognome TEXT NOT NULL,
-                ruolo TEXT NOT NULL CHECK(ruolo IN ('paziente', 'medico', 'admin')),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP
-            )
-        ''')
-        
-        # Tabella sessioni
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                session_token TEXT UNIQUE NOT NULL,
-                expires_at TIMESTAMP NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        ''')
-        
-        # Crea admin di default se non esiste
-        cursor.execute("SELECT COUNT(*) FROM users WHERE ruolo = 'admin'")
-        if cursor.fetchone()[0] == 0:
-            admin_password = self.hash_password('admin123')
+        with self.get_connection(write=True) as conn:
+            cursor = conn.cursor()
+        
+            # Tabella utenti
             cursor.execute('''
-                INSERT INTO users (username, password_hash, nome, cognome, ruolo)
-                VALUES (?, ?, ?, ?, ?)
-            ''', ('admin', admin_password, 'Admin', 'System', 'admin'))
-            print("[AuthDB] ✓ Admin di default creato (username: admin, password: admin123)")
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    nome TEXT NOT NULL,
+                    cognome TEXT NOT NULL,
+                    ruolo TEXT NOT NULL CHECK(ruolo IN ('paziente', 'medico', 'admin')),
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_login TIMESTAMP
+                )
+            ''')
+        
+            # Tabella sessioni
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    session_token TEXT UNIQUE NOT NULL,
+                    expires_at INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                )
+            ''')
+        
+            # Indici hot path: lookup sessione coperto dall'indice (niente
+            # fetch per rowid) e range scan per la pulizia delle scadute
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ix_sessions_expires'")
+            new_indexes = cursor.fetchone() is None
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS ix_sessions_token_expires
+                ON sessions(session_token, expires_at, user_id)
+            ''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS ix_sessions_expires ON sessions(expires_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS ix_users_ruolo_admin ON users(ruolo) WHERE ruolo = 'admin'")
+            if new_indexes:
+                cursor.execute("ANALYZE")
+        
+            # Sessioni create con expires_at testuale (schema precedente): in
+            # SQLite un TEXT è sempre > INTEGER, resterebbero valide per sempre
+            cursor.execute("DELETE FROM sessions WHERE typeof(expires_at) != 'integer'")
+        
+            cursor.execute("SELECT COUNT(*) FROM users WHERE ruolo = 'admin'")
+            needs_admin = cursor.fetchone()[0] == 0
         
-        conn.commit()
-        conn.close()
+            conn.commit()
+        
+        # Crea admin di default se non esiste (hash fuori dal lock di scrittura;
+        # l'INSERT ricontrolla, nel caso un admin sia arrivato nel frattempo)
+        if needs_admin:
+            admin_password = self.hash_password('admin123')
+            with self.get_connection(write=True) as conn:
+                cursor = conn.execute('''
+                    INSERT INTO users (username, password_hash, nome, cognome, ruolo)
+                    SELECT ?, ?, ?, ?, ?
+                    WHERE NOT EXISTS (SELECT 1 FROM users WHERE ruolo = 'admin')
+                ''', ('admin', admin_password, 'Admin', 'System', 'admin'))
+                conn.commit()
+            if cursor.rowcount:
+                print("[AuthDB] ✓ Admin di default creato (username: admin, password: admin123)")
     
     def fix_null_updated_at(self):
         """Fix per utenti con updated_at NULL (creati prima della migrazione)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        # Migrazione one-shot: già eseguita su questo DB in questo processo
+        db_key = str(Path(self.db_path).resolve())
+        if db_key in AuthDB._migrated_dbs:
+            return
         
-        try:
-            # Controlla se colonna updated_at esiste
-            cursor.execute("PRAGMA table_info(users)")
-            columns = [col[1] for col in cursor.fetchall()]
-            
-            if 'updated_at' not in columns:
-                print("[AuthDB] ⚠ Colonna updated_at non presente - esegui migration!")
-                return
-            
-            # Fix utenti con updated_at NULL
-            cursor.execute('''
-                UPDATE users 
-                SET updated_at = COALESCE(created_at, datetime('now'))
-                WHERE updated_at IS NULL
-            ''')
-            
-            fixed = cursor.rowcount
-            if fixed > 0:
+        with self.get_connection(write=True) as conn:
+            cursor = conn.cursor()
+            
+            try:
+                # Controlla se colonna updated_at esiste (probe, non lista colonne)
+                cursor.execute("SELECT 1 FROM pragma_table_info('users') WHERE name = 'updated_at'")
+                if cursor.fetchone() is None:
+                    print("[AuthDB] ⚠ Colonna updated_at non presente - esegui migration!")
+                    return
+            
+                # Indice parziale: contiene solo le righe da fixare, quindi
+                # a migrazione completata il probe sotto costa una lookup
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS ix_users_updated_null
+                    ON users(id) WHERE updated_at IS NULL
+                ''')
+                
+                cursor.execute("SELECT 1 FROM users WHERE updated_at IS NULL LIMIT 1")
+                if cursor.fetchone() is None:
+                    AuthDB._migrated_dbs.add(db_key)
+                    return
+            
+                # Fix utenti con updated_at NULL (un'unica transazione)
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute('''
+                    UPDATE users 
+                    SET updated_at = COALESCE(created_at, datetime('now'))
+                    WHERE updated_at IS NULL
+                ''')
+            
+                fixed = cursor.rowcount
                 conn.commit()
+                AuthDB._migrated_dbs.add(db_key)
                 print(f"[AuthDB] ✓ Fixati {fixed} utenti con updated_at NULL")
         
-        except sqlite3.OperationalError as e:
-            print(f"[AuthDB] ⚠ Errore fix updated_at: {e}")
-        finally:
-            conn.close()
+            except sqlite3.OperationalError as e:
+                print(f"[AuthDB] ⚠ Errore fix updated_at: {e}")
     
     def hash_password(self, password):
-        """Hash password con bcrypt"""
-        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        """Hash password con argon2id (nel thread pool di hashing)"""
+        return _run_in_hash_pool(_argon2_hash, password)
     
     def verify_password(self, password, password_hash):
-        """Verifica password"""
-        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+        """Verifica password: algoritmo scelto dal prefisso dell'hash salvato"""
+        # Encode una sola volta; entrambe le verifiche sono constant-time in C
+        password = password.encode('utf-8') if isinstance(password, str) else password
+        
+        if password_hash.startswith('$argon2'):
+            return _run_in_hash_pool(_argon2_verify, password, password_hash)
+        if password_hash.startswith('$2'):
+            return _run_in_hash_pool(_bcrypt_verify, password, password_hash.encode('ascii'))
+        return False
+    
+    def needs_rehash(self, password_hash):
+        """True se l'hash è bcrypt legacy o argon2 con parametri obsoleti"""
+        return password_hash.startswith('$2') or _PASSWORD_HASHER.check_needs_rehash(password_hash)
     
     def register_user(self, username, password, nome, cognome, ruolo):
         """Registra nuovo utente"""
-        if ruolo not in ['paziente', 'medico', 'admin']:
+        if ruolo not in _RUOLI:
             return {'success': False, 'error': 'Ruolo non valido'}
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        # Hash calcolato fuori dal lock di scrittura (argon2 è volutamente lento)
+        password_hash = self.hash_password(password)
         
-        try:
-            # Verifica username univoco
-            cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-            if cursor.fetchone():
-                return {'success': False, 'error': 'Username già esistente'}
+        with self.get_connection(write=True) as conn:
+            cursor = conn.cursor()
             
-            # Inserisci utente con updated_at
-            password_hash = self.hash_password(password)
-            cursor.execute('''
-                INSERT INTO users (username, password_hash, nome, cognome, ruolo, updated_at)
-                VALUES (?, ?, ?, ?, ?, datetime('now'))
-            ''', (username, password_hash, nome, cognome, ruolo))
+            try:
+                # Inserisci utente con updated_at (l'unicità dello username
+                # è garantita dal vincolo UNIQUE, niente SELECT preventiva)
+                cursor.execute('''
+                    INSERT INTO users (username, password_hash, nome, cognome, ruolo, updated_at)
+                    VALUES (?, ?, ?, ?, ?, datetime('now'))
+                ''', (username, password_hash, nome, cognome, ruolo))
             
-            conn.commit()
-            user_id = cursor.lastrowid
+                conn.commit()
+                user_id = cursor.lastrowid
             
-            return {
-                'success': True,
-                'user_id': user_id,
-                'message': 'Utente registrato con successo'
-            }
+                return {
+                    'success': True,
+                    'user_id': user_id,
+                    'message': 'Utente registrato con successo'
+                }
         
-        except sqlite3.IntegrityError as e:
-            return {'success': False, 'error': f'Errore database: {str(e)}'}
-        finally:
-            conn.close()
+            except sqlite3.IntegrityError as e:
+                if 'users.username' in str(e):
+                    return {'success': False, 'error': 'Username già esistente'}
+                return {'success': False, 'error': f'Errore database: {str(e)}'}
     
     def login(self, username, password):
         """Login utente e crea sessione"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
+        with self.get_connection() as conn:
             # Trova utente
-            cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+            cursor = conn.execute(self.SQL_FIND_USER, (username,))
             user = cursor.fetchone()
+        
+        if not user:
+            return {'success': False, 'error': 'Username o password errati'}
+        
+        # Verifica password (fuori dal lock di scrittura)
+        if not self.verify_password(password, user['password_hash']):
+            return {'success': False, 'error': 'Username o password errati'}
+        
+        # Upgrade trasparente degli hash bcrypt legacy ad argon2
+        new_hash = None
+        if self.needs_rehash(user['password_hash']):
+            new_hash = self.hash_password(password)
+        
+        # Crea sessione (40 minuti)
+        session_token = base64.urlsafe_b64encode(os.urandom(32)).rstrip(b'=').decode('ascii')
+        expires_at = int(time.time()) + SESSION_DURATION
+        
+        with self.get_connection(write=True) as conn:
+            # Tutte le scritture del login in un'unica transazione
+            conn.execute("BEGIN IMMEDIATE")
             
-            if not user:
-                return {'success': False, 'error': 'Username o password errati'}
-            
-            # Verifica password
-            if not self.verify_password(password, user['password_hash']):
-                return {'success': False, 'error': 'Username o password errati'}
-            
-            # Crea sessione (40 minuti)
-            session_token = secrets.token_urlsafe(32)
-            expires_at = datetime.now() + timedelta(minutes=40)
+            if new_hash:
+                conn.execute(self.SQL_REHASH_PASSWORD, (new_hash, user['id']))
             
-            cursor.execute('''
-                INSERT INTO sessions (user_id, session_token, expires_at)
-                VALUES (?, ?, ?)
-            ''', (user['id'], session_token, expires_at))
+            conn.execute(self.SQL_INSERT_SESSION, (user['id'], session_token, expires_at))
             
             # Aggiorna last_login (NON updated_at - solo last_login cambia)
-            cursor.execute('''
-                UPDATE users SET last_login = datetime('now') WHERE id = ?
-            ''', (user['id'],))
+            conn.execute(self.SQL_TOUCH_LAST_LOGIN, (user['id'],))
             
             conn.commit()
             
@@ -184,216 +415,163 @@ class AuthDB:
                     'ruolo': user['ruolo']
                 }
             }
-        
-        finally:
-            conn.close()
     
     def verify_session(self, session_token):
         """Verifica sessione valida"""
         if not session_token:
             return {'success': False, 'error': 'Sessione non presente'}
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        now = time.time()
+        with self._session_cache_lock:
+            cached = self._session_cache.get(session_token)
+            if cached is not None:
+                if cached[0] > now:
+                    self._session_cache.move_to_end(session_token)
+                    return {'success': True, 'user': cached[1]}
+                del self._session_cache[session_token]
         
-        try:
-            cursor.execute('''
-                SELECT s.*, u.id as user_id, u.username, u.nome, u.cognome, u.ruolo
-                FROM sessions s
-                JOIN users u ON s.user_id = u.id
-                WHERE s.session_token = ? AND s.expires_at > datetime('now')
-            ''', (session_token,))
-            
-            session = cursor.fetchone()
-            
-            if not session:
-                return {'success': False, 'error': 'Sessione scaduta o non valida'}
-            
-            return {
-                'success': True,
-                'user': {
-                    'id': session['user_id'],
-                    'username': session['username'],
-                    'nome': session['nome'],
-                    'cognome': session['cognome'],
-                    'ruolo': session['ruolo']
-                }
-            }
+        with self.get_connection() as conn:
+            # Tupla semplice (niente sqlite3.Row): unpack posizionale
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            session = cursor.execute(self.SQL_VERIFY_SESSION, (session_token, int(now))).fetchone()
         
-        finally:
-            conn.close()
+        if not session:
+            return {'success': False, 'error': 'Sessione scaduta o non valida'}
+        
+        expires_at = session[0]
+        user = dict(zip(SESSION_USER_KEYS, session[1:]))
+        
+        with self._session_cache_lock:
+            self._session_cache[session_token] = (min(expires_at, now + SESSION_CACHE_TTL), user)
+            self._session_cache.move_to_end(session_token)
+            while len(self._session_cache) > SESSION_CACHE_MAX:
+                self._session_cache.popitem(last=False)
+        
+        return {'success': True, 'user': user}
+    
+    def invalidate_user_sessions(self, user_ids):
+        """
+        Rimuove dalla cache le sessioni degli utenti modificati/eliminati
+        (anche fuori da AuthDB, es. merge della sincronizzazione utenti)
+        """
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+        with self._session_cache_lock:
+            stale = [token for token, (_, user) in self._session_cache.items() if user['id'] in user_ids]
+            for token in stale:
+                del self._session_cache[token]
     
     def logout(self, session_token):
         """Logout - elimina sessione"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self._session_cache_lock:
+            self._session_cache.pop(session_token, None)
         
-        try:
-            cursor.execute("DELETE FROM sessions WHERE session_token = ?", (session_token,))
+        with self.get_connection(write=True) as conn:
+            conn.execute(self.SQL_DELETE_SESSION, (session_token,))
             conn.commit()
             return {'success': True, 'message': 'Logout effettuato'}
-        finally:
-            conn.close()
     
     def cleanup_expired_sessions(self):
         """Rimuove sessioni scadute"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        now = time.time()
+        with self._session_cache_lock:
+            expired = [token for token, (expires, _) in self._session_cache.items() if expires <= now]
+            for token in expired:
+                del self._session_cache[token]
         
-        try:
-            cursor.execute("DELETE FROM sessions WHERE expires_at < datetime('now')")
-            deleted = cursor.rowcount
-            conn.commit()
-            return {'success': True, 'deleted': deleted}
-        finally:
-            conn.close()
+        # DELETE a blocchi, ognuno in una propria transazione: il lock di
+        # scrittura viene rilasciato tra un blocco e l'altro (login concorrenti)
+        deleted = 0
+        while True:
+            with self.get_connection(write=True) as conn:
+                cursor = conn.execute(self.SQL_DELETE_EXPIRED_BATCH, (int(time.time()), self.CLEANUP_BATCH_SIZE))
+                conn.commit()
+            if cursor.rowcount <= 0:
+                break
+            deleted += cursor.rowcount
+        
+        # Checkpoint del WAL per tenerne limitata la dimensione
+        with self.get_connection(write=True) as conn:
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        
+        return {'success': True, 'deleted': deleted}
     
     # ========== GESTIONE UTENTI (ADMIN) ==========
     
     def get_all_users(self):
         """Ottieni lista tutti utenti (admin only)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                SELECT id, username, nome, cognome, ruolo, created_at, last_login, updated_at
-                FROM users
-                ORDER BY created_at DESC
-            ''')
-            
-            users = []
-            for row in cursor.fetchall():
-                users.append({
-                    'id': row['id'],
-                    'username': row['username'],
-                    'nome': row['nome'],
-                    'cognome': row['cognome'],
-                    'ruolo': row['ruolo'],
-                    'created_at': row['created_at'],
-                    'last_login': row['last_login'],
-                    'updated_at': row['updated_at']
-                })
-            
+        with self.get_connection() as conn:
+            # sqlite3.Row -> dict direttamente, iterando il cursore
+            users = [dict(row) for row in conn.execute(self.SQL_LIST_USERS)]
             return {'success': True, 'users': users}
-        finally:
-            conn.close()
     
     def get_user_by_id(self, user_id):
         """Ottieni utente per ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                SELECT id, username, nome, cognome, ruolo, created_at, last_login, updated_at
-                FROM users WHERE id = ?
-            ''', (user_id,))
-            
-            user = cursor.fetchone()
+        with self.get_connection() as conn:
+            user = conn.execute(self.SQL_GET_USER_BY_ID, (user_id,)).fetchone()
             if not user:
                 return {'success': False, 'error': 'Utente non trovato'}
             
-            return {
-                'success': True,
-                'user': {
-                    'id': user['id'],
-                    'username': user['username'],
-                    'nome': user['nome'],
-                    'cognome': user['cognome'],
-                    'ruolo': user['ruolo'],
-                    'created_at': user['created_at'],
-                    'last_login': user['last_login'],
-                    'updated_at': user['updated_at']
-                }
-            }
-        finally:
-            conn.close()
+            return {'success': True, 'user': dict(user)}
     
     def update_user(self, user_id, nome=None, cognome=None, ruolo=None, new_password=None):
         """Aggiorna utente (admin only)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        # Campi vuoti = non modificati (NULL -> COALESCE mantiene il valore)
+        nome = nome or None
+        cognome = cognome or None
+        ruolo = ruolo or None
         
-        try:
-            updates = []
-            params = []
-            
-            if nome:
-                updates.append("nome = ?")
-                params.append(nome)
-            if cognome:
-                updates.append("cognome = ?")
-                params.append(cognome)
-            if ruolo:
-                if ruolo not in ['paziente', 'medico', 'admin']:
-                    return {'success': False, 'error': 'Ruolo non valido'}
-                updates.append("ruolo = ?")
-                params.append(ruolo)
-            if new_password:
-                updates.append("password_hash = ?")
-                params.append(self.hash_password(new_password))
-            
-            if not updates:
-                return {'success': False, 'error': 'Nessun campo da aggiornare'}
-            
-            # IMPORTANTE: Aggiungi updated_at quando modifichi utente
-            updates.append("updated_at = datetime('now')")
-            
-            params.append(user_id)
-            query = f"UPDATE users SET {', '.join(updates)} WHERE id = ?"
-            
-            cursor.execute(query, params)
+        if ruolo is not None and ruolo not in _RUOLI:
+            return {'success': False, 'error': 'Ruolo non valido'}
+        
+        if not (nome or cognome or ruolo or new_password):
+            return {'success': False, 'error': 'Nessun campo da aggiornare'}
+        
+        # Hash calcolato fuori dal lock di scrittura (argon2 è volutamente lento)
+        password_hash = self.hash_password(new_password) if new_password else None
+        
+        with self.get_connection(write=True) as conn:
+            # IMPORTANTE: updated_at aggiornato a ogni modifica (sync)
+            cursor = conn.execute(self.SQL_UPDATE_USER, (nome, cognome, ruolo, password_hash, user_id))
             conn.commit()
             
             if cursor.rowcount == 0:
                 return {'success': False, 'error': 'Utente non trovato'}
             
+            self.invalidate_user_sessions((user_id,))
+            
             return {'success': True, 'message': 'Utente aggiornato'}
-        
-        finally:
-            conn.close()
     
     def delete_user(self, user_id):
         """Elimina utente (admin only)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            # Non permettere eliminazione ultimo admin
-            cursor.execute("SELECT COUNT(*) FROM users WHERE ruolo = 'admin'")
-            admin_count = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT ruolo FROM users WHERE id = ?", (user_id,))
-            user = cursor.fetchone()
-            
-            if not user:
-                return {'success': False, 'error': 'Utente non trovato'}
+        with self.get_connection(write=True) as conn:
+            # DELETE auto-protetta: non elimina l'ultimo admin
+            cursor = conn.execute(self.SQL_DELETE_USER, (user_id,))
+            conn.commit()
             
-            if user['ruolo'] == 'admin' and admin_count <= 1:
+            if cursor.rowcount == 0:
+                # Distingui "non trovato" da "ultimo admin protetto"
+                user = conn.execute("SELECT ruolo FROM users WHERE id = ?", (user_id,)).fetchone()
+                if not user:
+                    return {'success': False, 'error': 'Utente non trovato'}
                 return {'success': False, 'error': 'Impossibile eliminare ultimo admin'}
             
-            cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-            conn.commit()
+            self.invalidate_user_sessions((user_id,))
             
             return {'success': True, 'message': 'Utente eliminato'}
-        
-        finally:
-            conn.close()
     
     # ========== SYNC SUPPORT ==========
     
     def get_all_users_for_sync(self):
         """Ottieni TUTTI gli utenti con password_hash per sync"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute("SELECT * FROM users")
-            users = [dict(row) for row in cursor.fetchall()]
-            return users
-        finally:
-            conn.close()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None  # tuple semplici, colonne note
+            
+            cursor.execute(self.SQL_SYNC_USERS)
+            return [dict(zip(SYNC_COLUMNS, row)) for row in cursor]
 
 # Test
 if __name__ == '__main__':
@@ -3,6 +3,18 @@ Cloud Dashboard Server for IIT Device Data
 Receives data via MQTT instead of direct board connection
 Con supporto per anomalie ECG, PIEZO e TEMPERATURE + Sistema Notifiche Real-time
 """
+import os
+
+# ====== ASYNC MODE ======
+# Flask-SocketIO: 'threading' (default) oppure 'eventlet' (DASHBOARD_ASYNC_MODE=eventlet).
+# Con eventlet il monkey patching deve avvenire prima di qualunque altro import
+# (paho-mqtt, sqlite3, socketio), così MQTT, I/O e socketio condividono un solo loop.
+ASYNC_MODE = os.environ.get('DASHBOARD_ASYNC_MODE', 'threading')
+if ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+    from eventlet import tpool
+
 import sys
 from flask import Flask, render_template, jsonify, request, redirect, url_for
 from flask_socketio import SocketIO, emit
@@ -12,13 +24,18 @@ from paho.mqtt.client import CallbackAPIVersion
 import threading
 import time
 import secrets
-import os
+import hashlib
 import json
+import mmap
+import gzip
+import heapq
+import queue
+import struct
 from collections import deque
 from datetime import datetime
 from pathlib import Path
-import sqlite3
-from functools import wraps
+from functools import wraps, lru_cache
+import numpy as np
 
 # ====== AUTHENTICATION ======
 from auth_db import AuthDB
@@ -26,6 +43,9 @@ from auth_db import AuthDB
 # ====== DATABASE SYNC ======
 from db_sync_module import DatabaseSyncService, SyncConfig
 
+# ====== SOCKETIO JSON (orjson + NumPy) ======
+import orjson_socketio
+
 # ====== FILE LOG WATCHER ======
 from file_log_watcher import setup_file_log_watcher
 
@@ -33,7 +53,43 @@ from file_log_watcher import setup_file_log_watcher
 from data_loader import SessionDataLoader
 from training_manager import TrainingManager
 import zipfile
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+# flask-compress opzionale: gzip/br delle risposte JSON (altrimenti nginx)
+try:
+    from flask_compress import Compress
+except ImportError:
+    Compress = None
+
+# orjson opzionale: parsing molto più veloce di payload MQTT e file JSON/JSONL
+# (accetta direttamente bytes, senza decode UTF-8 intermedio)
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_loads_buffer = orjson.loads  # accetta anche memoryview (mmap)
+    _json_dumps = orjson.dumps
+except ImportError:
+    _json_loads = json.loads
+    def _json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+    def _json_loads_buffer(buffer):
+        return json.loads(bytes(buffer))
+
+# msgpack opzionale: payload MQTT binari (topic con suffisso /msgpack) e
+# file di sessione {SIGNAL}_data.msgpack (frame con prefisso di lunghezza)
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_TOPIC_SUFFIX = '/msgpack'
+
+# watchdog opzionale: notifiche inotify sui log anomalie al posto del polling
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import PatternMatchingEventHandler, FileSystemEventHandler
+except ImportError:
+    Observer = None
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', secrets.token_hex(32))
@@ -41,12 +97,51 @@ app.config['SESSION_COOKIE_SECURE'] = False
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
+# Compressione delle risposte JSON sopra 1 KB (finestre storiche, summary, sync):
+# algoritmi di default di flask-compress (zstd/br/gzip secondo versione) a livello basso
+app.config['COMPRESS_MIN_SIZE'] = 1024
+app.config['COMPRESS_LEVEL'] = 3
+app.config['COMPRESS_BR_LEVEL'] = 3
+app.config['COMPRESS_ZSTD_LEVEL'] = 3
+GZIP_MIN_SIZE = 1024
+
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+if Compress is not None:
+    Compress(app)
+else:
+    @app.after_request
+    def gzip_json_response(response):
+        """Fallback senza flask-compress: gzip delle risposte JSON sopra GZIP_MIN_SIZE"""
+        if (response.mimetype != 'application/json' or response.status_code != 200
+                or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+            return response
+        data = response.get_data()
+        if len(data) < GZIP_MIN_SIZE:
+            return response
+        response.set_data(gzip.compress(data, compresslevel=3))
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        # Corpo diverso dall'originale: l'ETag diventa weak (come flask-compress)
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE, json=orjson_socketio)
 
 # ====== AUTH DATABASE ======
 auth_db = AuthDB('users.db')
 
+def run_blocking(fn, *args):
+    """
+    Esegue una chiamata bloccante (hash password + scrittura SQLite) fuori
+    dal loop eventlet, su un thread nativo; in threading mode è diretta
+    """
+    if ASYNC_MODE == 'eventlet':
+        return tpool.execute(fn, *args)
+    return fn(*args)
+
 # ====== TRAINING MANAGER ======
 training_manager = TrainingManager('var/iit_data/models')
 
@@ -68,67 +163,414 @@ SYNC_CONFIG = SyncConfig(
 # Sync service global
 sync_service = None
 
+# ====== CLOCK CACHE ======
+# Stringhe data/ora riusate finché non cambia il secondo (ISO) o il minuto
+# (giorno): evita datetime.now() + formattazione a ogni pacchetto/log
+_iso_cache = (0, '')
+_today_cache = (0, '')
+
+def now_iso():
+    """Timestamp ISO corrente, con risoluzione al secondo"""
+    global _iso_cache
+    sec = int(time.time())
+    if sec != _iso_cache[0]:
+        _iso_cache = (sec, datetime.fromtimestamp(sec).isoformat())
+    return _iso_cache[1]
+
+def today_str():
+    """Data corrente YYYYMMDD, ricalcolata al più una volta al minuto"""
+    global _today_cache
+    minute = int(time.time()) // 60
+    if minute != _today_cache[0]:
+        _today_cache = (minute, datetime.now().strftime("%Y%m%d"))
+    return _today_cache[1]
+
 # ====== STORAGE PATHS (same as receiver) ======
 BASE_STORAGE_DIR = Path("./var/iit_data")
 DATA_STORAGE_DIR = BASE_STORAGE_DIR / "data_storage"
 ANOMALY_LOGS_DIR = BASE_STORAGE_DIR / "anomaly_logs"
 
+# Prefisso del nome file dei log anomalie per tipo
+ANOMALY_FILE_PREFIXES = {
+    'ecg': 'anomalies_',
+    'piezo': 'piezo_anomalies_',
+    'temp': 'temp_anomalies_'
+}
+
+def anomaly_log_files(date_str):
+    """File di log anomalie (ECG, PIEZO, TEMP) per una data YYYYMMDD"""
+    return {
+        anomaly_type: ANOMALY_LOGS_DIR / f"{prefix}{date_str}.json"
+        for anomaly_type, prefix in ANOMALY_FILE_PREFIXES.items()
+    }
+
+def load_anomaly_log(file_path):
+    """Carica un log anomalie in formato array JSON (legacy) o JSONL"""
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        # mmap: il parser legge direttamente la page cache, senza copia in un bytes
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:64].lstrip()[:1] == b'[':
+                with memoryview(mm) as view:
+                    anomalies = _json_loads_buffer(view)
+                return anomalies if isinstance(anomalies, list) else []
+            anomalies = []
+            for line in iter(mm.readline, b''):
+                if not line.strip():
+                    continue
+                try:
+                    anomalies.append(_json_loads(line))
+                except ValueError:
+                    # Riga troncata (crash tra write e fsync, append concorrente):
+                    # si salta solo quella, non tutto il giorno
+                    continue
+            return anomalies
+
+def load_anomaly_log_if_exists(file_path):
+    """Come load_anomaly_log, ma restituisce [] se il file non esiste"""
+    try:
+        return load_anomaly_log(file_path)
+    except FileNotFoundError:
+        return []
+
+def count_anomaly_records(file_path):
+    """
+    Conta le anomalie senza costruire gli oggetti: per JSONL è un conteggio
+    di righe non vuote; solo gli array legacy vengono parsati
+    """
+    with open(file_path, 'rb') as f:
+        if not str(file_path).endswith('.jsonl'):
+            head = f.read(64).lstrip()
+            if head[:1] == b'[':
+                f.seek(0)
+                anomalies = _json_loads(f.read())
+                return len(anomalies) if isinstance(anomalies, list) else 0
+            f.seek(0)
+        return sum(1 for line in f if line.strip())
+
+def files_stat_key(files):
+    """(mtime_ns, size) di ogni file (None se assente): cambia a ogni scrittura"""
+    key = []
+    for file_path in files:
+        try:
+            st = os.stat(file_path)
+            key.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            key.append(None)
+    return tuple(key)
+
+# Pool per caricare in parallelo i tre log di una data
+_ANOMALY_POOL = ThreadPoolExecutor(max_workers=3, thread_name_prefix='anomaly-loader')
+
+# Risposte di /api/anomalies/data/<date>: date -> (files_stat_key, dati)
+_anomaly_response_cache = {}
+ANOMALY_RESPONSE_CACHE_MAX = 64
+
+# Pool condiviso per le letture di storage indipendenti (summary, sessioni per data)
+_STORAGE_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix='storage-io')
+
+# Conteggi di /api/anomalies/summary: path -> (mtime_ns, size, count)
+_summary_cache = {}
+_summary_lock = threading.Lock()
+SUMMARY_CACHE_MAX = 1024
+# Date presenti in ANOMALY_LOGS_DIR: (mtime_ns della directory, date)
+_summary_dates_cache = (None, frozenset())
+
+def count_anomaly_log(file_path):
+    """Numero di anomalie in un log, riparsato solo se (mtime, size) è cambiato"""
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        _summary_cache.pop(file_path, None)
+        return 0
+    cached = _summary_cache.get(file_path)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    
+    try:
+        count = count_anomaly_records(file_path)
+    except Exception:
+        count = 0
+    
+    with _summary_lock:
+        if file_path not in _summary_cache and len(_summary_cache) >= SUMMARY_CACHE_MAX:
+            # FIFO: i dict mantengono l'ordine di inserimento
+            _summary_cache.pop(next(iter(_summary_cache)))
+        _summary_cache[file_path] = (st.st_mtime_ns, st.st_size, count)
+    return count
+
+def anomaly_summary_dates():
+    """Date dei log anomalie: indice del watcher, o scansione solo se la directory è cambiata"""
+    global _summary_dates_cache
+    if state.anomaly_date_index is not None:
+        with state.index_lock:
+            return set(state.anomaly_date_index)
+    try:
+        dir_mtime = os.stat(ANOMALY_LOGS_DIR).st_mtime_ns
+    except FileNotFoundError:
+        return set()
+    if _summary_dates_cache[0] != dir_mtime:
+        _summary_dates_cache = (dir_mtime, frozenset(scan_anomaly_date_index()))
+    return set(_summary_dates_cache[1])
+
+# Intervallo minimo tra due data_update verso i client (secondi)
+DATA_EMIT_INTERVAL = 0.1
+# Intervallo minimo tra due status_update (secondi)
+STATUS_MIN_INTERVAL = 0.1
+
 # ====== GLOBAL STATE ======
+class RingBuffer:
+    """
+    Buffer circolare NumPy per i sample real-time (sostituisce deque di dict).
+    
+    I valori sono una matrice (maxlen x canali) preallocata, con i timestamp
+    in un array parallelo: nessun oggetto Python per sample.
+    """
+    __slots__ = ('maxlen', 'dtype', 'values', 'timestamps', 'head', 'count')
+    
+    def __init__(self, maxlen, dtype=np.float32):
+        self.maxlen = maxlen
+        self.dtype = dtype
+        self.values = None  # allocato al primo frame (numero canali noto)
+        self.timestamps = np.empty(maxlen, dtype=np.float64)
+        self.head = 0  # prossima posizione di scrittura, in [0, maxlen)
+        self.count = 0
+    
+    def __len__(self):
+        return self.count
+    
+    def extend(self, frames, timestamp):
+        """Aggiunge un blocco di frame (ognuno lista di valori per canale) con al più due scritture contigue"""
+        arr = np.asarray(frames, dtype=self.dtype)
+        if arr.ndim == 1:
+            arr = arr.reshape(-1, 1)
+        n = arr.shape[0]
+        if n == 0:
+            return
+        
+        if self.values is None or self.values.shape[1] != arr.shape[1]:
+            # Primo blocco o cambio numero canali: rialloca
+            self.values = np.empty((self.maxlen, arr.shape[1]), dtype=self.dtype)
+            self.head = 0
+            self.count = 0
+        
+        if n >= self.maxlen:
+            # Il blocco riempie da solo tutto il buffer
+            self.values[:] = arr[-self.maxlen:]
+            self.timestamps[:] = timestamp
+            self.head = 0
+            self.count = self.maxlen
+            return
+        
+        head = self.head
+        first = min(n, self.maxlen - head)
+        self.values[head:head + first] = arr[:first]
+        self.timestamps[head:head + first] = timestamp
+        if first < n:
+            # Wrap-around: il resto riparte dall'inizio
+            self.values[:n - first] = arr[first:]
+            self.timestamps[:n - first] = timestamp
+        
+        self.head = (head + n) % self.maxlen
+        self.count = min(self.count + n, self.maxlen)
+    
+    def last(self):
+        """Ultimo frame scritto (None se vuoto)"""
+        if self.count == 0:
+            return None
+        return self.values[(self.head - 1) % self.maxlen]
+    
+    def ordered(self):
+        """Valori in ordine cronologico (vista senza copia se il buffer non ha fatto wrap)"""
+        count, head, values = self.count, self.head, self.values
+        if count == 0 or values is None:
+            return np.empty((0, 0), dtype=self.dtype)
+        if count < self.maxlen:
+            return values[:count]
+        return np.concatenate((values[head:], values[:head]))
+
+class SignalStats:
+    """Contatori per segnale: attributi in __slots__ (niente dict annidati nel hot path)"""
+    __slots__ = ('samples', 'last_update', 'current_temp')
+    
+    def __init__(self):
+        self.samples = 0
+        self.last_update = None  # epoch float, formattato in to_dict
+        self.current_temp = None
+    
+    def to_dict(self, with_temp=False):
+        """Forma serializzata per /api/status e status_update"""
+        result = {
+            'samples': self.samples,
+            'last_update': datetime.fromtimestamp(self.last_update).isoformat() if self.last_update is not None else None
+        }
+        if with_temp:
+            result['current_temp'] = self.current_temp
+        return result
+
 class DashboardState:
+    __slots__ = (
+        'is_acquiring', 'device_connected', 'data_queues', 'stats',
+        'start_time', 'packet_count', 'current_session_id',
+        'session_index', 'anomaly_date_index', 'index_lock',
+        'dirty_signals', 'dirty_lock',
+        'anomaly_file_stat', 'last_notification_counts', 'mqtt_connected',
+        'dropped_realtime', 'status_event'
+    )
+    
     def __init__(self):
         self.is_acquiring = False
         self.device_connected = False
+        # TEMP resta float64: pochi sample e valori mostrati così come arrivano
         self.data_queues = {
-            'ECG': deque(maxlen=2500),
-            'ADC': deque(maxlen=2500),
-            'TEMP': deque(maxlen=120)
+            'ECG': RingBuffer(2500),
+            'ADC': RingBuffer(2500),
+            'TEMP': RingBuffer(120, dtype=np.float64)
         }
         self.stats = {
-            'ECG': {'samples': 0, 'last_update': None},
-            'ADC': {'samples': 0, 'last_update': None},
-            'TEMP': {'samples': 0, 'last_update': None, 'current_temp': None}
+            'ECG': SignalStats(),
+            'ADC': SignalStats(),
+            'TEMP': SignalStats()
         }
         self.start_time = None
         self.packet_count = 0
         self.current_session_id = None
         
+        # Indici in memoria dello storage (None finché il watcher non è attivo)
+        self.session_index = None
+        self.anomaly_date_index = None
+        self.index_lock = threading.Lock()
+        
+        # Segnali con nuovi dati non ancora inviati ai client
+        self.dirty_signals = set()
+        self.dirty_lock = threading.Lock()
+        # Impostato quando stats/packet_count cambiano (background_status_updater)
+        self.status_event = threading.Event()
+        
         # Notification tracking - initialize with existing anomaly counts
         # to prevent notification spam on server restart
-        self.last_notification_counts = self._get_initial_anomaly_counts()
+        # anomaly_file_stat: tipo -> (path, mtime_ns, size, offset letto, legacy)
+        self.anomaly_file_stat = {}
+        self.last_notification_counts = {'ecg': 0, 'piezo': 0, 'temp': 0}
+        self._get_initial_anomaly_counts()
         
         # MQTT state
         self.mqtt_connected = False
+        self.dropped_realtime = 0
+    
+    def stats_snapshot(self):
+        """Statistiche per segnale come dict, costruite solo quando vengono serializzate"""
+        return {
+            signal: signal_stats.to_dict(with_temp=(signal == 'TEMP'))
+            for signal, signal_stats in self.stats.items()
+        }
     
     def _get_initial_anomaly_counts(self):
         """Count existing anomalies on startup to avoid re-notifying them"""
-        counts = {'ecg': 0, 'piezo': 0, 'temp': 0}
+        counts = self.last_notification_counts
         
         if not ANOMALY_LOGS_DIR.exists():
             return counts
         
-        today = datetime.now().strftime("%Y%m%d")
-        files = {
-            'ecg': ANOMALY_LOGS_DIR / f"anomalies_{today}.json",
-            'piezo': ANOMALY_LOGS_DIR / f"piezo_anomalies_{today}.json",
-            'temp': ANOMALY_LOGS_DIR / f"temp_anomalies_{today}.json"
-        }
-        
-        for anomaly_type, file_path in files.items():
-            if file_path.exists():
-                try:
-                    with open(file_path, 'r') as f:
-                        anomalies = json.load(f)
-                    counts[anomaly_type] = len(anomalies) if isinstance(anomalies, list) else 0
-                except:
-                    counts[anomaly_type] = 0
+        for anomaly_type, file_path in anomaly_log_files(today_str()).items():
+            try:
+                self.read_new_anomalies(anomaly_type, file_path)
+            except FileNotFoundError:
+                pass
+            except:
+                counts[anomaly_type] = 0
         
         print(f"[Startup] Existing anomalies: ECG={counts['ecg']}, PIEZO={counts['piezo']}, TEMP={counts['temp']}")
         return counts
+    
+    def read_new_anomalies(self, anomaly_type, file_path):
+        """
+        Restituisce le anomalie comparse nel file dall'ultima lettura.
+        
+        Se mtime e dimensione non sono cambiati il file non viene riaperto.
+        Il formato si riconosce sempre dal primo byte del file: per i file
+        JSONL legge solo la coda a partire dall'ultimo offset; per il formato
+        legacy (array JSON) ri-parsa il file intero. Un cambio di formato (es.
+        file_update dal device che riporta il file ad array, o migrazione a
+        JSONL) riparte dall'inizio del file senza rinotificare le anomalie già
+        contate. Solleva FileNotFoundError se il file non esiste.
+        """
+        st = os.stat(file_path)
+        cached = self.anomaly_file_stat.get(anomaly_type)
+        
+        if cached and cached[0] == file_path:
+            if cached[1] == st.st_mtime_ns and cached[2] == st.st_size:
+                return []
+            offset = cached[3]
+            was_legacy = cached[4]
+        else:
+            # Nuovo file (es. cambio giorno): riparte da zero
+            offset = 0
+            was_legacy = None
+            self.last_notification_counts[anomaly_type] = 0
+        
+        if st.st_size < offset:
+            # File riscritto/troncato
+            offset = 0
+            self.last_notification_counts[anomaly_type] = 0
+        
+        with open(file_path, 'rb') as f:
+            legacy = f.read(64).lstrip()[:1] == b'['
+            if legacy or was_legacy:
+                # Array, o JSONL appena migrato da array: file intero
+                offset = 0
+            f.seek(offset)
+            chunk = f.read()
+        
+        last_count = self.last_notification_counts[anomaly_type]
+        
+        if legacy:
+            # Formato legacy: array JSON riscritto a ogni anomalia
+            anomalies = _json_loads(chunk)
+            if not isinstance(anomalies, list):
+                anomalies = []
+            new_anomalies = anomalies[last_count:]
+            self.last_notification_counts[anomaly_type] = len(anomalies)
+        else:
+            # JSONL: consuma solo le righe complete (righe non valide saltate,
+            # così l'offset avanza comunque)
+            end = chunk.rfind(b'\n') + 1
+            records = []
+            for line in chunk[:end].splitlines():
+                if line.strip():
+                    try:
+                        records.append(_json_loads(line))
+                    except ValueError:
+                        continue
+            offset += end
+            if was_legacy:
+                # Dall'array a JSONL: le prime last_count anomalie sono già notificate
+                new_anomalies = records[last_count:]
+                self.last_notification_counts[anomaly_type] = len(records)
+            else:
+                new_anomalies = records
+                self.last_notification_counts[anomaly_type] = last_count + len(new_anomalies)
+        
+        self.anomaly_file_stat[anomaly_type] = (file_path, st.st_mtime_ns, st.st_size, offset, legacy)
+        return new_anomalies
         
 state = DashboardState()
 
 # ====== SYSTEM LOGGING ======
-system_logs = deque(maxlen=1000)  # Keep last 1000 log entries in memory
+SYSTEM_LOGS_MAX = 1000
+system_logs = deque(maxlen=SYSTEM_LOGS_MAX)  # Keep last 1000 log entries in memory
+# Deque parallele per categoria e per livello: i filtri leggono solo la coda
+# che interessa invece di scartare le altre voci
+system_logs_by_category = {}
+system_logs_by_level = {}
+system_logs_lock = threading.Lock()
+
+# Log in attesa di essere inviati ai client (coda limitata: sotto flood i
+# log in eccesso non vengono inviati ma restano in system_logs)
+LOG_EMIT_INTERVAL = 0.1
+LOG_BATCH_SIZE = 100
+pending_logs = queue.Queue(maxsize=LOG_BATCH_SIZE * 10)
 
 def add_system_log(category, message, level='INFO'):
     """
@@ -139,20 +581,97 @@ def add_system_log(category, message, level='INFO'):
         message: Log message
         level: Log level (INFO, WARNING, ERROR, DEBUG)
     """
-    log_entry = {
-        'timestamp': datetime.now().isoformat(),
+    add_system_logs([(category, message, level)])
+
+def add_system_logs(entries):
+    """
+    Add several system log entries with a single lock acquisition
+    
+    Args:
+        entries: Iterable of (category, message, level) tuples
+    """
+    timestamp = now_iso()
+    log_entries = [{
+        'timestamp': timestamp,
         'category': category,
         'level': level,
         'message': message
-    }
-    
-    system_logs.append(log_entry)
-    
-    # Emit to all connected clients
+    } for category, message, level in entries]
+    
+    with system_logs_lock:
+        for log_entry in log_entries:
+            system_logs.append(log_entry)
+            category, level = log_entry['category'], log_entry['level']
+            by_category = system_logs_by_category.get(category)
+            if by_category is None:
+                by_category = system_logs_by_category[category] = deque(maxlen=SYSTEM_LOGS_MAX)
+            by_category.append(log_entry)
+            by_level = system_logs_by_level.get(level)
+            if by_level is None:
+                by_level = system_logs_by_level[level] = deque(maxlen=SYSTEM_LOGS_MAX)
+            by_level.append(log_entry)
+    
+    # Emit to connected clients in batches (background_log_emitter)
+    for log_entry in log_entries:
+        try:
+            pending_logs.put_nowait(log_entry)
+        except queue.Full:
+            break
+
+def tail_filter_logs(category='', level='', limit=None):
+    """
+    Ultimi `limit` log (tutti se None) filtrati per categoria/livello, in
+    ordine cronologico: scansione a ritroso che si ferma appena raggiunto limit
+    """
+    with system_logs_lock:
+        if category:
+            source = system_logs_by_category.get(category, ())
+        elif level:
+            source = system_logs_by_level.get(level, ())
+        else:
+            source = system_logs
+        
+        if limit is not None and limit <= 0:
+            limit = None  # come lo slicing [-0:] precedente: nessun limite
+        out = []
+        for log in reversed(source):
+            if level and log['level'] != level:
+                continue
+            out.append(log)
+            if limit is not None and len(out) >= limit:
+                break
+    out.reverse()
+    return out
+
+def has_data_clients():
+    """True se almeno un client è connesso al namespace /data"""
     try:
-        socketio.emit('system_log', log_entry, namespace='/data')
-    except Exception as e:
-        print(f"[Logging] Error emitting log: {e}")
+        return bool(socketio.server.manager.rooms.get('/data'))
+    except AttributeError:
+        return True  # server non ancora inizializzato: comportamento conservativo
+
+def background_log_emitter():
+    """Invia i log accumulati come un unico evento system_log_batch (max 10 Hz)"""
+    while True:
+        socketio.sleep(LOG_EMIT_INTERVAL)
+        if pending_logs.empty():
+            continue
+        
+        batch = []
+        while len(batch) < LOG_BATCH_SIZE:
+            try:
+                batch.append(pending_logs.get_nowait())
+            except queue.Empty:
+                break
+        
+        # Nessun client in ascolto: i log restano comunque in system_logs
+        if not has_data_clients():
+            continue
+        
+        try:
+            socketio.emit('system_log_batch', batch, namespace='/data')
+        except Exception as e:
+            print(f"[Logging] Error emitting logs: {e}")
 
 # ====== MQTT CLIENT ======
 mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=MQTT_CLIENT_ID)
@@ -176,6 +695,15 @@ def on_mqtt_connect(client, userdata, flags, reason_code, properties):
             ('iit/device/status', 1),
         ]
         
+        # Varianti MessagePack degli stessi topic (solo se msgpack è installato)
+        if msgpack is not None:
+            topics += [
+                ('iit/device/+/realtime/+/msgpack', 1),
+                ('iit/device/+/anomalies/+/msgpack', 1),
+                ('iit/device/realtime/+/msgpack', 1),
+                ('iit/device/anomalies/+/msgpack', 1),
+            ]
+        
         for topic, qos in topics:
             client.subscribe(topic, qos)
             print(f"[MQTT] Subscribed to: {topic}")
@@ -193,33 +721,74 @@ def on_mqtt_disconnect(client, userdata, flags, reason_code, properties):
         print(f"[MQTT] Unexpected disconnection (code: {reason_code})")
         add_system_log('MQTT', f'Unexpected disconnection (code: {reason_code})', 'WARNING')
 
+_UTF8_BOM = b'\xef\xbb\xbf'
+
+def decode_mqtt_payload(raw, topic):
+    """Decodifica il payload MQTT: MessagePack se il topic termina con /msgpack, altrimenti JSON"""
+    if topic.endswith(MSGPACK_TOPIC_SUFFIX):
+        return msgpack.unpackb(raw, raw=False)
+    # BOM UTF-8 accettato da json.loads ma non da orjson: rimosso per entrambi
+    return _json_loads(raw.removeprefix(_UTF8_BOM))
+
+# Coda di ingresso MQTT: il thread di rete paho si limita ad accodare
+# (topic, payload) senza parsing; un solo worker decodifica e smista.
+# Con eventlet il thread paho è un green thread: LightQueue fa attendere il
+# worker sull'hub (nessun polling), SimpleQueue.get() lo bloccherebbe
+if ASYNC_MODE == 'eventlet':
+    import eventlet.queue
+    _INGRESS = eventlet.queue.LightQueue()
+else:
+    _INGRESS = queue.SimpleQueue()
+INGRESS_MAX = 10000
+
 def on_mqtt_message(client, userdata, msg):
-    """Main MQTT message handler"""
+    """Main MQTT message handler (thread paho: solo accodamento)"""
+    _INGRESS.put_nowait((msg.topic, msg.payload))
+
+def dispatch_mqtt_message(topic, raw):
+    """Instrada un messaggio MQTT sull'handler corrispondente"""
     try:
-        payload = json.loads(msg.payload.decode())
-        topic = msg.topic
-        
-        # Route messages
-        if '/realtime/' in topic:
-            handle_realtime_data(payload, topic)
-        elif '/anomalies/' in topic:
-            handle_anomaly_data(payload, topic)
-        elif '/session' in topic:
-            handle_session_event(payload)
-        elif '/status' in topic:
-            handle_device_status(payload)
+        # Route on the topic first: only the matched branch is decoded
+        for marker, handler in MQTT_ROUTES:
+            if marker in topic:
+                break
+        else:
+            return
+        
+        if handler is handle_realtime_data:
+            # Coda oltre soglia: si scartano i realtime più vecchi (semantica
+            # QoS 0); anomalie ed eventi di sessione non vengono mai scartati
+            if _INGRESS.qsize() > INGRESS_MAX:
+                state.dropped_realtime += 1
+                return
+            if (raw.removeprefix(_UTF8_BOM).lstrip()[:1] != b'{'
+                    and not topic.endswith(MSGPACK_TOPIC_SUFFIX)):
+                return  # non è un oggetto JSON (spazi/BOM iniziali ammessi): niente parsing
+        
+        handler(decode_mqtt_payload(raw, topic), topic)
             
     except Exception as e:
         print(f"[MQTT] Error processing message: {e}")
 
+def ingress_worker():
+    """Consuma la coda di ingresso MQTT (avviato con socketio.start_background_task)"""
+    while True:
+        topic, raw = _INGRESS.get()
+        dispatch_mqtt_message(topic, raw)
+        if state.dropped_realtime and _INGRESS.qsize() == 0:
+            print(f"[MQTT] Ingress backlog drained, dropped {state.dropped_realtime} realtime messages")
+            state.dropped_realtime = 0
+
 def handle_realtime_data(payload, topic):
     """Handle real-time data from MQTT"""
     try:
         signal = payload.get('signal')
         frames = payload.get('frames', [])
-        timestamp = payload.get('timestamp')
+        # Il publisher può aggregare N frame per messaggio (~16 KB) con 'ts'
+        # come timestamp del batch: il batch è scritto nel buffer in un colpo solo
+        timestamp = payload.get('timestamp', payload.get('ts'))
         
-        if not signal or signal not in ['ECG', 'ADC', 'TEMP']:
+        if not signal or signal not in ['ECG', 'ADC', 'TEMP'] or not frames:
             return
         
         # Push data to queues (same as local dashboard)
@@ -231,14 +800,14 @@ def handle_realtime_data(payload, topic):
 def handle_anomaly_data(payload, topic):
     """Handle anomaly detection results from MQTT"""
     try:
-        # Determine anomaly type from topic or payload
-        if '/ecg' in topic.lower() or payload.get('anomaly_type', '').upper() == 'ECG':
-            anomaly_type = 'ecg'
-        elif '/piezo' in topic.lower() or payload.get('anomaly_type', '').upper() == 'PIEZO':
-            anomaly_type = 'piezo'
-        elif '/temp' in topic.lower() or payload.get('anomaly_type', '').upper() == 'TEMP':
-            anomaly_type = 'temp'
-        else:
+        # Determine anomaly type from the last topic segment
+        # (iit/device/<id>/anomalies/<type>[/msgpack]) or from the payload
+        if topic.endswith(MSGPACK_TOPIC_SUFFIX):
+            topic = topic[:-len(MSGPACK_TOPIC_SUFFIX)]
+        anomaly_type = ANOMALY_TOPIC_TYPES.get(topic.rsplit('/', 1)[-1])
+        if anomaly_type is None:
+            anomaly_type = ANOMALY_TOPIC_TYPES.get(payload.get('anomaly_type', ''))
+        if anomaly_type is None:
             print(f"[MQTT] Unknown anomaly type in topic: {topic}")
             return
         
@@ -248,7 +817,7 @@ def handle_anomaly_data(payload, topic):
     except Exception as e:
         print(f"[MQTT] Error handling anomaly: {e}")
 
-def handle_session_event(payload):
+def handle_session_event(payload, topic=None):
     """Handle session start/end events"""
     try:
         event = payload.get('event')
@@ -269,7 +838,7 @@ def handle_session_event(payload):
     except Exception as e:
         print(f"[MQTT] Error handling session event: {e}")
 
-def handle_device_status(payload):
+def handle_device_status(payload, topic=None):
     """Handle device status updates"""
     try:
         status = payload.get('status')
@@ -289,8 +858,40 @@ mqtt_client.on_connect = on_mqtt_connect
 mqtt_client.on_disconnect = on_mqtt_disconnect
 mqtt_client.on_message = on_mqtt_message
 
+# Ultimo segmento del topic anomalie (o anomaly_type del payload) -> tipo
+ANOMALY_TOPIC_TYPES = {
+    'ecg': 'ecg', 'ECG': 'ecg',
+    'piezo': 'piezo', 'PIEZO': 'piezo',
+    'temp': 'temp', 'TEMP': 'temp'
+}
+
+# Topic router: (sottostringa del topic, handler), nell'ordine di priorità
+MQTT_ROUTES = (
+    ('/realtime/', handle_realtime_data),
+    ('/anomalies/', handle_anomaly_data),
+    ('/session', handle_session_event),
+    ('/status', handle_device_status),
+)
+
 # ====== NOTIFICATION SYSTEM ======
 
+def _validate_temp_anomaly(anomaly_data):
+    """Anomalia TEMP valida: temperatura e soglia presenti e non nulle"""
+    return bool(anomaly_data.get('temperature', 0)) and bool(anomaly_data.get('threshold', 0))
+
+def _validate_recon_anomaly(anomaly_data):
+    """Anomalia ECG/PIEZO valida: errore di ricostruzione e soglia presenti e non nulli"""
+    reconstruction_error = anomaly_data.get('reconstruction_error', 0)
+    if reconstruction_error is None or reconstruction_error == 0:
+        return False
+    return bool(anomaly_data.get('threshold', 0))
+
+ANOMALY_VALIDATORS = {
+    'temp': _validate_temp_anomaly,
+    'ecg': _validate_recon_anomaly,
+    'piezo': _validate_recon_anomaly
+}
+
 def send_anomaly_notification(anomaly_type: str, anomaly_data: dict):
     """
     Invia notifica real-time quando viene rilevata una nuova anomalia
@@ -299,55 +900,29 @@ def send_anomaly_notification(anomaly_type: str, anomaly_data: dict):
         anomaly_type: 'ecg', 'piezo', o 'temp'
         anomaly_data: Dati dell'anomalia
     """
-    # VALIDATION: Filter out invalid anomalies
-    if anomaly_type == 'temp':
-        temperature = anomaly_data.get('temperature', 0)
-        threshold = anomaly_data.get('threshold', 0)
-        
-        # Reject if temperature is 0, None, or missing
-        if not temperature or temperature == 0:
-            print(f"[Notification] REJECTED invalid TEMP anomaly - temperature: {temperature}")
-            return
-        
-        # Reject if threshold is 0, None, or missing
-        if not threshold or threshold == 0:
-            print(f"[Notification] REJECTED invalid TEMP anomaly - threshold: {threshold}")
-            return
-        
-        print(f"[Notification] VALIDATED TEMP anomaly - temp: {temperature}°C, threshold: {threshold}°C")
-    
-    elif anomaly_type in ['ecg', 'piezo']:
-        reconstruction_error = anomaly_data.get('reconstruction_error', 0)
-        threshold = anomaly_data.get('threshold', 0)
-        
-        # Reject if reconstruction_error is 0, None, or missing
-        if reconstruction_error is None or reconstruction_error == 0:
-            print(f"[Notification] REJECTED invalid {anomaly_type.upper()} anomaly - reconstruction_error: {reconstruction_error}")
-            return
-        
-        # Reject if threshold is 0, None, or missing
-        if not threshold or threshold == 0:
-            print(f"[Notification] REJECTED invalid {anomaly_type.upper()} anomaly - threshold: {threshold}")
-            return
-        
-        print(f"[Notification] VALIDATED {anomaly_type.upper()} anomaly - error: {reconstruction_error}, threshold: {threshold}")
+    # VALIDATION: Filter out invalid anomalies (silenziosamente: arrivano a raffiche)
+    validator = ANOMALY_VALIDATORS.get(anomaly_type)
+    if validator is not None and not validator(anomaly_data):
+        return
     
     notification = {
         'type': anomaly_type,
-        'timestamp': datetime.now().isoformat(),
+        'timestamp': now_iso(),
         'data': anomaly_data
     }
     
     print(f"[Notification] Sending {anomaly_type.upper()} notification to /data namespace")
-    print(f"[Notification] Data: {notification}")
     
-    # Invia via SocketIO a tutti i client connessi
+    # Invia via SocketIO a tutti i client connessi (una sola volta: i client
+    # sono tutti sul namespace /data)
     socketio.emit('new_anomaly', notification, namespace='/data')
-    socketio.emit('new_anomaly', notification)
-    
-    print(f"[Notification] Notification sent successfully")
 
 
+# Impostato dal watcher quando cambia un log anomalie del giorno corrente
+anomaly_event = threading.Event()
+ANOMALY_POLL_INTERVAL = 3     # senza watchdog
+ANOMALY_RESYNC_INTERVAL = 30  # con watchdog: rilettura di sicurezza (eventi persi)
+
 def check_for_new_anomalies():
     """
     Controlla periodicamente i file di log per nuove anomalie
@@ -356,38 +931,125 @@ def check_for_new_anomalies():
     if not ANOMALY_LOGS_DIR.exists():
         return
     
-    today = datetime.now().strftime("%Y%m%d")
+    # File da monitorare (saltati senza I/O se mtime/size invariati)
+    for anomaly_type, file_path in anomaly_log_files(today_str()).items():
+        notify_new_anomalies(anomaly_type, file_path)
+
+def notify_new_anomalies(anomaly_type, file_path):
+    """Invia una notifica per ogni anomalia comparsa nel file dall'ultima lettura"""
+    try:
+        new_anomalies = state.read_new_anomalies(anomaly_type, file_path)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        app.logger.error(f"Error checking {anomaly_type} anomalies: {str(e)}")
+        return
     
-    # File da monitorare
-    files_to_check = {
-        'ecg': ANOMALY_LOGS_DIR / f"anomalies_{today}.json",
-        'piezo': ANOMALY_LOGS_DIR / f"piezo_anomalies_{today}.json",
-        'temp': ANOMALY_LOGS_DIR / f"temp_anomalies_{today}.json"
-    }
+    for anomaly in new_anomalies:
+        send_anomaly_notification(anomaly_type, anomaly)
+
+def anomaly_type_from_filename(filename):
+    """Ricava il tipo di anomalia dal nome del file di log"""
+    for anomaly_type, prefix in ANOMALY_FILE_PREFIXES.items():
+        if filename.startswith(prefix):
+            return anomaly_type
+    return None
+
+def anomaly_date_from_filename(filename):
+    """Data YYYYMMDD di un file di log anomalie (None se il nome non è valido)"""
+    anomaly_type = anomaly_type_from_filename(filename)
+    if anomaly_type is None or not filename.endswith('.json'):
+        return None
+    date_str = filename[len(ANOMALY_FILE_PREFIXES[anomaly_type]):-len('.json')]
+    if len(date_str) == 8 and date_str.isdigit():
+        return date_str
+    return None
+
+def start_storage_watcher():
+    """
+    Avvia un watcher inotify (watchdog) sulle directory di storage.
     
-    for anomaly_type, file_path in files_to_check.items():
-        if not file_path.exists():
-            continue
+    - log anomalie: notifiche per le anomalie scritte da altri processi
+      (receiver; le notifiche real-time arrivano già via MQTT in
+      handle_anomaly_data) e aggiornamento dell'indice delle date
+    - sessioni: aggiornamento dell'indice in memoria a ogni metadata.json
+    
+    Restituisce None se watchdog non è installato.
+    """
+    if Observer is None:
+        return None
+    
+    class AnomalyLogHandler(PatternMatchingEventHandler):
+        def __init__(self):
+            super().__init__(
+                patterns=['*anomalies_*.json'],
+                ignore_directories=True
+            )
         
-        try:
-            with open(file_path, 'r') as f:
-                anomalies = json.load(f)
-            
-            current_count = len(anomalies) if isinstance(anomalies, list) else 0
-            last_count = state.last_notification_counts[anomaly_type]
-            
-            # Se ci sono nuove anomalie
-            if current_count > last_count:
-                # Invia notifica per ogni nuova anomalia
-                for i in range(last_count, current_count):
-                    anomaly = anomalies[i]
-                    send_anomaly_notification(anomaly_type, anomaly)
-                
-                # Aggiorna contatore
-                state.last_notification_counts[anomaly_type] = current_count
-                
-        except Exception as e:
-            app.logger.error(f"Error checking {anomaly_type} anomalies: {str(e)}")
+        def _handle(self, path):
+            file_path = Path(path)
+            anomaly_type = anomaly_type_from_filename(file_path.name)
+            if anomaly_type is None:
+                return
+            # Solo il file del giorno corrente genera notifiche: la lettura
+            # avviene in background_anomaly_checker, non nel thread del watcher
+            today_file = anomaly_log_files(today_str())[anomaly_type]
+            if file_path.name != today_file.name:
+                return
+            anomaly_event.set()
+        
+        def on_created(self, event):
+            refresh_anomaly_date_index(os.path.basename(event.src_path))
+            self._handle(event.src_path)
+        
+        def on_modified(self, event):
+            self._handle(event.src_path)
+        
+        def on_moved(self, event):
+            refresh_anomaly_date_index(os.path.basename(event.src_path))
+            refresh_anomaly_date_index(os.path.basename(event.dest_path))
+            self._handle(event.dest_path)
+        
+        def on_deleted(self, event):
+            refresh_anomaly_date_index(os.path.basename(event.src_path))
+    
+    class SessionIndexHandler(FileSystemEventHandler):
+        @staticmethod
+        def _parts(path):
+            # data_storage/<date>/<session_id>/metadata.json
+            return Path(os.path.relpath(os.path.abspath(path), DATA_STORAGE_DIR.resolve())).parts
+        
+        def _refresh(self, path):
+            parts = self._parts(path)
+            if len(parts) == 3 and parts[2] == 'metadata.json':
+                refresh_session_index(parts[0], parts[1])
+        
+        def _remove(self, path):
+            parts = self._parts(path)
+            if len(parts) == 1:
+                remove_date_from_session_index(parts[0])
+            elif len(parts) == 2 or (len(parts) == 3 and parts[2] == 'metadata.json'):
+                refresh_session_index(parts[0], parts[1])
+        
+        def on_created(self, event):
+            self._refresh(event.src_path)
+        
+        def on_modified(self, event):
+            self._refresh(event.src_path)
+        
+        def on_moved(self, event):
+            self._remove(event.src_path)
+            self._refresh(event.dest_path)
+        
+        def on_deleted(self, event):
+            self._remove(event.src_path)
+    
+    observer = Observer()
+    observer.daemon = True
+    observer.schedule(AnomalyLogHandler(), str(ANOMALY_LOGS_DIR), recursive=False)
+    observer.schedule(SessionIndexHandler(), str(DATA_STORAGE_DIR), recursive=True)
+    observer.start()
+    return observer
 
 
 # ====== VALIDAZIONE INPUT ======
@@ -397,8 +1059,9 @@ def validate_signal_name(signal):
     allowed_signals = ['ECG', 'ADC', 'TEMP']
     return signal in allowed_signals
 
+@lru_cache(maxsize=4096)
 def validate_session_id(session_id):
-    """Valida il formato del session ID"""
+    """Valida il formato del session ID (memoizzata: pochi ID ricorrenti)"""
     if not session_id or len(session_id) != 15:
         return False
     try:
@@ -407,8 +1070,9 @@ def validate_session_id(session_id):
     except:
         return False
 
+@lru_cache(maxsize=4096)
 def validate_date_string(date_str):
-    """Valida il formato della data"""
+    """Valida il formato della data (memoizzata: poche date ricorrenti)"""
     if not date_str or len(date_str) != 8:
         return False
     try:
@@ -424,84 +1088,111 @@ def push_data(signal_name, frames, timestamp=None):
     if not validate_signal_name(signal_name):
         return
     
-    for frame in frames:
-        state.data_queues[signal_name].append({
-            'values': frame,
-            'timestamp': timestamp or time.time()
-        })
+    buffer = state.data_queues[signal_name]
+    buffer.extend(frames, timestamp or time.time())
     
-    state.stats[signal_name]['samples'] += len(frames)
-    state.stats[signal_name]['last_update'] = datetime.now().isoformat()
+    signal_stats = state.stats[signal_name]
+    signal_stats.samples += len(frames)
+    signal_stats.last_update = time.time()
     
     if signal_name == 'TEMP' and frames:
-        state.stats[signal_name]['current_temp'] = frames[-1][0]
+        signal_stats.current_temp = float(buffer.last()[0])
     
     state.packet_count += 1
     
-    # Send updates to clients every 5 packets
-    if state.packet_count % 5 == 0:
-        socketio.emit('data_update', {
-            'signal': signal_name,
-            'data': prepare_chart_data(signal_name)
-        }, namespace='/data')
+    # L'invio ai client è delegato a background_data_emitter / background_status_updater
+    with state.dirty_lock:
+        state.dirty_signals.add(signal_name)
+    state.status_event.set()
 
 def prepare_chart_data(signal_name, max_points=1000):
     """Prepara i dati per il grafico con downsampling intelligente"""
     if not validate_signal_name(signal_name):
         return {'x': [], 'y': []}
     
-    data = list(state.data_queues[signal_name])
+    data = state.data_queues[signal_name].ordered()
     
     if len(data) == 0:
         return {'x': [], 'y': []}
     
-    # Downsampling se necessario
+    # Downsampling se necessario (slicing NumPy, nessuna copia)
     if len(data) > max_points:
         step = len(data) // max_points
         data = data[::step]
     
+    # Array NumPy serializzati direttamente da orjson_socketio (devono
+    # essere C-contigui: la copia è un'unica operazione C)
     if signal_name == 'TEMP':
         return {
-            'x': list(range(len(data))),
-            'y': [[d['values'][0]] for d in data]
+            'x': np.arange(len(data)),
+            'y': np.ascontiguousarray(data[:, :1])
         }
     else:
-        num_channels = len(data[0]['values']) if data else 0
-        y_data = [[] for _ in range(num_channels)]
-        
-        for point in data:
-            for ch in range(num_channels):
-                y_data[ch].append(point['values'][ch])
-        
+        # Trasposizione canali in un'unica operazione C
         return {
-            'x': list(range(len(data))),
-            'y': y_data
+            'x': np.arange(len(data)),
+            'y': np.ascontiguousarray(data.T)
         }
 
 # ====== STORAGE FUNCTIONS (read from receiver's storage) ======
 
+def iter_msgpack_frames(f):
+    """Legge i sample da un file di frame MessagePack (4 byte big-endian di lunghezza + frame)"""
+    while True:
+        header = f.read(4)
+        if len(header) < 4:
+            return
+        (size,) = struct.unpack('>I', header)
+        frame = f.read(size)
+        if len(frame) < size:
+            return  # frame troncato (scrittura in corso)
+        yield msgpack.unpackb(frame, raw=False)
+
+def session_data_file(session_id, signal):
+    """
+    File dati di una sessione: {SIGNAL}_data.msgpack se presente (e msgpack
+    installato), altrimenti {SIGNAL}_data.jsonl. None se nessuno dei due esiste.
+    """
+    date_part = session_id.split('_')[0]
+    session_dir = DATA_STORAGE_DIR / date_part / session_id
+    
+    if not session_dir.exists():
+        print(f"[Storage] Session dir not found: {session_dir}")
+        return None
+    
+    # Formato binario (se presente) con fallback al JSONL esistente
+    msgpack_file = session_dir / f"{signal.upper()}_data.msgpack"
+    if msgpack is not None and msgpack_file.exists():
+        return msgpack_file
+    
+    # FIX: Nome file corretto - MAIUSCOLO e .jsonl
+    data_file = session_dir / f"{signal.upper()}_data.jsonl"
+    
+    if not data_file.exists():
+        print(f"[Storage] Data file not found: {data_file}")
+        return None
+    
+    return data_file
+
+def iter_session_samples(data_file):
+    """Itera i sample (dict {timestamp, values} o liste) di un file dati di sessione"""
+    with open(data_file, 'rb') as f:
+        if data_file.suffix == '.msgpack':
+            yield from iter_msgpack_frames(f)
+        else:
+            # Leggi JSONL (una riga = un sample)
+            for line in f:
+                if line.strip():
+                    yield _json_loads(line)
+
 def load_session_data(session_id, signal, limit=None):
     """Load session data from storage"""
     try:
-        date_part = session_id.split('_')[0]
-        session_dir = DATA_STORAGE_DIR / date_part / session_id
-        
-        if not session_dir.exists():
-            print(f"[Storage] Session dir not found: {session_dir}")
-            return []
-        
-        # FIX: Nome file corretto - MAIUSCOLO e .jsonl
-        data_file = session_dir / f"{signal.upper()}_data.jsonl"
-        
-        if not data_file.exists():
-            print(f"[Storage] Data file not found: {data_file}")
+        data_file = session_data_file(session_id, signal)
+        if data_file is None:
             return []
         
-        # Leggi JSONL (una riga = un sample)
-        data = []
-        with open(data_file, 'r') as f:
-            for line in f:
-                data.append(json.loads(line.strip()))
+        data = list(iter_session_samples(data_file))
         
         print(f"[Storage] Loaded {len(data)} samples from {data_file}")
         
@@ -512,41 +1203,183 @@ def load_session_data(session_id, signal, limit=None):
     except Exception as e:
         print(f"[Storage] Error loading session data: {e}")
         return []
+
+def load_session_array(session_id, signal, limit=None):
+    """
+    Come load_session_data, ma scrive i valori in streaming in un array NumPy
+    (campioni x canali) preallocato: nessuna lista intermedia di sample.
+    """
+    dtype = np.float64 if signal.upper() == 'TEMP' else np.float32
+    empty = np.empty((0, 0), dtype=dtype)
     
-def get_available_sessions():
-    """Get list of available sessions from storage"""
-    sessions = []
-    
-    if not DATA_STORAGE_DIR.exists():
-        return sessions
-    
-    # Iterate through date directories
-    for date_dir in sorted(DATA_STORAGE_DIR.iterdir(), reverse=True):
-        if not date_dir.is_dir():
-            continue
+    try:
+        data_file = session_data_file(session_id, signal)
+        if data_file is None:
+            return empty
         
-        # Iterate through session directories
-        for session_dir in sorted(date_dir.iterdir(), reverse=True):
-            if not session_dir.is_dir():
-                continue
+        file_size = data_file.stat().st_size
+        arr = None
+        n = 0
+        
+        for sample in iter_session_samples(data_file):
+            values = sample['values'] if isinstance(sample, dict) else sample
             
-            session_id = session_dir.name
-            metadata_file = session_dir / "metadata.json"
+            if arr is None:
+                # Righe stimate da dimensione file / dimensione del primo sample
+                n_channels = len(values) if isinstance(values, list) else 1
+                sample_bytes = max(len(_json_dumps(sample)), 1)
+                capacity = limit or (file_size // sample_bytes + 16)
+                arr = np.empty((capacity, n_channels), dtype=dtype)
+            elif n == len(arr):
+                if limit:
+                    break
+                arr = np.resize(arr, (len(arr) * 2, arr.shape[1]))
             
-            if metadata_file.exists():
-                try:
-                    with open(metadata_file, 'r') as f:
-                        metadata = json.load(f)
-                    
-                    sessions.append({
-                        'session_id': session_id,
-                        'date': date_dir.name,
-                        'metadata': metadata
-                    })
-                except:
-                    pass
+            arr[n] = values
+            n += 1
+        
+        if arr is None:
+            return empty
+        
+        print(f"[Storage] Loaded {n} samples from {data_file}")
+        return arr[:n]
+    except Exception as e:
+        print(f"[Storage] Error loading session data: {e}")
+        return empty
+    
+# Array di sessione per /api/history/window: (session_id, signal) -> (stat, colonne)
+_session_array_cache = {}
+_session_array_lock = threading.Lock()
+SESSION_ARRAY_CACHE_MAX = 8
+
+def get_session_array_cached(session_id, signal):
+    """
+    load_session_array con cache, in layout colonnare (canali x campioni):
+    ogni canale è contiguo, quindi la finestra di un canale è una vista senza
+    copie. Lo scorrimento della finestra non rilegge il file; l'array viene
+    ricaricato solo se (mtime, size) del file cambia
+    """
+    data_file = session_data_file(session_id, signal)
+    if data_file is None:
+        return np.ascontiguousarray(load_session_array(session_id, signal).T)
+    
+    key = (session_id, signal.upper())
+    stat_key = files_stat_key((data_file,))
+    cached = _session_array_cache.get(key)
+    if cached is not None and cached[0] == stat_key:
+        return cached[1]
+    
+    arr = np.ascontiguousarray(load_session_array(session_id, signal).T)
+    with _session_array_lock:
+        _session_array_cache.pop(key, None)
+        if len(_session_array_cache) >= SESSION_ARRAY_CACHE_MAX:
+            _session_array_cache.pop(next(iter(_session_array_cache)))
+        _session_array_cache[key] = (stat_key, arr)
+    return arr
+
+# ====== STORAGE INDEX ======
+# Sessioni e date con anomalie tenute in memoria e aggiornate dal watcher
+# (start_storage_watcher). Senza watchdog gli indici restano None e le API
+# riscandiscono il disco a ogni richiesta.
+
+def format_session_entry(session_id, date, metadata):
+    """Voce di /api/history/sessions a partire dal metadata.json"""
+    return {
+        'session_id': session_id,
+        'date': date,
+        'start_time': metadata.get('start_time', ''),
+        'end_time': metadata.get('end_time', ''),
+        'status': metadata.get('status', 'unknown'),
+        'duration': metadata.get('duration', 0),
+        'total_samples': metadata.get('total_samples', {})
+    }
+
+def read_session_entry(date, session_id):
+    """Legge il metadata.json di una sessione (None se assente o illeggibile)"""
+    metadata_file = DATA_STORAGE_DIR / date / session_id / "metadata.json"
+    try:
+        metadata = _json_loads(metadata_file.read_bytes())
+    except (OSError, ValueError):
+        return None
+    return format_session_entry(session_id, date, metadata)
+
+def scan_session_index():
+    """Scansione completa di DATA_STORAGE_DIR: session_id -> voce formattata"""
+    index = {}
+    try:
+        date_entries = os.scandir(DATA_STORAGE_DIR)
+    except FileNotFoundError:
+        return index
     
-    return sessions
+    with date_entries:
+        for date_entry in date_entries:
+            if not date_entry.is_dir():
+                continue
+            with os.scandir(date_entry.path) as session_entries:
+                for session_entry in session_entries:
+                    if not session_entry.is_dir():
+                        continue
+                    entry = read_session_entry(date_entry.name, session_entry.name)
+                    if entry is not None:
+                        index[session_entry.name] = entry
+    return index
+
+def scan_anomaly_date_index():
+    """Scansione completa di ANOMALY_LOGS_DIR: insieme delle date YYYYMMDD"""
+    dates = set()
+    try:
+        entries = os.scandir(ANOMALY_LOGS_DIR)
+    except FileNotFoundError:
+        return dates
+    
+    with entries:
+        for entry in entries:
+            date_str = anomaly_date_from_filename(entry.name)
+            if date_str:
+                dates.add(date_str)
+    return dates
+
+def refresh_session_index(date, session_id):
+    """Aggiorna (o rimuove) una sessione nell'indice"""
+    if state.session_index is None:
+        return
+    entry = read_session_entry(date, session_id)
+    with state.index_lock:
+        if entry is not None:
+            state.session_index[session_id] = entry
+        else:
+            state.session_index.pop(session_id, None)
+
+def remove_date_from_session_index(date):
+    """Rimuove dall'indice tutte le sessioni di una data"""
+    if state.session_index is None:
+        return
+    with state.index_lock:
+        for session_id in [sid for sid, entry in state.session_index.items() if entry['date'] == date]:
+            del state.session_index[session_id]
+
+def refresh_anomaly_date_index(filename):
+    """Aggiorna l'indice delle date dopo la creazione/rimozione di un log anomalie"""
+    if state.anomaly_date_index is None:
+        return
+    date_str = anomaly_date_from_filename(filename)
+    if not date_str:
+        return
+    present = any(path.exists() for path in anomaly_log_files(date_str).values())
+    with state.index_lock:
+        if present:
+            state.anomaly_date_index.add(date_str)
+        else:
+            state.anomaly_date_index.discard(date_str)
+
+def build_storage_indexes():
+    """Popola gli indici in memoria (da chiamare dopo l'avvio del watcher)"""
+    session_index = scan_session_index()
+    anomaly_date_index = scan_anomaly_date_index()
+    with state.index_lock:
+        state.session_index = session_index
+        state.anomaly_date_index = anomaly_date_index
+    print(f"[Storage] Indexed {len(session_index)} sessions, {len(anomaly_date_index)} anomaly dates")
 
 # ====== AUTHENTICATION DECORATORS ======
 
@@ -559,6 +1392,8 @@ def require_auth(f):
         if not token:
             return jsonify({'success': False, 'error': 'Non autenticato'}), 401
         
+        # verify_session ha già una cache LRU/TTL in-process (AuthDB): le
+        # richieste ripetute con lo stesso token non interrogano SQLite
         result = auth_db.verify_session(token)
         
         if not result['success']:
@@ -617,7 +1452,7 @@ def get_status():
         'device_connected': state.device_connected,
         'mqtt_connected': state.mqtt_connected,
         'is_acquiring': state.is_acquiring,
-        'stats': state.stats,
+        'stats': state.stats_snapshot(),
         'packet_count': state.packet_count,
         'uptime': int(time.time() - state.start_time) if state.start_time else 0,
         'current_session': state.current_session_id
@@ -635,7 +1470,7 @@ def api_login():
     if not username or not password:
         return jsonify({'success': False, 'error': 'Username e password richiesti'}), 400
     
-    result = auth_db.login(username, password)
+    result = run_blocking(auth_db.login, username, password)
     
     if result['success']:
         return jsonify(result), 200
@@ -656,7 +1491,7 @@ def api_register():
     if not all([username, password, nome, cognome, ruolo]):
         return jsonify({'success': False, 'error': 'Tutti i campi sono richiesti'}), 400
     
-    result = auth_db.register_user(username, password, nome, cognome, ruolo)
+    result = run_blocking(auth_db.register_user, username, password, nome, cognome, ruolo)
     
     if result['success']:
         return jsonify(result), 200
@@ -753,30 +1588,60 @@ def stop_acquisition():
         'current_state': state.is_acquiring
     })
 
+# ====== CONDITIONAL JSON RESPONSES ======
+
+def make_etag(*parts):
+    """ETag forte e corto a partire da valori che cambiano con i dati (mtime, size, ...)"""
+    return hashlib.blake2b(repr(parts).encode(), digest_size=8).hexdigest()
+
+def not_modified(etag):
+    """True se il client ha già la versione identificata da etag"""
+    # Confronto weak (RFC 7232): l'ETag di una risposta compressa è W/"..."
+    return request.if_none_match.contains_weak(etag)
+
+def etag_json_response(body, etag=None, max_age=None):
+    """
+    Risposta JSON con ETag e Cache-Control: il client rivalida con
+    If-None-Match e riceve 304 se nulla è cambiato.
+    Senza etag esplicito l'ETag è l'hash del body serializzato; con max_age
+    il browser riusa la risposta per max_age secondi senza rivalidare.
+    """
+    payload = _json_dumps(body)
+    if etag is None:
+        etag = make_etag(payload)
+    if not_modified(etag):
+        return app.response_class(status=304)
+    
+    response = app.response_class(payload, mimetype='application/json')
+    response.set_etag(etag)
+    if max_age:
+        response.headers['Cache-Control'] = f'private, max-age={max_age}, must-revalidate'
+    else:
+        response.headers['Cache-Control'] = 'private, must-revalidate'
+    return response
+
+def ojsonify(obj, status=200):
+    """jsonify con orjson (array NumPy serializzati senza .tolist())"""
+    return app.response_class(orjson_socketio.dumps_bytes(obj), status=status,
+                              mimetype='application/json')
+
 # ====== HISTORY API ROUTES ======
 
 @app.route('/api/history/sessions')
 def get_sessions():
     """Get list of available sessions"""
     try:
-        sessions = get_available_sessions()
+        if state.session_index is not None:
+            with state.index_lock:
+                sessions = list(state.session_index.values())
+        else:
+            sessions = list(scan_session_index().values())
         
-        formatted_sessions = []
-        for session in sessions:
-            session_id = session['session_id']
-            metadata = session.get('metadata', {})
-            
-            formatted_sessions.append({
-                'session_id': session_id,
-                'date': session['date'],
-                'start_time': metadata.get('start_time', ''),
-                'end_time': metadata.get('end_time', ''),
-                'status': metadata.get('status', 'unknown'),
-                'duration': metadata.get('duration', 0),
-                'total_samples': metadata.get('total_samples', {})
-            })
+        formatted_sessions = sorted(
+            sessions, key=lambda session: (session['date'], session['session_id']), reverse=True
+        )
         
-        return jsonify({'sessions': formatted_sessions})
+        return etag_json_response({'sessions': formatted_sessions})
     
     except Exception as e:
         app.logger.error(f"Error getting sessions: {str(e)}")
@@ -789,37 +1654,39 @@ def get_session_data(session_id, signal):
         return jsonify({'error': 'Invalid parameters'}), 400
     
     try:
-        data = load_session_data(session_id, signal)
-        
-        if not data:
+        # ETag dai file di dati della sessione: 304 senza rileggere il file
+        session_dir = DATA_STORAGE_DIR / session_id.split('_')[0] / session_id
+        etag = make_etag(session_id, signal, files_stat_key((
+            session_dir / f"{signal.upper()}_data.msgpack",
+            session_dir / f"{signal.upper()}_data.jsonl"
+        )))
+        if not_modified(etag):
+            return app.response_class(status=304)
+        
+        data = load_session_array(session_id, signal)
+        
+        if len(data) == 0:
             return jsonify({
                 'data': {'x': [], 'y': []},
                 'count': 0
             })
         
-        # Format data for frontend
+        # Format data for frontend (trasposizione canali in un'unica operazione C)
         if signal == 'TEMP':
             chart_data = {
-                'x': list(range(len(data))),
-                'y': [[d] for d in data]
+                'x': np.arange(len(data)).tolist(),
+                'y': data[:, :1].tolist()
             }
         else:
-            num_channels = len(data[0]) if data else 0
-            y_data = [[] for _ in range(num_channels)]
-            
-            for point in data:
-                for ch in range(num_channels):
-                    y_data[ch].append(point[ch])
-            
             chart_data = {
-                'x': list(range(len(data))),
-                'y': y_data
+                'x': np.arange(len(data)).tolist(),
+                'y': data.T.tolist()
             }
         
-        return jsonify({
+        return etag_json_response({
             'data': chart_data,
             'count': len(data)
-        })
+        }, etag)
     
     except Exception as e:
         app.logger.error(f"Error getting session data: {str(e)}")
@@ -831,24 +1698,11 @@ def get_session_data(session_id, signal):
 def get_anomaly_dates():
     """Get dates with available anomaly data"""
     try:
-        if not ANOMALY_LOGS_DIR.exists():
-            return jsonify({'dates': []})
-        
-        dates = set()
-        
-        for log_file in ANOMALY_LOGS_DIR.glob("*.json"):
-            filename = log_file.stem
-            date_str = None
-            
-            if filename.startswith("anomalies_"):
-                date_str = filename.replace("anomalies_", "")
-            elif filename.startswith("piezo_anomalies_"):
-                date_str = filename.replace("piezo_anomalies_", "")
-            elif filename.startswith("temp_anomalies_"):
-                date_str = filename.replace("temp_anomalies_", "")
-            
-            if date_str and len(date_str) == 8 and date_str.isdigit():
-                dates.add(date_str)
+        if state.anomaly_date_index is not None:
+            with state.index_lock:
+                dates = set(state.anomaly_date_index)
+        else:
+            dates = scan_anomaly_date_index()
         
         formatted_dates = []
         for date in sorted(dates, reverse=True):
@@ -861,7 +1715,7 @@ def get_anomaly_dates():
             except:
                 pass
         
-        return jsonify({'dates': formatted_dates})
+        return etag_json_response({'dates': formatted_dates})
     
     except Exception as e:
         app.logger.error(f"Error getting anomaly dates: {str(e)}")
@@ -874,29 +1728,23 @@ def get_anomalies_for_date(date):
         return jsonify({'error': 'Invalid date format'}), 400
     
     try:
-        ecg_anomalies = []
-        piezo_anomalies = []
-        temp_anomalies = []
-        
-        # Load ECG anomalies
-        ecg_file = ANOMALY_LOGS_DIR / f"anomalies_{date}.json"
-        if ecg_file.exists():
-            with open(ecg_file, 'r') as f:
-                ecg_anomalies = json.load(f)
-        
-        # Load PIEZO anomalies
-        piezo_file = ANOMALY_LOGS_DIR / f"piezo_anomalies_{date}.json"
-        if piezo_file.exists():
-            with open(piezo_file, 'r') as f:
-                piezo_anomalies = json.load(f)
-        
-        # Load TEMP anomalies
-        temp_file = ANOMALY_LOGS_DIR / f"temp_anomalies_{date}.json"
-        if temp_file.exists():
-            with open(temp_file, 'r') as f:
-                temp_anomalies = json.load(f)
+        files = anomaly_log_files(date)
+        paths = (files['ecg'], files['piezo'], files['temp'])
         
-        return jsonify({
+        # Nessun file cambiato dall'ultima richiesta: risposta dalla cache
+        key = files_stat_key(paths)
+        etag = make_etag(date, key)
+        if not_modified(etag):
+            return app.response_class(status=304)
+        
+        cached = _anomaly_response_cache.get(date)
+        if cached is not None and cached[0] == key:
+            return etag_json_response(cached[1], etag)
+        
+        # Load ECG, PIEZO and TEMP anomalies in parallel
+        ecg_anomalies, piezo_anomalies, temp_anomalies = _ANOMALY_POOL.map(load_anomaly_log_if_exists, paths)
+        
+        result = {
             'ecg_anomalies': ecg_anomalies,
             'piezo_anomalies': piezo_anomalies,
             'temp_anomalies': temp_anomalies,
@@ -904,7 +1752,13 @@ def get_anomalies_for_date(date):
             'piezo_count': len(piezo_anomalies),
             'temp_count': len(temp_anomalies),
             'total_count': len(ecg_anomalies) + len(piezo_anomalies) + len(temp_anomalies)
-        })
+        }
+        
+        if len(_anomaly_response_cache) >= ANOMALY_RESPONSE_CACHE_MAX:
+            _anomaly_response_cache.clear()
+        _anomaly_response_cache[date] = (key, result)
+        
+        return etag_json_response(result, etag)
     
     except Exception as e:
         app.logger.error(f"Error getting anomalies for date: {str(e)}")
@@ -923,168 +1777,202 @@ def get_anomaly_summary():
                 'total': 0
             })
         
-        summary = []
-        total_ecg = 0
-        total_piezo = 0
-        total_temp = 0
-        
         # Get all unique dates
-        dates = set()
-        for log_file in ANOMALY_LOGS_DIR.glob("*.json"):
-            filename = log_file.stem
-            date_str = None
-            
-            if filename.startswith("anomalies_"):
-                date_str = filename.replace("anomalies_", "")
-            elif filename.startswith("piezo_anomalies_"):
-                date_str = filename.replace("piezo_anomalies_", "")
-            elif filename.startswith("temp_anomalies_"):
-                date_str = filename.replace("temp_anomalies_", "")
-            
-            if date_str and len(date_str) == 8 and date_str.isdigit():
-                dates.add(date_str)
+        dates = anomaly_summary_dates()
         
-        # Count anomalies per date
-        for date in sorted(dates, reverse=True):
-            ecg_count = 0
-            piezo_count = 0
-            temp_count = 0
-            
-            ecg_file = ANOMALY_LOGS_DIR / f"anomalies_{date}.json"
-            if ecg_file.exists():
-                try:
-                    with open(ecg_file, 'r') as f:
-                        ecg_data = json.load(f)
-                        ecg_count = len(ecg_data) if isinstance(ecg_data, list) else 0
-                except:
-                    pass
-            
-            piezo_file = ANOMALY_LOGS_DIR / f"piezo_anomalies_{date}.json"
-            if piezo_file.exists():
-                try:
-                    with open(piezo_file, 'r') as f:
-                        piezo_data = json.load(f)
-                        piezo_count = len(piezo_data) if isinstance(piezo_data, list) else 0
-                except:
-                    pass
-            
-            temp_file = ANOMALY_LOGS_DIR / f"temp_anomalies_{date}.json"
-            if temp_file.exists():
-                try:
-                    with open(temp_file, 'r') as f:
-                        temp_data = json.load(f)
-                        temp_count = len(temp_data) if isinstance(temp_data, list) else 0
-                except:
-                    pass
-            
-            total_ecg += ecg_count
-            total_piezo += piezo_count
-            total_temp += temp_count
+        # Count anomalies per date (solo i file modificati vengono riletti,
+        # in parallelo sul pool di storage)
+        # I totali non dipendono dall'ordine: nessun sort delle date
+        files = [anomaly_log_files(date) for date in dates]
+        paths = [f[t] for f in files for t in ('ecg', 'piezo', 'temp')]
         
-        return jsonify({
+        # ETag da (mtime, size) di tutti i log: 304 senza contare nulla
+        etag = make_etag('anomaly-summary', files_stat_key(paths))
+        if not_modified(etag):
+            return app.response_class(status=304)
+        
+        counts = list(_STORAGE_POOL.map(count_anomaly_log, paths))
+        
+        total_ecg = sum(counts[0::3])
+        total_piezo = sum(counts[1::3])
+        total_temp = sum(counts[2::3])
+        
+        return etag_json_response({
             'total_ecg': total_ecg,
             'total_piezo': total_piezo,
             'total_temp': total_temp,
             'total': total_ecg + total_piezo + total_temp
-        })
+        }, etag, max_age=SUMMARY_MAX_AGE)
     
     except Exception as e:
         app.logger.error(f"Error getting anomaly summary: {str(e)}")
         return jsonify({'error': 'Server error'}), 500
 
     
+# max-age (secondi) di summary e date: brevi, poi rivalidazione con ETag
+SUMMARY_MAX_AGE = 5
+
+# Grafici di training: immutabili una volta scritti (cache browser per un anno)
+CHART_MAX_AGE = 31536000
+
+# Nomi dei mesi come %B in locale C (evita strptime/strftime per ogni data)
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+               'August', 'September', 'October', 'November', 'December']
+
+# /api/history/dates: risposta ricostruita solo se cambia l'mtime di DATA_STORAGE_DIR
+_dates_cache = {'mtime': None, 'dates': []}
+
 @app.route('/api/history/dates')
 def get_history_dates():
     """Get available dates"""
     try:
-        if not DATA_STORAGE_DIR.exists():
+        try:
+            mtime = os.stat(DATA_STORAGE_DIR).st_mtime_ns
+        except FileNotFoundError:
             return jsonify({'dates': []})
         
-        dates = []
-        for date_dir in sorted(DATA_STORAGE_DIR.iterdir(), reverse=True):
-            if date_dir.is_dir() and len(date_dir.name) == 8:
-                dates.append({
-                    'value': date_dir.name,
-                    'label': datetime.strptime(date_dir.name, '%Y%m%d').strftime('%d %B %Y')
-                })
-        
-        return jsonify({'dates': dates})
+        limit = request.args.get('limit', type=int)
+        etag = make_etag('history-dates', mtime, limit)
+        if not_modified(etag):
+            return app.response_class(status=304)
+        
+        if mtime != _dates_cache['mtime']:
+            with os.scandir(DATA_STORAGE_DIR) as entries:
+                names = sorted(
+                    (entry.name for entry in entries
+                     if entry.is_dir() and len(entry.name) == 8 and entry.name.isdigit()),
+                    reverse=True
+                )
+            dates = [{
+                'value': d,
+                'label': f"{d[6:8]} {MONTH_NAMES[int(d[4:6]) - 1]} {d[0:4]}"
+            } for d in names if 1 <= int(d[4:6]) <= 12]
+            _dates_cache['dates'] = dates
+            _dates_cache['mtime'] = mtime
+        
+        # ?limit=N: solo le N date più recenti (lista in cache già ordinata)
+        dates = _dates_cache['dates']
+        if limit is not None and limit >= 0:
+            dates = dates[:limit]
+        return etag_json_response({'dates': dates}, etag, max_age=SUMMARY_MAX_AGE)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Conteggi di righe dei file di sessione: path -> (mtime_ns, size, count)
+_line_count_cache = {}
+_line_count_lock = threading.Lock()
+LINE_COUNT_CACHE_MAX = 4096
+
+LINE_COUNT_CHUNK = 1 << 20
+
+def fast_count_lines(file_path):
+    """Conta le righe con bytes.count(b'\\n') su blocchi da 1 MB (memchr in C, nessuna decodifica)"""
+    count = 0
+    last = b'\n'
+    with open(file_path, 'rb', buffering=0) as f:
+        for chunk in iter(lambda: f.read(LINE_COUNT_CHUNK), b''):
+            count += chunk.count(b'\n')
+            last = chunk[-1:]
+    # Ultima riga senza newline finale (come l'iterazione per righe)
+    if last != b'\n':
+        count += 1
+    return count
+
+def count_lines(file_path):
+    """Numero di righe di un file (0 se non esiste), ricontato solo se il file è cambiato"""
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return 0
+    cached = _line_count_cache.get(file_path)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    
+    try:
+        count = fast_count_lines(file_path)
+    except FileNotFoundError:
+        return 0
+    
+    with _line_count_lock:
+        if file_path not in _line_count_cache and len(_line_count_cache) >= LINE_COUNT_CACHE_MAX:
+            _line_count_cache.pop(next(iter(_line_count_cache)))
+        _line_count_cache[file_path] = (st.st_mtime_ns, st.st_size, count)
+    return count
+
+def session_total_samples(session_path, metadata):
+    """
+    total_samples di una sessione: dal metadata.json scritto a fine sessione
+    se completo, altrimenti (sessione attiva o interrotta) contando le righe
+    """
+    total_samples = metadata.get('total_samples')
+    if (metadata.get('status') == 'completed' and isinstance(total_samples, dict)
+            and all(isinstance(total_samples.get(s), int) for s in ('ECG', 'ADC', 'TEMP'))):
+        return {s: total_samples[s] for s in ('ECG', 'ADC', 'TEMP')}
+    
+    # Conta samples - FIX: usa .jsonl e conta righe
+    return {
+        'ECG': count_lines(os.path.join(session_path, "ECG_data.jsonl")),
+        'ADC': count_lines(os.path.join(session_path, "ADC_data.jsonl")),
+        'TEMP': count_lines(os.path.join(session_path, "TEMP_data.jsonl"))
+    }
+
+def read_session_summary(session_path):
+    """Metadati e numero di sample per segnale di una sessione (eseguito sul pool)"""
+    # EAFP: una sola open() invece di exists() + open()
+    metadata = {}
+    try:
+        with open(os.path.join(session_path, "metadata.json"), 'rb') as f:
+            metadata = _json_loads(f.read())
+    except FileNotFoundError:
+        pass
+    
+    return {
+        'session_id': os.path.basename(session_path),
+        'start_time': metadata.get('start_time', ''),
+        'end_time': metadata.get('end_time', ''),
+        'duration': metadata.get('duration', 0),
+        'status': metadata.get('status', 'unknown'),
+        'total_samples': session_total_samples(session_path, metadata)
+    }
+
 @app.route('/api/history/window/<session_id>/<signal>')
 def get_windowed_data(session_id, signal):
     position = int(request.args.get('position', 0))
     window_size = int(request.args.get('window_size', 1000))
     
     try:
-        data = load_session_data(session_id, signal)
+        columns = get_session_array_cached(session_id, signal)
+        total_count = columns.shape[1]
         
-        if not data:
+        if total_count == 0:
             return jsonify({
                 'data': {'x': [], 'y': []},
                 'count': 0,
                 'total_count': 0
             })
         
-        window_data = data[position:position + window_size]
+        # Finestra come slicing per canale (righe contigue)
+        window = columns[:, position:position + window_size]
+        count = window.shape[1]
         
-        # FIX: Data format is {timestamp: X, values: [Y]} - extract only values
-        if signal == 'TEMP':
-            # Extract values from {timestamp, values} format
-            values = []
-            for item in window_data:
-                if isinstance(item, dict) and 'values' in item:
-                    val = item['values']
-                    # values is array with 1 element for TEMP
-                    values.append(val[0] if isinstance(val, list) and len(val) > 0 else val)
-                else:
-                    values.append(item)
-            
-            chart_data = {
-                'x': list(range(position, position + len(values))),
-                'y': [values]
-            }
-        elif signal == 'ADC':
-            # ADC: {timestamp, values: [ch1, ch2, ch3]} - 3 channels
-            y_data = [[], [], []]
-            for item in window_data:
-                if isinstance(item, dict) and 'values' in item:
-                    vals = item['values']
-                    if isinstance(vals, list) and len(vals) >= 3:
-                        for ch in range(3):
-                            y_data[ch].append(vals[ch])
-                    else:
-                        for ch in range(3):
-                            y_data[ch].append(0)
-                else:
-                    for ch in range(3):
-                        y_data[ch].append(0)
-            
-            chart_data = {
-                'x': list(range(position, position + len(window_data))),
-                'y': y_data
-            }
-        else:  # ECG
-            # ECG: {timestamp, values: [val]}
-            values = []
-            for item in window_data:
-                if isinstance(item, dict) and 'values' in item:
-                    val = item['values']
-                    # values is array with 1 element for ECG
-                    values.append(val[0] if isinstance(val, list) and len(val) > 0 else val)
-                else:
-                    values.append(item)
-            
-            chart_data = {
-                'x': list(range(position, position + len(values))),
-                'y': [values]
-            }
+        if signal == 'ADC':
+            # ADC: 3 canali (colonne mancanti a 0, come nel formato precedente)
+            values = window[:3]
+            if len(values) < 3:
+                values = np.zeros((3, count), dtype=window.dtype)
+        else:
+            # TEMP / ECG: un solo canale, vista già contigua (nessuna copia)
+            values = window[:1]
         
-        return jsonify({
+        chart_data = {
+            'x': np.arange(position, position + count),
+            'y': np.ascontiguousarray(values)
+        }
+        
+        return ojsonify({
             'data': chart_data,
-            'count': len(window_data),
-            'total_count': len(data)
+            'count': count,
+            'total_count': total_count
         })
     except Exception as e:
         print(f"[ERROR] get_windowed_data: {e}")
@@ -1095,53 +1983,24 @@ def get_windowed_data(session_id, signal):
 @app.route('/api/history/sessions/<date>')
 def get_sessions_for_date(date):
     try:
-        date_dir = DATA_STORAGE_DIR / date
-        if not date_dir.exists():
+        try:
+            entries = os.scandir(DATA_STORAGE_DIR / date)
+        except FileNotFoundError:
             return jsonify({'sessions': []})
         
-        sessions = []
-        for session_dir in sorted(date_dir.iterdir(), reverse=True):
-            if not session_dir.is_dir():
-                continue
-            
-            metadata_file = session_dir / "metadata.json"
-            metadata = {}
-            if metadata_file.exists():
-                with open(metadata_file, 'r') as f:
-                    metadata = json.load(f)
-            
-            # Conta samples - FIX: usa .jsonl e conta righe
-            ecg_count = adc_count = temp_count = 0
-            
-            ecg_file = session_dir / "ECG_data.jsonl"
-            if ecg_file.exists():
-                with open(ecg_file, 'r') as f:
-                    ecg_count = sum(1 for _ in f)
-            
-            adc_file = session_dir / "ADC_data.jsonl"
-            if adc_file.exists():
-                with open(adc_file, 'r') as f:
-                    adc_count = sum(1 for _ in f)
-            
-            temp_file = session_dir / "TEMP_data.jsonl"
-            if temp_file.exists():
-                with open(temp_file, 'r') as f:
-                    temp_count = sum(1 for _ in f)
-            
-            sessions.append({
-                'session_id': session_dir.name,
-                'start_time': metadata.get('start_time', ''),
-                'end_time': metadata.get('end_time', ''),
-                'duration': metadata.get('duration', 0),
-                'status': metadata.get('status', 'unknown'),
-                'total_samples': {
-                    'ECG': ecg_count,
-                    'ADC': adc_count,
-                    'TEMP': temp_count
-                }
-            })
+        # DirEntry.is_dir usa il tipo letto con la directory (nessuna stat);
+        # con ?limit=N solo le N sessioni più recenti (heap, O(n log N))
+        limit = request.args.get('limit', type=int)
+        with entries:
+            session_dirs = [entry for entry in entries if entry.is_dir(follow_symlinks=False)]
+        if limit is not None and limit >= 0:
+            session_dirs = heapq.nlargest(limit, session_dirs, key=lambda e: e.name)
+        else:
+            session_dirs.sort(key=lambda e: e.name, reverse=True)
+        session_paths = [entry.path for entry in session_dirs]
+        sessions = list(_STORAGE_POOL.map(read_session_summary, session_paths))
         
-        return jsonify({'sessions': sessions})
+        return ojsonify({'sessions': sessions})
     except Exception as e:
         print(f"[ERROR] get_sessions_for_date: {e}")
         return jsonify({'error': str(e)}), 500
@@ -1205,18 +2064,12 @@ def get_users_for_sync():
         return jsonify({'success': False, 'error': 'Unauthorized - Invalid sync token'}), 401
     
     try:
-        conn = sqlite3.connect('users.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM users")
-        users = [dict(row) for row in cursor.fetchall()]
-        
-        conn.close()
+        # Connessione di lettura long-lived di AuthDB (niente open/close per richiesta)
+        users = auth_db.get_all_users_for_sync()
         
         print(f"[Sync API] Sent {len(users)} users to remote")
         
-        return jsonify({
+        return ojsonify({
             'success': True,
             'users': users,
             'count': len(users),
@@ -1227,6 +2080,20 @@ def get_users_for_sync():
         print(f"[Sync API] Error getting users: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Timestamp ISO-8601 del sync: da Python 3.11 fromisoformat accetta la 'Z'
+# finale e gli offset, senza la copia di str.replace per ogni riga
+if sys.version_info >= (3, 11):
+    parse_sync_timestamp = datetime.fromisoformat
+else:
+    def parse_sync_timestamp(value):
+        """datetime.fromisoformat con supporto al suffisso 'Z' (Python < 3.11)"""
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        return datetime.fromisoformat(value)
+
+# Massimo numero di id per SELECT ... IN (limite variabili SQLite: 999)
+SYNC_IN_CHUNK = 900
+
 @app.route('/api/users/sync', methods=['POST'])
 def receive_users_for_sync():
     """
@@ -1238,97 +2105,112 @@ def receive_users_for_sync():
         return jsonify({'success': False, 'error': 'Unauthorized - Invalid sync token'}), 401
     
     try:
-        data = request.get_json()
+        # Body decodificato direttamente dai byte (orjson se disponibile)
+        data = _json_loads(request.get_data(cache=False))
         users = data.get('users', [])
         
         if not users:
             return jsonify({'success': False, 'error': 'No users provided'}), 400
         
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        updated = 0
-        inserted = 0
-        conflicts = []
-        
-        for user in users:
-            # Check if user exists
-            cursor.execute("SELECT id, updated_at FROM users WHERE id = ?", (user['id'],))
-            existing = cursor.fetchone()
+        # Connessione RW condivisa di AuthDB; BEGIN IMMEDIATE prende subito
+        # il lock di scrittura ed evita SQLITE_BUSY a metà transazione
+        with auth_db.get_connection(write=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            
+            # Stato locale di tutti gli utenti in arrivo con poche SELECT ... IN
+            # (blocchi da 900 per restare sotto il limite di variabili SQLite)
+            ids = [user['id'] for user in users]
+            existing_map = {}
+            for i in range(0, len(ids), SYNC_IN_CHUNK):
+                chunk = ids[i:i + SYNC_IN_CHUNK]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f"SELECT id, updated_at FROM users WHERE id IN ({placeholders})", chunk)
+                existing_map.update(cursor.fetchall())
             
-            if existing:
-                existing_id, existing_updated_at = existing
+            updated = 0
+            inserted = 0
+            conflicts = []
+            to_upsert = []
+        
+            for user in users:
+                if user['id'] in existing_map:
+                    existing_updated_at = existing_map[user['id']]
                 
-                # Compare timestamps
-                try:
-                    incoming_updated = user.get('updated_at')
+                    # Compare timestamps
+                    try:
+                        incoming_updated = user.get('updated_at')
                     
-                    if not incoming_updated or not existing_updated_at:
-                        conflicts.append({
-                            'id': user['id'],
-                            'username': user['username'],
-                            'reason': 'missing_timestamp'
-                        })
-                        continue
+                        if not incoming_updated or not existing_updated_at:
+                            conflicts.append({
+                                'id': user['id'],
+                                'username': user['username'],
+                                'reason': 'missing_timestamp'
+                            })
+                            continue
                     
-                    # Parse timestamps
-                    incoming_ts = datetime.fromisoformat(incoming_updated.replace('Z', '+00:00'))
-                    existing_ts = datetime.fromisoformat(existing_updated_at.replace('Z', '+00:00'))
+                        # Parse timestamps
+                        incoming_ts = parse_sync_timestamp(incoming_updated)
+                        existing_ts = parse_sync_timestamp(existing_updated_at)
                     
-                    # Compare (with 1 second tolerance)
-                    diff = abs((incoming_ts - existing_ts).total_seconds())
+                        # Compare (with 1 second tolerance)
+                        diff = abs((incoming_ts - existing_ts).total_seconds())
                     
-                    if diff < 1:
-                        # Same timestamp - already synced
-                        continue
-                    elif incoming_ts > existing_ts:
-                        # Incoming is newer - update
-                        cursor.execute('''
-                            UPDATE users 
-                            SET username=?, password_hash=?, nome=?, cognome=?, ruolo=?, 
-                                created_at=?, last_login=?, updated_at=?
-                            WHERE id=?
-                        ''', (
-                            user['username'], user['password_hash'], user['nome'],
-                            user['cognome'], user['ruolo'], user.get('created_at'),
-                            user.get('last_login'), user['updated_at'], user['id']
-                        ))
-                        updated += 1
-                        print(f"[Sync API] ✓ Updated user {user['id']} ({user['username']}) - incoming newer")
-                    else:
-                        # Existing is newer - conflict
+                        if diff < 1:
+                            # Same timestamp - already synced
+                            continue
+                        elif incoming_ts > existing_ts:
+                            # Incoming is newer - update
+                            updated += 1
+                            print(f"[Sync API] ✓ Updated user {user['id']} ({user['username']}) - incoming newer")
+                        else:
+                            # Existing is newer - conflict
+                            conflicts.append({
+                                'id': user['id'],
+                                'username': user['username'],
+                                'reason': 'local_newer',
+                                'local_ts': existing_updated_at,
+                                'incoming_ts': incoming_updated
+                            })
+                            print(f"[Sync API] ⚠ Conflict: user {user['id']} ({user['username']}) - local is newer")
+                            continue
+                
+                    except Exception as ts_error:
+                        print(f"[Sync API] Error comparing timestamps for user {user['id']}: {ts_error}")
                         conflicts.append({
                             'id': user['id'],
                             'username': user['username'],
-                            'reason': 'local_newer',
-                            'local_ts': existing_updated_at,
-                            'incoming_ts': incoming_updated
+                            'reason': 'timestamp_parse_error'
                         })
-                        print(f"[Sync API] ⚠ Conflict: user {user['id']} ({user['username']}) - local is newer")
-                
-                except Exception as ts_error:
-                    print(f"[Sync API] Error comparing timestamps for user {user['id']}: {ts_error}")
-                    conflicts.append({
-                        'id': user['id'],
-                        'username': user['username'],
-                        'reason': 'timestamp_parse_error'
-                    })
+                        continue
             
-            else:
-                # New user - insert
-                cursor.execute('''
-                    INSERT INTO users (id, username, password_hash, nome, cognome, ruolo, created_at, last_login, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
+                else:
+                    # New user - insert
+                    inserted += 1
+                    print(f"[Sync API] ✓ Inserted new user {user['id']} ({user['username']})")
+                
+                to_upsert.append((
                     user['id'], user['username'], user['password_hash'], user['nome'],
                     user['cognome'], user['ruolo'], user.get('created_at'),
                     user.get('last_login'), user.get('updated_at')
                 ))
-                inserted += 1
-                print(f"[Sync API] ✓ Inserted new user {user['id']} ({user['username']})")
+            
+            # Un solo executemany: UPSERT invece di INSERT OR REPLACE, che
+            # cancellerebbe la riga e con essa (ON DELETE CASCADE) le sessioni
+            cursor.executemany('''
+                INSERT INTO users (id, username, password_hash, nome, cognome, ruolo, created_at, last_login, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    username=excluded.username, password_hash=excluded.password_hash,
+                    nome=excluded.nome, cognome=excluded.cognome, ruolo=excluded.ruolo,
+                    created_at=excluded.created_at, last_login=excluded.last_login,
+                    updated_at=excluded.updated_at
+            ''', to_upsert)
+            
+            conn.commit()
         
-        conn.commit()
-        conn.close()
+        # Il merge può cambiare ruolo/nome: verify_session non deve servire la cache
+        auth_db.invalidate_user_sessions(row[0] for row in to_upsert)
         
         if conflicts:
             print(f"[Sync API] ⚠ {len(conflicts)} conflicts detected")
@@ -1354,6 +2236,8 @@ def handle_connect():
     """Client connected"""
     print(f"[Dashboard] Client connected: {request.sid}")
     emit('connection_response', {'status': 'connected'})
+    # Il nuovo client riceve subito le statistiche correnti
+    state.status_event.set()
 
 @socketio.on('disconnect', namespace='/data')
 def handle_disconnect():
@@ -1374,22 +2258,58 @@ def handle_data_request(data):
 # ====== BACKGROUND THREADS ======
 
 def background_status_updater():
-    """Thread for periodic status updates"""
+    """
+    Thread for status updates: invia status_update solo quando stats o
+    packet_count cambiano; le modifiche ravvicinate vengono accorpate
+    """
     while True:
-        time.sleep(2)
-        if state.device_connected or state.mqtt_connected:
+        state.status_event.wait()
+        state.status_event.clear()
+        if (state.device_connected or state.mqtt_connected) and has_data_clients():
             socketio.emit('status_update', {
-                'stats': state.stats,
+                'stats': state.stats_snapshot(),
                 'packet_count': state.packet_count,
                 'uptime': int(time.time() - state.start_time) if state.start_time else 0
             }, namespace='/data')
+        socketio.sleep(STATUS_MIN_INTERVAL)
 
-def background_anomaly_checker():
-    """Thread for periodic anomaly checks"""
+def background_data_emitter():
+    """Invia un unico data_update aggregato per tutti i segnali aggiornati"""
     while True:
-        time.sleep(3)
+        socketio.sleep(DATA_EMIT_INTERVAL)
+        with state.dirty_lock:
+            if not state.dirty_signals:
+                continue
+            dirty, state.dirty_signals = state.dirty_signals, set()
+        
+        try:
+            socketio.emit('data_update', {
+                'signals': {signal: prepare_chart_data(signal) for signal in dirty}
+            }, namespace='/data')
+        except Exception as e:
+            print(f"[Dashboard] Error emitting data update: {e}")
+
+def background_anomaly_checker(interval=ANOMALY_POLL_INTERVAL):
+    """
+    Thread for anomaly checks: si sveglia su anomaly_event (watcher) oppure
+    ogni `interval` secondi (polling senza watchdog, resync di sicurezza con watchdog)
+    """
+    while True:
+        anomaly_event.wait(timeout=interval)
+        anomaly_event.clear()
         check_for_new_anomalies()
 
+def background_session_cleanup():
+    """Thread for periodic cleanup of expired sessions"""
+    while True:
+        socketio.sleep(300)
+        try:
+            result = auth_db.cleanup_expired_sessions()
+            if result['deleted']:
+                print(f"[Dashboard] Removed {result['deleted']} expired sessions")
+        except Exception as e:
+            print(f"[Dashboard] Error cleaning up sessions: {e}")
+
 def mqtt_thread():
     """Thread MQTT con protezione restart"""
     import sys
@@ -1417,19 +2337,10 @@ def get_system_logs():
         level = request.args.get('level', '')
         limit = int(request.args.get('limit', 500))
         
-        # Filter logs
-        filtered_logs = list(system_logs)
-        
-        if category:
-            filtered_logs = [log for log in filtered_logs if log['category'] == category]
+        # Filter logs + apply limit (solo la coda richiesta)
+        filtered_logs = tail_filter_logs(category, level, limit)
         
-        if level:
-            filtered_logs = [log for log in filtered_logs if log['level'] == level]
-        
-        # Apply limit
-        filtered_logs = filtered_logs[-limit:]
-        
-        return jsonify({
+        return ojsonify({
             'success': True,
             'logs': filtered_logs,
             'total': len(filtered_logs)
@@ -1446,13 +2357,7 @@ def export_system_logs():
         level = request.args.get('level', '')
         
         # Filter logs
-        filtered_logs = list(system_logs)
-        
-        if category:
-            filtered_logs = [log for log in filtered_logs if log['category'] == category]
-        
-        if level:
-            filtered_logs = [log for log in filtered_logs if log['level'] == level]
+        filtered_logs = tail_filter_logs(category, level)
         
         export_data = {
             'exported_at': datetime.now().isoformat(),
@@ -1471,13 +2376,17 @@ def export_system_logs():
 
 # ====== MODEL TRAINING API ======
 
+# Loader condiviso: mantiene la cache delle sessioni tra le richieste
+_training_loader = SessionDataLoader()
+_training_loader_lock = threading.Lock()
+
 @app.route('/api/training/sessions')
 @require_auth
 def get_training_sessions():
     """Get available sessions for training"""
     try:
-        loader = SessionDataLoader()
-        sessions = loader.get_available_sessions()
+        with _training_loader_lock:
+            sessions = _training_loader.get_available_sessions()
         
         return jsonify({
             'success': True,
@@ -1545,7 +2454,7 @@ def get_training_progress(training_id):
         
         return jsonify({
             'success': True,
-            'progress': progress
+            'progress': dict(progress)
         })
     
     except Exception as e:
@@ -1601,6 +2510,47 @@ def delete_training(training_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+class ZipStreamBuffer:
+    """Destinazione write-only per ZipFile: i byte scritti vengono svuotati dal generatore"""
+    def __init__(self):
+        self.buf = bytearray()
+    
+    def write(self, data):
+        self.buf += data
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = bytes(self.buf)
+        self.buf.clear()
+        return data
+
+def stream_zip(entries):
+    """
+    Genera uno zip a blocchi da (path, arcname): memoria costante e primo
+    byte subito. I PNG (già compressi) vengono salvati senza ricompressione.
+    """
+    stream = ZipStreamBuffer()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for file_path, arcname in entries:
+            compress_type = zipfile.ZIP_STORED if file_path.suffix == '.png' else zipfile.ZIP_DEFLATED
+            zf.write(file_path, arcname, compress_type=compress_type)
+            if stream.buf:
+                yield stream.drain()
+    # Central directory scritta alla chiusura
+    if stream.buf:
+        yield stream.drain()
+
+def zip_response(entries, download_name):
+    """Risposta zip in streaming (chunked) per download_training_file"""
+    return app.response_class(
+        stream_zip(entries),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={download_name}'}
+    )
+
 @app.route('/api/training/download/<training_id>/<file_type>')
 @require_auth
 def download_training_file(training_id, file_type):
@@ -1641,46 +2591,29 @@ def download_training_file(training_id, file_type):
             if not charts_dir.exists():
                 return jsonify({'success': False, 'error': 'Charts not found'}), 404
             
-            # Create in-memory zip
-            memory_file = BytesIO()
-            with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-                for chart_file in charts_dir.glob('*.png'):
-                    zf.write(chart_file, chart_file.name)
-            
-            memory_file.seek(0)
-            return send_file(
-                memory_file,
-                mimetype='application/zip',
-                as_attachment=True,
-                download_name=f'{training_id}_charts.zip'
-            )
+            # Zip in streaming (nessun archivio completo in memoria)
+            entries = [(chart_file, chart_file.name) for chart_file in charts_dir.glob('*.png')]
+            return zip_response(entries, f'{training_id}_charts.zip')
         
         elif file_type == 'all':
             # Create complete package zip
             training_dir = Path(training_manager.models_path) / training_id
             
-            memory_file = BytesIO()
-            with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-                # Add model files
-                for file_name in ['model.tflite', 'config.json', 'training_config.json', 
-                                  'training_sessions.json', 'training_log.txt']:
-                    file_path = training_dir / file_name
-                    if file_path.exists():
-                        zf.write(file_path, file_name)
-                
-                # Add charts
-                charts_dir = training_dir / 'charts'
-                if charts_dir.exists():
-                    for chart_file in charts_dir.glob('*.png'):
-                        zf.write(chart_file, f'charts/{chart_file.name}')
+            entries = []
+            # Add model files
+            for file_name in ['model.tflite', 'config.json', 'training_config.json', 
+                              'training_sessions.json', 'training_log.txt']:
+                file_path = training_dir / file_name
+                if file_path.exists():
+                    entries.append((file_path, file_name))
             
-            memory_file.seek(0)
-            return send_file(
-                memory_file,
-                mimetype='application/zip',
-                as_attachment=True,
-                download_name=f'{training_id}_complete.zip'
-            )
+            # Add charts
+            charts_dir = training_dir / 'charts'
+            if charts_dir.exists():
+                for chart_file in charts_dir.glob('*.png'):
+                    entries.append((chart_file, f'charts/{chart_file.name}'))
+            
+            return zip_response(entries, f'{training_id}_complete.zip')
         
         return jsonify({'success': False, 'error': 'File not found'}), 404
     
@@ -1703,7 +2636,14 @@ def get_training_chart(training_id, chart_name):
         print(f"  exists: {chart_path.exists() if chart_path else 'None'}")
         
         if chart_path and chart_path.exists():
-            return send_file(chart_path, mimetype='image/png')
+            # ETag da mtime/size e 304 gestiti da send_file (conditional);
+            # private perché la route richiede autenticazione
+            response = send_file(chart_path, mimetype='image/png', conditional=True,
+                                 etag=True, max_age=CHART_MAX_AGE)
+            response.cache_control.private = True
+            response.cache_control.public = False
+            response.cache_control.immutable = True
+            return response
         else:
             print(f"  ERROR: Chart not found at {chart_path}")
             return jsonify({'success': False, 'error': 'Chart not found'}), 404
@@ -1736,24 +2676,44 @@ def run_dashboard(host='0.0.0.0', port=5002, debug=False):
     
     # ====== START FILE LOG WATCHER ======
     # Pass add_system_log explicitly to ensure it's available
-    log_watcher = setup_file_log_watcher("system.log", log_callback=add_system_log)
+    log_watcher = setup_file_log_watcher("system.log", log_callback=add_system_log,
+                                         log_batch_callback=add_system_logs)
     log_watcher.start()
     print("[FileLogWatcher] Monitoring system.log for real-time debug logs")
     
+    # Start MQTT ingress worker (prima del client, per non perdere messaggi)
+    socketio.start_background_task(ingress_worker)
+    
     # Start MQTT thread
     mqtt_bg_thread = threading.Thread(target=mqtt_thread, daemon=True)
     mqtt_bg_thread.start()
     print("[MQTT] Background thread started")
     
-    # Start status updater thread
-    status_thread = threading.Thread(target=background_status_updater, daemon=True)
-    status_thread.start()
+    # Start batched system log emitter
+    socketio.start_background_task(background_log_emitter)
+    
+    # Start coalesced data emitter
+    socketio.start_background_task(background_data_emitter)
+    print("[Dashboard] Data emitter started")
+    
+    # Start status updater (task del server: green thread con eventlet)
+    socketio.start_background_task(background_status_updater)
     print("[Dashboard] Status updater thread started")
     
-    # Start anomaly checker thread
-    anomaly_thread = threading.Thread(target=background_anomaly_checker, daemon=True)
-    anomaly_thread.start()
-    print("[Dashboard] Anomaly checker thread started")
+    # Start storage watcher (inotify) or fall back to the polling thread
+    storage_observer = start_storage_watcher()
+    if storage_observer is not None:
+        build_storage_indexes()
+        anomaly_interval = ANOMALY_RESYNC_INTERVAL
+        print("[Dashboard] Storage watcher started (anomaly logs + session index)")
+    else:
+        anomaly_interval = ANOMALY_POLL_INTERVAL
+    socketio.start_background_task(background_anomaly_checker, anomaly_interval)
+    print(f"[Dashboard] Anomaly checker thread started ({'event-driven' if storage_observer else 'polling'}, interval {anomaly_interval}s)")
+    
+    # Start expired sessions cleanup thread
+    socketio.start_background_task(background_session_cleanup)
+    print("[Dashboard] Session cleanup thread started")
     
     # ====== START SYNC SERVICE ======
     global sync_service
@@ -1767,7 +2727,7 @@ def run_dashboard(host='0.0.0.0', port=5002, debug=False):
     print(f"       - LOCAL_API_URL with Raspberry IP")
     print(f"       - SYNC_TOKEN (must match Raspberry)")
     
-    sync_service = DatabaseSyncService(SYNC_CONFIG)
+    sync_service = DatabaseSyncService(SYNC_CONFIG, on_users_updated=auth_db.invalidate_user_sessions)
     sync_service.start()
     print("[Sync] ✓ Synchronization service started")
     print("=" * 60 + "\n")
@@ -8,6 +8,236 @@ import numpy as np
 from pathlib import Path
 from datetime import datetime
 import os
+import re
+import mmap
+from concurrent.futures.process import BrokenProcessPool
+
+from process_pool import SafeProcessPool
+
+# orjson opzionale: parsing JSONL in C direttamente dai bytes (accetta il '\n' finale)
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    # Decoder stdlib creato una volta: si saltano i controlli di tipo e la
+    # detect_encoding di json.loads a ogni riga (i JSONL sono UTF-8)
+    _json_decode = json.JSONDecoder().decode
+    
+    def _json_loads(data):
+        if not isinstance(data, str):
+            data = data.decode('utf-8')
+        return _json_decode(data)
+
+# orjson.JSONDecodeError è sottoclasse di ValueError, come json.JSONDecodeError
+JSONDecodeError = ValueError
+
+# pysimdjson opzionale: l'array 'values' diventa un buffer di double senza
+# creare oggetti Python per ogni numero (np.frombuffer, zero-copy)
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+def _iter_jsonl_lines(path, file_size):
+    """
+    Righe (bytes) di un file JSONL via mmap: il parser legge dalla page cache
+    senza copia dell'intero file, con ricerca di b'\\n' in C (mm.find)
+    """
+    if file_size == 0:
+        return  # mmap non accetta file vuoti
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if hasattr(mm, 'madvise'):
+            mm.madvise(mmap.MADV_SEQUENTIAL)  # read-ahead aggressivo del kernel
+        pos = 0
+        while pos < file_size:
+            idx = mm.find(b'\n', pos)
+            if idx < 0:
+                idx = file_size
+            if idx > pos:
+                yield mm[pos:idx]
+            pos = idx + 1
+
+LINE_COUNT_CHUNK = 1024 * 1024
+
+def _count_lines(path):
+    """
+    Numero di righe di un file con bytes.count(b'\\n') su blocchi da 1 MB
+    (memchr in C, nessuna decodifica né oggetto per riga)
+    """
+    count = 0
+    last = b'\n'
+    with open(path, 'rb', buffering=0) as f:
+        for chunk in iter(lambda: f.read(LINE_COUNT_CHUNK), b''):
+            count += chunk.count(b'\n')
+            last = chunk[-1:]
+    # Ultima riga senza newline finale (come l'iterazione per righe)
+    if last != b'\n':
+        count += 1
+    return count
+
+# Fast path per file ben formati: estrazione dei numeri con una regex sui bytes
+# e conversione con numpy, entrambe in C, senza un oggetto JSON per riga.
+# Ogni match è una riga intera "{ ... }" con una sola chiave "values": righe
+# troncate (senza '}' finale) o con più "values" non corrispondono e il file
+# passa al parser JSON. La regex controlla la forma della riga, non valida
+# tutto il JSON (es. il resto dell'oggetto dopo i valori)
+_NUM = rb'\s*(-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)\s*'
+_NOT_VALUES = rb'(?:(?!"values")[^\n])*'
+def _line_re(values):
+    return re.compile(rb'^[ \t]*\{' + _NOT_VALUES + rb'"values"\s*:\s*\[' + values
+                      + rb'[,\]]' + _NOT_VALUES + rb'\}[ \t\r]*$', re.M)
+_ECG_VALUE_RE = _line_re(_NUM)
+_PIEZO_VALUES_RE = _line_re(_NUM + b',' + _NUM + b',' + _NUM)
+FAST_PARSE_BLOCK = 8 * 1024 * 1024
+
+def _fast_extract(session_path, file_size, pattern, channels=None):
+    """
+    Valori float32 estratti da `pattern` a blocchi di righe intere; None se
+    anche una sola riga non corrisponde (il chiamante usa il parser JSON)
+    """
+    shape = (0,) if channels is None else (0, channels)
+    if file_size == 0:
+        return np.empty(shape, dtype=np.float32)
+    blocks = []
+    with open(session_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < file_size:
+            end = mm.rfind(b'\n', start, start + FAST_PARSE_BLOCK) + 1
+            if end <= start:
+                end = min(start + FAST_PARSE_BLOCK, file_size)
+                if end < file_size:
+                    return None  # riga più lunga di un blocco: caso non previsto
+            block = mm[start:end]
+            start = end
+            lines = block.count(b'\n') + (not block.endswith(b'\n'))
+            found = pattern.findall(block)
+            if len(found) != lines:
+                return None  # righe vuote, malformate o con schema diverso
+            if found:
+                # bytes -> float64 come i parser JSON, poi float32 come _SampleBuffer
+                blocks.append(np.array(found).astype(np.float64).astype(np.float32))
+    if not blocks:
+        return np.empty(shape, dtype=np.float32)
+    return np.concatenate(blocks)
+
+class _SampleBuffer:
+    """
+    Buffer float32 preallocato per i sample di una sessione: righe stimate da
+    dimensione file / lunghezza della prima riga, raddoppio se non bastano.
+    Con channels=N ogni riga è un vettore di N valori (matrice righe x N).
+    """
+    
+    def __init__(self, file_size, channels=None):
+        self.file_size = file_size
+        self.channels = channels
+        self.buf = None
+        self.n = 0
+    
+    def _shape(self, rows):
+        return rows if self.channels is None else (rows, self.channels)
+    
+    def append(self, value, line_bytes):
+        if self.buf is None:
+            rows = self.file_size // max(line_bytes, 1) + 16
+            self.buf = np.empty(self._shape(rows), dtype=np.float32)
+        elif self.n == len(self.buf):
+            self.buf = np.resize(self.buf, self._shape(len(self.buf) * 2))
+        self.buf[self.n] = value
+        self.n += 1
+    
+    def array(self):
+        """Sample letti (vista: la copia compatta avviene nel np.concatenate finale)"""
+        if self.buf is None:
+            return np.empty(self._shape(0), dtype=np.float32)
+        return self.buf[:self.n]
+
+def _iter_values(session_path, file_size):
+    """
+    (values, lunghezza riga) per ogni riga valida di un JSONL di sessione:
+    values è un array float64 (simdjson) o la lista decodificata (orjson/json)
+    """
+    lines = _iter_jsonl_lines(session_path, file_size)
+    if simdjson is not None:
+        parser = simdjson.Parser()
+        for line in lines:
+            try:
+                # Oggetti simdjson temporanei: rilasciati prima del parse successivo
+                values = np.frombuffer(parser.parse(line)['values'].as_buffer(of_type='d'),
+                                       dtype=np.float64)
+            except (ValueError, KeyError, TypeError):
+                continue
+            yield values, len(line)
+    else:
+        for line in lines:
+            try:
+                entry = _json_loads(line)
+            except JSONDecodeError:
+                continue
+            if isinstance(entry, dict) and 'values' in entry:
+                yield entry['values'], len(line)
+
+def _parse_ecg_session(session_path):
+    """Sample ECG di una sessione (funzione di modulo: eseguibile nel process pool)"""
+    # Load ECG data from JSONL (scritti direttamente in un buffer float32)
+    file_size = os.path.getsize(session_path)
+    fast = _fast_extract(session_path, file_size, _ECG_VALUE_RE)
+    if fast is not None:
+        return fast
+    buf = _SampleBuffer(file_size)
+    for values, line_bytes in _iter_values(session_path, file_size):
+        # ECG_data.jsonl format: {"timestamp": 18345, "values": [4032]}
+        if len(values) > 0:
+            buf.append(values[0], line_bytes)  # Extract ECG value
+    return buf.array()
+
+def _parse_piezo_session(session_path, channel='all'):
+    """Sample PIEZO di una sessione (funzione di modulo: eseguibile nel process pool)"""
+    # Load PIEZO data from JSONL (scritti direttamente in un buffer float32);
+    # con channel='all' si salvano i 3 canali e la media è un'unica operazione
+    file_size = os.path.getsize(session_path)
+    fast = _fast_extract(session_path, file_size, _PIEZO_VALUES_RE, channels=3)
+    if fast is not None:
+        if channel == 'all':
+            return fast.mean(axis=1, dtype=np.float64).astype(np.float32)
+        return np.ascontiguousarray(fast[:, channel])
+    buf = _SampleBuffer(file_size, channels=3 if channel == 'all' else None)
+    for values, line_bytes in _iter_values(session_path, file_size):
+        # ADC_data.jsonl format: {"timestamp": 18950, "values": [7817, 1257, 252]}
+        # values = [piezo_ch1, piezo_ch2, piezo_ch3]
+        if len(values) >= 3:
+            try:
+                if channel == 'all':
+                    buf.append(values[:3], line_bytes)
+                else:
+                    # Use specific channel
+                    buf.append(values[channel], line_bytes)
+            except (ValueError, TypeError, IndexError):
+                continue
+    
+    if channel == 'all':
+        # Use average of all 3 channels (accumulo in float64 come np.mean per riga)
+        return buf.array().mean(axis=1, dtype=np.float64).astype(np.float32)
+    return buf.array()
+
+def _parse_sessions(parse_fn, session_paths, *args):
+    """
+    Esegue parse_fn(path, *args) su ogni sessione in un process pool (parsing
+    JSON CPU-bound: più processi aggirano il GIL); inline con una sola
+    sessione o se il pool non è disponibile
+    """
+    extra = [[arg] * len(session_paths) for arg in args]
+    # Con data_loader eseguito come script parse_fn sta in __main__, che i
+    # worker non importano
+    if len(session_paths) <= 1 or parse_fn.__module__ == '__main__':
+        return list(map(parse_fn, session_paths, *extra))
+    try:
+        # Worker da forkserver: niente fork() dal thread di training del server
+        with SafeProcessPool(max_workers=min(len(session_paths), os.cpu_count() or 1)) as executor:
+            return list(executor.map(parse_fn, session_paths, *extra))
+    except (BrokenProcessPool, OSError) as e:
+        print(f"[DataLoader] Process pool unavailable ({e}), parsing inline")
+        return list(map(parse_fn, session_paths, *extra))
 
 class SessionDataLoader:
     """
@@ -16,6 +246,21 @@ class SessionDataLoader:
     
     def __init__(self, data_storage_path='var/iit_data/data_storage'):
         self.data_storage_path = Path(data_storage_path)
+        # session folder -> (chiave di stat, dict sessione): evita di ricontare
+        # le righe delle sessioni non modificate a ogni listing
+        self._sessions_cache = {}
+    
+    @staticmethod
+    def _session_parts(session_id):
+        """(date, time) da un session_id YYYYMMDD_HHMMSS, con un solo split"""
+        parts = session_id.split('_')
+        return parts[0], parts[1] if len(parts) > 1 else '000000'
+    
+    @staticmethod
+    def _sorted_entries(path):
+        """Voci di una directory (os.DirEntry) ordinate per nome, come sorted(iterdir())"""
+        with os.scandir(path) as it:
+            return sorted(it, key=lambda entry: entry.name)
     
     def get_available_sessions(self):
         """
@@ -25,43 +270,61 @@ class SessionDataLoader:
             list: List of session dicts with metadata
         """
         sessions = []
+        seen = set()
         
         if not self.data_storage_path.exists():
+            self._sessions_cache.clear()
             return sessions
         
+        # os.scandir: tipo di ogni voce da readdir (d_type), niente stat per is_dir
         # Iterate through date folders (YYYYMMDD)
-        for date_folder in sorted(self.data_storage_path.iterdir()):
-            if not date_folder.is_dir():
+        for date_entry in self._sorted_entries(self.data_storage_path):
+            if not date_entry.is_dir():
                 continue
             
             # Iterate through session folders (YYYYMMDD_HHMMSS)
-            for session_folder in sorted(date_folder.iterdir()):
-                if not session_folder.is_dir():
+            for session_entry in self._sorted_entries(date_entry.path):
+                if not session_entry.is_dir():
                     continue
                 
-                session_id = session_folder.name
-                date_str = session_folder.parent.name
-                time_str = session_id.split('_')[1] if '_' in session_id else '000000'
+                session_folder = Path(session_entry.path)
+                session_id = session_entry.name
+                date_str = date_entry.name
+                _, time_str = self._session_parts(session_id)
                 
-                # Calculate session metadata
-                metadata_file = session_folder / 'metadata.json'
-                ecg_file = session_folder / 'ECG_data.jsonl'
-                adc_file = session_folder / 'ADC_data.jsonl'
+                # Un solo listing della cartella: presenza dei file senza exists()
+                with os.scandir(session_entry.path) as it:
+                    files = {entry.name: entry for entry in it if entry.is_file()}
+                ecg_entry = files.get('ECG_data.jsonl')
+                adc_entry = files.get('ADC_data.jsonl')
                 
-                if not (ecg_file.exists() or adc_file.exists()):
+                # Sessione invariata (cartella e file dati): voce in cache
+                ecg_stat = ecg_entry.stat() if ecg_entry else None
+                adc_stat = adc_entry.stat() if adc_entry else None
+                stat_key = tuple(
+                    (st.st_mtime_ns, st.st_size) if st is not None else None
+                    for st in (session_entry.stat(), ecg_stat, adc_stat)
+                )
+                seen.add(session_folder)
+                cached = self._sessions_cache.get(session_folder)
+                if cached is not None and cached[0] == stat_key:
+                    sessions.append(cached[1])
+                    continue
+                
+                if not (ecg_entry or adc_entry):
                     continue
                 
                 # Get file sizes
                 total_size = 0
                 files_info = {}
                 
-                if ecg_file.exists():
-                    size = ecg_file.stat().st_size
+                if ecg_entry:
+                    size = ecg_stat.st_size
                     total_size += size
                     files_info['ecg_size_mb'] = size / (1024 * 1024)
                 
-                if adc_file.exists():
-                    size = adc_file.stat().st_size
+                if adc_entry:
+                    size = adc_stat.st_size
                     total_size += size
                     files_info['adc_size_mb'] = size / (1024 * 1024)
                 
@@ -70,12 +333,11 @@ class SessionDataLoader:
                 samples_count = 0
                 
                 # Quick count of lines to estimate samples
-                if ecg_file.exists():
-                    with open(ecg_file, 'r') as f:
-                        samples_count = sum(1 for _ in f)
+                if ecg_entry:
+                    samples_count = _count_lines(ecg_entry.path)
                     duration_seconds = samples_count / 250  # 250 Hz sampling
                 
-                sessions.append({
+                session = {
                     'session_id': session_id,
                     'date': date_str,
                     'time': time_str,
@@ -86,10 +348,16 @@ class SessionDataLoader:
                     'duration_formatted': self._format_duration(duration_seconds),
                     'samples_count': samples_count,
                     'size_mb': round(total_size / (1024 * 1024), 2),
-                    'has_ecg': ecg_file.exists(),
-                    'has_adc': adc_file.exists(),
+                    'has_ecg': ecg_entry is not None,
+                    'has_adc': adc_entry is not None,
                     **files_info
-                })
+                }
+                self._sessions_cache[session_folder] = (stat_key, session)
+                sessions.append(session)
+        
+        # Sessioni rimosse dal disco
+        for session_folder in set(self._sessions_cache) - seen:
+            del self._sessions_cache[session_folder]
         
         return sessions
     
@@ -121,6 +389,7 @@ class SessionDataLoader:
         
         print(f"\n[DataLoader] Loading ECG data from {len(session_ids)} sessions...")
         
+        found = []
         for session_id in session_ids:
             # Find session path
             date_str = session_id.split('_')[0]
@@ -130,22 +399,15 @@ class SessionDataLoader:
                 print(f"   Session not found: {session_id}")
                 continue
             
-            print(f"  Loading {session_id}...")
-            
-            # Load ECG data from JSONL
-            session_data = []
-            with open(session_path, 'r') as f:
-                for line in f:
-                    try:
-                        entry = json.loads(line.strip())
-                        # ECG_data.jsonl format: {"timestamp": 18345, "values": [4032]}
-                        if 'values' in entry and len(entry['values']) > 0:
-                            session_data.append(entry['values'][0])  # Extract ECG value
-                    except json.JSONDecodeError:
-                        continue
-            
+            found.append((session_id, session_path))
+        
+        # Parsing delle sessioni in parallelo (una per processo)
+        print(f"  Loading {len(found)} sessions...")
+        arrays = _parse_sessions(_parse_ecg_session, [str(path) for _, path in found])
+        
+        for (session_id, session_path), session_data in zip(found, arrays):
             if len(session_data) > 0:
-                all_data.extend(session_data)
+                all_data.append(session_data)
                 
                 sessions_metadata.append({
                     'session_id': session_id,
@@ -154,10 +416,10 @@ class SessionDataLoader:
                     'path': str(session_path.parent)
                 })
                 
-                print(f"     Loaded {len(session_data):,} samples")
+                print(f"     {session_id}: loaded {len(session_data):,} samples")
         
-        # Convert to numpy array
-        data_array = np.array(all_data, dtype=np.float32)
+        # Concatena i buffer delle sessioni (un'unica copia)
+        data_array = np.concatenate(all_data) if all_data else np.empty(0, dtype=np.float32)
         
         print(f"\n[DataLoader] Total ECG samples loaded: {len(data_array):,}")
         print(f"[DataLoader] Total duration: {self._format_duration(len(data_array) / 250)}")
@@ -181,6 +443,7 @@ class SessionDataLoader:
         print(f"\n[DataLoader] Loading PIEZO data from {len(session_ids)} sessions...")
         print(f"[DataLoader] Channel mode: {channel}")
         
+        found = []
         for session_id in session_ids:
             # Find session path
             date_str = session_id.split('_')[0]
@@ -190,29 +453,15 @@ class SessionDataLoader:
                 print(f"   Session not found: {session_id}")
                 continue
             
-            print(f"  Loading {session_id}...")
-            
-            # Load PIEZO data from JSONL
-            session_data = []
-            with open(session_path, 'r') as f:
-                for line in f:
-                    try:
-                        entry = json.loads(line.strip())
-                        # ADC_data.jsonl format: {"timestamp": 18950, "values": [7817, 1257, 252]}
-                        # values = [piezo_ch1, piezo_ch2, piezo_ch3]
-                        if 'values' in entry and len(entry['values']) >= 3:
-                            if channel == 'all':
-                                # Use average of all 3 channels
-                                avg_value = np.mean(entry['values'][:3])
-                                session_data.append(avg_value)
-                            else:
-                                # Use specific channel
-                                session_data.append(entry['values'][channel])
-                    except (json.JSONDecodeError, IndexError):
-                        continue
-            
+            found.append((session_id, session_path))
+        
+        # Parsing delle sessioni in parallelo (una per processo)
+        print(f"  Loading {len(found)} sessions...")
+        arrays = _parse_sessions(_parse_piezo_session, [str(path) for _, path in found], channel)
+        
+        for (session_id, session_path), session_data in zip(found, arrays):
             if len(session_data) > 0:
-                all_data.extend(session_data)
+                all_data.append(session_data)
                 
                 sessions_metadata.append({
                     'session_id': session_id,
@@ -221,10 +470,10 @@ class SessionDataLoader:
                     'path': str(session_path.parent)
                 })
                 
-                print(f"    ✓ Loaded {len(session_data):,} samples")
+                print(f"    ✓ {session_id}: loaded {len(session_data):,} samples")
         
-        # Convert to numpy array
-        data_array = np.array(all_data, dtype=np.float32)
+        # Concatena i buffer delle sessioni (un'unica copia)
+        data_array = np.concatenate(all_data) if all_data else np.empty(0, dtype=np.float32)
         
         print(f"\n[DataLoader] Total PIEZO samples loaded: {len(data_array):,}")
         print(f"[DataLoader] Total duration: {self._format_duration(len(data_array) / 250)}")
@@ -242,26 +491,33 @@ class SessionDataLoader:
         total_duration = sum(s['duration_seconds'] for s in sessions_metadata)
         total_samples = sum(s['samples'] for s in sessions_metadata)
         
+        sessions_used = []
+        for s in sessions_metadata:
+            date_str, time_str = self._session_parts(s['session_id'])
+            sessions_used.append({
+                'session_id': s['session_id'],
+                'date': date_str,
+                'time': time_str,
+                'duration_seconds': s['duration_seconds'],
+                'samples_count': s['samples'],
+                'path': s['path']
+            })
+        
         sessions_info = {
-            'sessions_used': [
-                {
-                    'session_id': s['session_id'],
-                    'date': s['session_id'].split('_')[0],
-                    'time': s['session_id'].split('_')[1] if '_' in s['session_id'] else '000000',
-                    'duration_seconds': s['duration_seconds'],
-                    'samples_count': s['samples'],
-                    'path': s['path']
-                }
-                for s in sessions_metadata
-            ],
+            'sessions_used': sessions_used,
             'total_sessions': len(sessions_metadata),
             'total_duration_seconds': total_duration,
             'total_duration_formatted': self._format_duration(total_duration),
             'total_samples': total_samples
         }
         
-        with open(output_path, 'w') as f:
-            json.dump(sessions_info, f, indent=2)
+        # orjson: serializzazione indentata in C (stesso layout a 2 spazi)
+        if orjson is not None:
+            with open(output_path, 'wb') as f:
+                f.write(orjson.dumps(sessions_info, option=orjson.OPT_INDENT_2))
+        else:
+            with open(output_path, 'w') as f:
+                json.dump(sessions_info, f, indent=2)
         
         print(f"[DataLoader] Saved sessions info: {output_path}")
         
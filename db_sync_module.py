@@ -12,6 +12,16 @@ from typing import List, Dict, Any
 import sys
 import threading
 
+# orjson opzionale: (de)serializzazione dei payload di sync in C
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:
+    _json_loads = json.loads
+    def _json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
 # ========== CONFIGURATION ==========
 class SyncConfig:
     """Configuration for database sync"""
@@ -98,9 +108,9 @@ def get_remote_users(api_url: str, token: str) -> List[Dict[str, Any]]:
             timeout=10
         )
         response.raise_for_status()
-        data = response.json()
+        data = _json_loads(response.content)
         return data.get('users', [])
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, ValueError) as e:
         print(f"[Sync]    Error fetching remote users: {e}")
         return []
 
@@ -113,7 +123,7 @@ def push_users_to_remote(api_url: str, token: str, users: List[Dict[str, Any]])
                 "X-Sync-Token": token,
                 "Content-Type": "application/json"
             },
-            json={"users": users},
+            data=_json_dumps({"users": users}),
             timeout=10
         )
         response.raise_for_status()
@@ -151,8 +161,13 @@ def compare_users(local: Dict, remote: Dict) -> str:
     else:
         return 'remote_newer'
 
-def sync_databases_once(config: SyncConfig, verbose=True) -> Dict[str, Any]:
-    """Single sync run - returns stats"""
+def sync_databases_once(config: SyncConfig, verbose=True, on_users_updated=None) -> Dict[str, Any]:
+    """
+    Single sync run - returns stats
+    
+    on_users_updated: callback opzionale con gli id degli utenti aggiornati
+    localmente (es. per invalidare la cache delle sessioni)
+    """
     if verbose:
         print(f"[Sync] [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Starting sync...")
     
@@ -220,6 +235,8 @@ def sync_databases_once(config: SyncConfig, verbose=True) -> Dict[str, Any]:
             print(f"[Sync]   Updating {len(to_update_local)} users locally:")
         for user in to_update_local:
             upsert_user(config.LOCAL_DB_PATH, user)
+        if on_users_updated is not None:
+            on_users_updated([user['id'] for user in to_update_local])
     
     if to_push_remote:
         if verbose:
@@ -247,10 +264,12 @@ def sync_databases_once(config: SyncConfig, verbose=True) -> Dict[str, Any]:
 class DatabaseSyncService:
     """Service that runs sync in background thread"""
     
-    def __init__(self, config: SyncConfig):
+    def __init__(self, config: SyncConfig, on_users_updated=None):
         self.config = config
+        self.on_users_updated = on_users_updated
         self.running = False
         self.thread = None
+        self._stop_event = threading.Event()
     
     def start(self):
         """Start sync service in background thread"""
@@ -259,6 +278,7 @@ class DatabaseSyncService:
             return
         
         self.running = True
+        self._stop_event.clear()
         self.thread = threading.Thread(target=self._sync_loop, daemon=True)
         self.thread.start()
         print(f"[Sync] Service started (interval: {self.config.SYNC_INTERVAL}s)")
@@ -266,6 +286,7 @@ class DatabaseSyncService:
     def stop(self):
         """Stop sync service"""
         self.running = False
+        self._stop_event.set()
         if self.thread:
             self.thread.join(timeout=5)
         print("[Sync] Service stopped")
@@ -274,15 +295,12 @@ class DatabaseSyncService:
         """Main sync loop"""
         while self.running:
             try:
-                sync_databases_once(self.config, verbose=True)
+                sync_databases_once(self.config, verbose=True, on_users_updated=self.on_users_updated)
             except Exception as e:
                 print(f"[Sync] ✗ Sync error: {e}")
             
-            # Sleep in small intervals to allow quick shutdown
-            for _ in range(self.config.SYNC_INTERVAL):
-                if not self.running:
-                    break
-                time.sleep(1)
+            # Un solo wait per intervallo; stop() lo interrompe subito
+            self._stop_event.wait(self.config.SYNC_INTERVAL)
 
 # ========== STANDALONE MODE ==========
 def main():
@@ -4,28 +4,48 @@ Scrive TUTTI i log in un file e li streama alla dashboard
 """
 
 import os
+import re
 import sys
 import time
 import threading
-from datetime import datetime
 from pathlib import Path
 
+# inotify_simple opzionale (solo Linux): il watcher si sveglia quando il
+# file viene scritto invece di fare polling ogni 100ms
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
 class FileLogWatcher:
     """
     Monitora un file di log e invia le nuove righe alla dashboard
     """
     
-    def __init__(self, log_file_path, emit_callback):
+    ROTATION_CHECK_INTERVAL = 5.0  # secondi tra due confronti di inode path/fd
+    POLL_INTERVAL = 0.1            # fallback senza inotify
+    INOTIFY_TIMEOUT_MS = 1000      # con inotify: risveglio massimo a vuoto
+    EMIT_BATCH_SIZE = 50           # righe massime per chiamata a emit_callback_batch
+    
+    def __init__(self, log_file_path, emit_callback, emit_callback_batch=None):
         """
         Args:
             log_file_path: Path al file di log da monitorare
             emit_callback: Funzione per inviare log alla dashboard
+            emit_callback_batch: Funzione opzionale che riceve una lista di
+                (category, level, message, timestamp); se presente sostituisce
+                emit_callback per le righe lette dal file
         """
         self.log_file = Path(log_file_path)
         self.emit_callback = emit_callback
+        self.emit_callback_batch = emit_callback_batch
         self.stop_event = threading.Event()
         self.watcher_thread = None
         self.last_position = 0
+        self._fd = None  # fd tenuto aperto per tutta la vita del watcher
+        self._inotify = None
+        self._watch_descriptor = None
+        self._ts_cache = (None, '')  # (secondo, "HH:MM:SS") dell'ultimo timestamp
         
         # Mapping prefissi → categorie
         self.category_map = {
@@ -71,6 +91,22 @@ class FileLogWatcher:
             'Exception': 'ERROR',
             'Traceback': 'ERROR',
         }
+        
+        self._compile_maps()
+    
+    def _compile_maps(self):
+        """
+        Compila i prefissi in due regex ad alternanza: una sola scansione in C
+        per riga invece di un startswith / in per ogni prefisso. Le regex
+        lavorano sui bytes UTF-8: la riga si decodifica solo al momento dell'invio
+        """
+        self.category_map_bytes = {k.encode(): v for k, v in self.category_map.items()}
+        self.level_map_bytes = {k.encode(): v for k, v in self.level_map.items()}
+        # match() prova le alternative nell'ordine del dict: stessa priorità del loop
+        self._category_re = re.compile(b'|'.join(map(re.escape, self.category_map_bytes)))
+        self._level_re = re.compile(b'|'.join(map(re.escape, self.level_map_bytes)))
+        # Priorità dei livelli = ordine nel dict (vince il primo prefisso presente)
+        self._level_priority = {prefix: i for i, prefix in enumerate(self.level_map_bytes)}
     
     def start(self):
         """Avvia il watcher"""
@@ -85,6 +121,8 @@ class FileLogWatcher:
         
         # Imposta posizione all'inizio (file appena resettato)
         self.last_position = 0
+        self._fd = os.open(str(self.log_file), os.O_RDONLY)
+        self._open_inotify()
         
         # Avvia thread watcher per nuovi log
         self.stop_event.clear()
@@ -99,59 +137,173 @@ class FileLogWatcher:
         self.stop_event.set()
         if self.watcher_thread:
             self.watcher_thread.join(timeout=2.0)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+    
+    def _open_inotify(self):
+        """Crea l'istanza inotify e il watch sul file (se disponibile)"""
+        if INotify is None:
+            return
+        try:
+            self._inotify = INotify()
+            self._add_watch()
+        except OSError as e:
+            # Limite di watch raggiunto o filesystem non supportato: polling
+            sys.__stdout__.write(f"[FileLogWatcher] inotify unavailable ({e}), polling\n")
+            sys.__stdout__.flush()
+            self._inotify = None
+    
+    def _add_watch(self):
+        """(Ri)aggancia il watch al file corrente, es. dopo una rotazione"""
+        if self._watch_descriptor is not None:
+            try:
+                self._inotify.rm_watch(self._watch_descriptor)
+            except OSError:
+                pass  # inode già rimosso: il kernel ha tolto il watch
+        self._watch_descriptor = self._inotify.add_watch(
+            str(self.log_file), inotify_flags.MODIFY | inotify_flags.ATTRIB)
+    
+    def _wait_for_changes(self):
+        """Attende nuove scritture: evento inotify (con timeout) o sleep di polling"""
+        if self._inotify is not None:
+            self._inotify.read(timeout=self.INOTIFY_TIMEOUT_MS)
+        else:
+            time.sleep(self.POLL_INTERVAL)
     
     def _watch_loop(self):
         """Loop principale che monitora il file"""
+        last_rotation_check = time.monotonic()
         while not self.stop_event.is_set():
             try:
-                if not self.log_file.exists():
-                    time.sleep(0.5)
-                    continue
+                # Rotazione/ricreazione del file: controllo sul path solo ogni
+                # ROTATION_CHECK_INTERVAL secondi, non a ogni giro
+                now = time.monotonic()
+                if self._fd is None or now - last_rotation_check >= self.ROTATION_CHECK_INTERVAL:
+                    last_rotation_check = now
+                    if not self._check_rotation():
+                        time.sleep(0.5)
+                        continue
+                
+                # Una sola fstat sul fd già aperto (niente exists() + stat())
+                current_size = os.fstat(self._fd).st_size
                 
-                current_size = self.log_file.stat().st_size
+                # File troncato: si riparte dall'inizio
+                if current_size < self.last_position:
+                    self.last_position = 0
                 
                 # Se il file è cresciuto, leggi le nuove righe
                 if current_size > self.last_position:
-                    with open(self.log_file, 'r', encoding='utf-8', errors='ignore') as f:
-                        f.seek(self.last_position)
-                        new_lines = f.readlines()
-                        self.last_position = f.tell()
-                    
-                    # Invia ogni riga alla dashboard
-                    for line in new_lines:
-                        line = line.rstrip('\n')
-                        if line.strip():  # Ignora righe vuote
-                            self._send_to_dashboard(line)
+                    self._read_new_lines(current_size)
                 
-                time.sleep(0.1)  # Check ogni 100ms
+                self._wait_for_changes()
                 
             except Exception as e:
                 sys.__stdout__.write(f"[FileLogWatcher] Error: {e}\n")
                 sys.__stdout__.flush()
                 time.sleep(1)
     
-    def _send_to_dashboard(self, line):
-        """Invia una riga di log alla dashboard"""
+    def _check_rotation(self):
+        """
+        Riapre il file se il path punta a un inode diverso da quello del fd
+        (rotazione o ricreazione). False se il file non esiste.
+        """
+        try:
+            path_ino = os.stat(self.log_file).st_ino
+        except FileNotFoundError:
+            return False
+        if self._fd is not None and os.fstat(self._fd).st_ino == path_ino:
+            return True
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(str(self.log_file), os.O_RDONLY)
+        self.last_position = 0
+        if self._inotify is not None:
+            self._add_watch()
+        return True
+    
+    def _read_new_lines(self, size):
+        """
+        Legge le righe complete tra last_position e size con un solo os.pread
+        sul fd aperto (niente mmap: un troncamento concorrente darebbe SIGBUS,
+        qui al massimo una lettura corta). Una riga finale senza '\\n' resta
+        da leggere al giro successivo.
+        """
+        data = os.pread(self._fd, size - self.last_position, self.last_position)
+        end = data.rfind(b'\n')
+        if end < 0:
+            return
+        self.last_position += end + 1
+        
+        batch = [] if self.emit_callback_batch is not None else None
+        for line in data[:end].split(b'\n'):  # bytes: decodifica rimandata a _classify
+            if not line.strip():  # Ignora righe vuote
+                continue
+            if batch is None:
+                self._send_to_dashboard(line)
+                continue
+            entry = self._classify(line)
+            if entry is None:
+                continue
+            batch.append(entry)
+            if len(batch) >= self.EMIT_BATCH_SIZE:
+                self._send_batch(batch)
+                batch = []
+        if batch:
+            self._send_batch(batch)
+    
+    def _send_batch(self, batch):
+        """Invia un gruppo di righe con una sola chiamata"""
+        try:
+            self.emit_callback_batch(batch)
+        except Exception as e:
+            sys.__stdout__.write(f"[FileLogWatcher] Emit error: {e}\n")
+            sys.__stdout__.flush()
+    
+    def _classify(self, line):
+        """
+        (category, level, message, timestamp) di una riga di log (bytes);
+        None se la riga decodificata è vuota
+        """
+        message = line.decode('utf-8', 'ignore')
+        if not message.strip():
+            return None
+        
         # Determina categoria
         category = 'Dashboard'
-        for prefix, cat in self.category_map.items():
-            if line.startswith(prefix):
-                category = cat
-                break
+        match = self._category_re.match(line)
+        if match:
+            category = self.category_map_bytes[match.group(0)]
         
         # Determina livello
         level = 'INFO'
-        for prefix, lvl in self.level_map.items():
-            if prefix in line:
-                level = lvl
-                break
+        found = [m.group(0) for m in self._level_re.finditer(line)]
+        if found:
+            level = self.level_map_bytes[min(found, key=self._level_priority.__getitem__)]
         
-        # Timestamp
-        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-        
-        # Invia
+        return category, level, message, self._timestamp()
+    
+    def _timestamp(self):
+        """
+        "HH:MM:SS.mmm" locale: strftime solo al cambio di secondo,
+        i millisecondi con aritmetica intera su time_ns()
+        """
+        t = time.time_ns()
+        sec, ns = divmod(t, 1_000_000_000)
+        if sec != self._ts_cache[0]:
+            self._ts_cache = (sec, time.strftime("%H:%M:%S", time.localtime(sec)))
+        return f"{self._ts_cache[1]}.{ns // 1_000_000:03d}"
+    
+    def _send_to_dashboard(self, line):
+        """Invia una riga di log (bytes) alla dashboard"""
+        entry = self._classify(line)
+        if entry is None:
+            return
         try:
-            self.emit_callback(category, level, line, timestamp)
+            self.emit_callback(*entry)
         except Exception as e:
             # Use sys.__stdout__ to avoid infinite loop
             sys.__stdout__.write(f"[FileLogWatcher] Emit error: {e}\n")
@@ -162,13 +314,14 @@ class FileLogWatcher:
 
 # ===== SETUP PER IITdata_acq.py =====
 
-def setup_file_log_watcher(log_file_path="system.log", log_callback=None):
+def setup_file_log_watcher(log_file_path="system.log", log_callback=None, log_batch_callback=None):
     """
     Setup del watcher che legge da file e invia alla dashboard
     
     Args:
         log_file_path: Path del file di log (default: system.log)
         log_callback: Funzione add_system_log da chiamare (opzionale, tenta import se None)
+        log_batch_callback: Funzione add_system_logs per gruppi di righe (opzionale)
     
     Returns:
         FileLogWatcher instance
@@ -190,7 +343,18 @@ def setup_file_log_watcher(log_file_path="system.log", log_callback=None):
             sys.__stdout__.write(f"[FileLogWatcher] Callback error: {e}\n")
             sys.__stdout__.flush()
     
-    watcher = FileLogWatcher(log_file_path, emit_callback)
+    emit_callback_batch = None
+    if log_batch_callback is not None:
+        def emit_callback_batch(batch):
+            # add_system_logs vuole [(category, message, level), ...]
+            try:
+                log_batch_callback([(category, message, level)
+                                    for category, level, message, _ in batch])
+            except Exception as e:
+                sys.__stdout__.write(f"[FileLogWatcher] Callback error: {e}\n")
+                sys.__stdout__.flush()
+    
+    watcher = FileLogWatcher(log_file_path, emit_callback, emit_callback_batch)
     return watcher
 
 
@@ -3,19 +3,27 @@ ECG Anomaly Detection Model Trainer
 Adapted to use JSON data from dashboard sessions instead of CSV
 """
 
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
 from tensorflow.keras.models import Model
-from sklearn.model_selection import train_test_split
 import json
 import os
+import gc
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
+# GPU: memoria allocata su richiesta invece di riservarla tutta all'avvio
+# (server condiviso); va impostata prima che il device venga inizializzato
+for _gpu in tf.config.list_physical_devices('GPU'):
+    try:
+        tf.config.experimental.set_memory_growth(_gpu, True)
+    except RuntimeError:
+        pass  # GPU già inizializzata (es. dall'altro trainer): impostazione già fissata
+# XLA auto-clustering anche per i grafi non compilati esplicitamente con jit_compile
+tf.config.optimizer.set_jit(True)
+
 # Custom JSON encoder for numpy types
 class NumpyEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -27,9 +35,68 @@ class NumpyEncoder(json.JSONEncoder):
             return obj.tolist()
         return super().default(obj)
 
+# orjson opzionale: serializzazione in C con supporto nativo ai tipi numpy
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _write_json(path, obj):
+    """Scrive obj come JSON indentato a 2 spazi (tipi numpy inclusi)"""
+    if orjson is not None:
+        Path(path).write_bytes(orjson.dumps(
+            obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w') as f:
+            json.dump(obj, f, indent=2, cls=NumpyEncoder)
+
+def mixed_precision_policy():
+    """
+    Policy Keras mixed precision adatta all'hardware: float16 su GPU, bfloat16
+    su CPU con istruzioni BF16 (AVX-512 BF16 / AMX), None (float32) altrimenti
+    """
+    if tf.config.list_physical_devices('GPU'):
+        return 'mixed_float16'
+    try:
+        with open('/proc/cpuinfo') as f:
+            cpu_flags = f.read()
+    except OSError:
+        return None
+    if 'avx512_bf16' in cpu_flags or 'amx_bf16' in cpu_flags:
+        return 'mixed_bfloat16'
+    return None
+
+# Numba opzionale: normalizzazione fusa (min/max + scrittura) e parallela sui segmenti
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _normalize_windows(windows, out):
+        """Normalizza in [0, 1] ogni riga di windows in out (riga costante -> zeri)"""
+        n_windows, length = windows.shape
+        for i in prange(n_windows):
+            min_val = windows[i, 0]
+            max_val = min_val
+            for j in range(1, length):
+                v = windows[i, j]
+                if v < min_val:
+                    min_val = v
+                if v > max_val:
+                    max_val = v
+            value_range = max_val - min_val
+            for j in range(length):
+                out[i, j] = (windows[i, j] - min_val) / value_range if value_range != 0 else 0.0
+else:
+    _normalize_windows = None
+
 # Import custom modules
 from data_loader import SessionDataLoader
 from training_manager import TrainingManager
+from process_pool import SafeProcessPool
+import training_plots  # grafici: modulo leggero, eseguibile nel pool senza TensorFlow
 
 class ECGModelTrainer:
     """
@@ -47,22 +114,45 @@ class ECGModelTrainer:
         self.LATENT_DIM = 32
         self.EPOCHS = 100
         self.BATCH_SIZE = 64
+        self.SHUFFLE_BUFFER = 10000  # i dati arrivano già mescolati da train_test_split
         self.OVERLAP_RATIO = 0.75
         self.SIGMA_THRESHOLD = 3.0
         
+        # Data parallelism solo se ci sono più GPU: su un device singolo
+        # MirroredStrategy aggiungerebbe solo overhead
+        if len(tf.config.list_physical_devices('GPU')) > 1:
+            self.strategy = tf.distribute.MirroredStrategy()
+        else:
+            self.strategy = tf.distribute.get_strategy()
+        
+        self.mixed_precision_policy = mixed_precision_policy()
+        
         self.autoencoder = None
         self.threshold = None
+        self.keras_threshold = None         # threshold del modello Keras float
+        self.tflite_threshold_stats = None  # statistiche del modello TFLite esportato
+        self._recon_mse = None      # tf.function: MSE di ricostruzione per campione
+        self._loss_cache = {}       # id(data) -> (data, losses) per ogni split
+        self._plot_pool = None
+        self._plot_jobs = []        # (future, plot_fn, args) dei grafici in corso
+        # Generatore PCG64 locale per scegliere i campioni dei grafici (stesso
+        # seed di train_test_split: grafici riproducibili tra due training)
+        self.rng = np.random.default_rng(42)
+        self._rep_samples = None    # segmenti di calibrazione per la quantizzazione int8
     
     def segment_signal(self, signal):
-        """Segment long signal into fixed-length windows with overlap"""
-        segments = []
+        """
+        Segment long signal into fixed-length windows with overlap
+        (vista zero-copy sul segnale: righe = finestre, passo step_size)
+        """
         step_size = int(self.SEQUENCE_LENGTH * (1 - self.OVERLAP_RATIO))
+        signal = np.ascontiguousarray(signal, dtype=np.float32)
         
-        for start in range(0, len(signal) - self.SEQUENCE_LENGTH + 1, step_size):
-            segment = signal[start:start + self.SEQUENCE_LENGTH]
-            segments.append(segment)
+        if len(signal) < self.SEQUENCE_LENGTH:
+            return np.empty((0, self.SEQUENCE_LENGTH), dtype=np.float32)
         
-        return segments
+        windows = np.lib.stride_tricks.sliding_window_view(signal, self.SEQUENCE_LENGTH)
+        return windows[::step_size]
     
     def normalize_signal(self, signal):
         """Normalize signal to [0, 1] range"""
@@ -84,44 +174,73 @@ class ECGModelTrainer:
         segments = self.segment_signal(raw_signal)
         print(f"  Segments created: {len(segments):,}")
         
-        # Convert to array and normalize
-        data = np.array(segments, dtype=np.float32)
-        for i in range(len(data)):
-            data[i] = self.normalize_signal(data[i])
+        # Normalize every segment to [0, 1]
+        # (come normalize_signal: segmento costante -> tutti zeri)
+        # Un solo blocco (n_segments, SEQUENCE_LENGTH) preallocato: i segmenti
+        # sono una vista sul segnale e vengono scritti qui già normalizzati
+        data = np.empty(segments.shape, dtype=np.float32)
+        if _normalize_windows is not None and len(segments):
+            _normalize_windows(segments, data)
+        else:
+            # One vectorized pass over all segments, in place (nessun temporaneo N x L)
+            min_val = segments.min(axis=1, keepdims=True)
+            max_val = segments.max(axis=1, keepdims=True)
+            value_range = max_val - min_val
+            value_range[value_range == 0] = 1
+            np.subtract(segments, min_val, out=data)
+            np.divide(data, value_range, out=data)
         
         print(f"  Final data shape: {data.shape}")
         print(f"  Value range: [{np.min(data):.4f}, {np.max(data):.4f}]")
         
         return data
     
-    def build_model(self):
-        """Build autoencoder model"""
-        print(f"\n[ECGTrainer] Building model...")
+    def _create_autoencoder(self, policy=None):
+        """
+        Layer e modello (non compilato). policy (es. 'mixed_float16') viene
+        passata a ogni layer come dtype: nessuna policy globale Keras, che
+        varrebbe per tutto il processo (anche per un training concorrente)
+        """
+        dtype = keras.mixed_precision.Policy(policy) if policy else None
+        
+        # Convoluzioni 1D al posto dei Dense(1000) in ingresso/uscita: pesi
+        # condivisi lungo il tempo, molti meno parametri da leggere per campione.
+        # Lunghezza temporale: 1000 -> 250 (conv /4) -> 50 (pool /5) -> 25 (conv /2)
+        reduced_length = self.SEQUENCE_LENGTH // 40
         
         # Encoder
         encoder = keras.Sequential([
             layers.Input(shape=(self.SEQUENCE_LENGTH,)),
-            layers.Dense(128, activation="relu"),
-            layers.Dropout(0.2),
-            layers.Dense(64, activation="relu"),
-            layers.Dropout(0.2),
-            layers.Dense(self.LATENT_DIM, activation="relu", name="bottleneck")
+            layers.Reshape((self.SEQUENCE_LENGTH, 1), dtype=dtype),
+            layers.Conv1D(16, 7, strides=4, padding="same", activation="relu", dtype=dtype),
+            layers.MaxPooling1D(5, dtype=dtype),
+            layers.Conv1D(32, 5, strides=2, padding="same", activation="relu", dtype=dtype),
+            layers.Flatten(dtype=dtype),
+            layers.Dropout(0.2, dtype=dtype),
+            layers.Dense(64, activation="relu", dtype=dtype),
+            layers.Dropout(0.2, dtype=dtype),
+            layers.Dense(self.LATENT_DIM, activation="relu", name="bottleneck", dtype=dtype)
         ], name="encoder")
         
-        # Decoder
+        # Decoder (speculare all'encoder)
         decoder = keras.Sequential([
             layers.Input(shape=(self.LATENT_DIM,)),
-            layers.Dense(64, activation="relu"),
-            layers.Dropout(0.2),
-            layers.Dense(128, activation="relu"),
-            layers.Dropout(0.2),
-            layers.Dense(self.SEQUENCE_LENGTH, activation="sigmoid")
+            layers.Dense(64, activation="relu", dtype=dtype),
+            layers.Dropout(0.2, dtype=dtype),
+            layers.Dense(reduced_length * 32, activation="relu", dtype=dtype),
+            layers.Reshape((reduced_length, 32), dtype=dtype),
+            layers.Conv1DTranspose(16, 5, strides=2, padding="same", activation="relu", dtype=dtype),
+            layers.UpSampling1D(5, dtype=dtype),
+            # Uscita sempre in float32 (stabilità numerica con mixed precision)
+            layers.Conv1DTranspose(1, 7, strides=4, padding="same", activation="sigmoid",
+                                   dtype="float32"),
+            layers.Reshape((self.SEQUENCE_LENGTH,), dtype="float32")
         ], name="decoder")
         
         # Full autoencoder
         class Autoencoder(Model):
             def __init__(self, enc, dec):
-                super().__init__()
+                super().__init__(dtype=dtype)
                 self.encoder = enc
                 self.decoder = dec
             
@@ -130,15 +249,38 @@ class ECGModelTrainer:
                 decoded = self.decoder(encoded)
                 return decoded
         
-        self.autoencoder = Autoencoder(encoder, decoder)
-        self.autoencoder.build(input_shape=(None, self.SEQUENCE_LENGTH))
+        autoencoder = Autoencoder(encoder, decoder)
+        autoencoder.build(input_shape=(None, self.SEQUENCE_LENGTH))
         
-        self.autoencoder.compile(
-            optimizer=keras.optimizers.Adam(learning_rate=0.001),
-            loss='mse',
-            metrics=['mae']
-        )
+        return autoencoder
+    
+    def build_model(self):
+        """Build autoencoder model"""
+        print(f"\n[ECGTrainer] Building model...")
+        
+        # Variabili create nello scope della strategia: replicate su ogni
+        # GPU con MirroredStrategy (strategia di default con un solo device)
+        with self.strategy.scope():
+            # Mixed precision solo sui layer di questo modello (dtype per layer)
+            self.autoencoder = self._create_autoencoder(self.mixed_precision_policy)
+            
+            # Loss scaling esplicito con float16: senza policy globale Keras
+            # non lo aggiungerebbe da solo
+            optimizer = keras.optimizers.Adam(learning_rate=0.001)
+            if self.mixed_precision_policy == 'mixed_float16':
+                optimizer = keras.mixed_precision.LossScaleOptimizer(optimizer)
+            
+            # jit_compile: forward, loss MSE e update Adam compilati in un unico
+            # step XLA (per un MLP così piccolo domina l'overhead di dispatch)
+            self.autoencoder.compile(
+                optimizer=optimizer,
+                loss='mse',
+                metrics=['mae'],
+                jit_compile=True
+            )
         
+        print(f"  Replicas: {self.strategy.num_replicas_in_sync}")
+        print(f"  Precision policy: {self.mixed_precision_policy or 'float32'}")
         print(f"  Total parameters: {self.autoencoder.count_params():,}")
         
         return self.autoencoder
@@ -150,27 +292,48 @@ class ECGModelTrainer:
         print(f"  Validation samples: {len(val_data):,}")
         print(f"  Epochs: {self.EPOCHS}")
         
+        # Copia (non vista) per non tenere in vita tutto train_data fino all'export
+        self._rep_samples = np.array(train_data[:256], dtype=np.float32)
+        
         # Custom callback for progress tracking
         class ProgressCallback(keras.callbacks.Callback):
+            UPDATE_EVERY = 5  # epoche tra due update_progress (più prima/ultima)
+            
             def __init__(self, trainer, training_manager, training_id, total_epochs):
                 super().__init__()
                 self.trainer = trainer
                 self.training_manager = training_manager
                 self.training_id = training_id
                 self.total_epochs = total_epochs
+                # Loss per epoca in array preallocati (niente liste che crescono)
+                self._losses = np.zeros(total_epochs, dtype=np.float32)
+                self._val_losses = np.zeros(total_epochs, dtype=np.float32)
+                self._last_epoch = -1
+                self._reported_epoch = -1
             
-            def on_epoch_end(self, epoch, logs=None):
-                loss = logs.get('loss', 0)
-                val_loss = logs.get('val_loss', 0)
-                
+            def _report(self, epoch):
                 self.training_manager.update_progress(
                     self.training_id,
                     epoch + 1,
                     self.total_epochs,
-                    loss,
-                    val_loss,
+                    self._losses[epoch],
+                    self._val_losses[epoch],
                     f"Epoch {epoch+1}/{self.total_epochs}"
                 )
+                self._reported_epoch = epoch
+            
+            def on_epoch_end(self, epoch, logs=None):
+                self._losses[epoch] = logs.get('loss', 0)
+                self._val_losses[epoch] = logs.get('val_loss', 0)
+                self._last_epoch = epoch
+                
+                if epoch == 0 or (epoch + 1) % self.UPDATE_EVERY == 0 or epoch + 1 == self.total_epochs:
+                    self._report(epoch)
+            
+            def on_train_end(self, logs=None):
+                # EarlyStopping: l'ultima epoca eseguita va comunque riportata
+                if self._last_epoch > self._reported_epoch:
+                    self._report(self._last_epoch)
         
         callbacks = [
             ProgressCallback(self, self.training_manager, self.training_id, self.EPOCHS),
@@ -188,24 +351,77 @@ class ECGModelTrainer:
             )
         ]
         
+        # Pipeline tf.data: batch pronti in anticipo (prefetch) mentre lo step
+        # precedente è in esecuzione, invece di affettare gli array a ogni epoca
+        # Batch globale: BATCH_SIZE per replica
+        global_batch_size = self.BATCH_SIZE * self.strategy.num_replicas_in_sync
+        options = tf.data.Options()
+        options.experimental_deterministic = False
+        train_ds = (tf.data.Dataset.from_tensor_slices((train_data, train_data))
+                    .cache()
+                    .shuffle(min(len(train_data), self.SHUFFLE_BUFFER))
+                    .batch(global_batch_size)
+                    .prefetch(tf.data.AUTOTUNE)
+                    .with_options(options))
+        val_ds = (tf.data.Dataset.from_tensor_slices((val_data, val_data))
+                  .batch(global_batch_size)
+                  .cache()
+                  .prefetch(tf.data.AUTOTUNE))
+        
         history = self.autoencoder.fit(
-            train_data, train_data,
+            train_ds,
             epochs=self.EPOCHS,
-            batch_size=self.BATCH_SIZE,
-            validation_data=(val_data, val_data),
+            validation_data=val_ds,
             callbacks=callbacks,
             verbose=2
         )
         
         return history
     
+    def reconstruction_losses(self, data):
+        """
+        MSE di ricostruzione per campione, a batch da 256 su una pipeline
+        tf.data con prefetch: le ricostruzioni complete non vengono mai
+        materializzate in memoria host
+        """
+        if self._recon_mse is None:
+            autoencoder = self.autoencoder
+            
+            @tf.function(reduce_retracing=True)
+            def recon_mse(x):
+                reconstructed = autoencoder(x, training=False)
+                return tf.reduce_mean(tf.square(reconstructed - x), axis=-1)
+            
+            self._recon_mse = recon_mse
+        
+        dataset = tf.data.Dataset.from_tensor_slices(data).batch(256).prefetch(tf.data.AUTOTUNE)
+        return np.concatenate([self._recon_mse(batch).numpy() for batch in dataset])
+    
+    def cached_losses(self, data):
+        """
+        Errori di ricostruzione di uno split, un solo forward pass per array:
+        threshold e grafici che usano lo stesso split condividono il risultato
+        """
+        entry = self._loss_cache.get(id(data))
+        if entry is None or entry[0] is not data:
+            entry = self._loss_cache[id(data)] = (data, self.reconstruction_losses(data))
+        return entry[1]
+    
+    def clear_inference_cache(self):
+        """Rilascia gli errori di ricostruzione in cache (e i riferimenti agli split)"""
+        self._loss_cache.clear()
+    
     def calculate_threshold(self, train_data):
         """Calculate anomaly detection threshold"""
         print(f"\n[ECGTrainer] Calculating threshold...")
         
-        reconstructions = self.autoencoder.predict(train_data, batch_size=256, verbose=0)
-        train_loss = tf.keras.losses.mse(train_data, reconstructions).numpy()
+        threshold, stats = self._threshold_stats(self.cached_losses(train_data))
+        self.threshold = threshold
         
+        return threshold, stats
+    
+    def _threshold_stats(self, train_loss):
+        """Threshold (media + SIGMA_THRESHOLD·std) e statistiche degli errori"""
         mean_loss = np.mean(train_loss)
         std_loss = np.std(train_loss)
         threshold = mean_loss + self.SIGMA_THRESHOLD * std_loss
@@ -214,8 +430,6 @@ class ECGModelTrainer:
         print(f"  Std loss: {std_loss:.6f}")
         print(f"  Threshold ({self.SIGMA_THRESHOLD}σ): {threshold:.6f}")
         
-        self.threshold = threshold
-        
         return threshold, {
             'mean': float(mean_loss),
             'std': float(std_loss),
@@ -228,13 +442,61 @@ class ECGModelTrainer:
             'sigma': self.SIGMA_THRESHOLD
         }
     
-    def save_model(self, model_config):
-        """Save model in TFLite format"""
+    def tflite_reconstruction_losses(self, tflite_model, data, batch_size=256):
+        """MSE di ricostruzione per campione calcolato con il modello TFLite"""
+        interpreter = tf.lite.Interpreter(model_content=tflite_model,
+                                          num_threads=os.cpu_count() or 1)
+        input_index = interpreter.get_input_details()[0]['index']
+        output_index = interpreter.get_output_details()[0]['index']
+        interpreter.resize_tensor_input(input_index, [batch_size, self.SEQUENCE_LENGTH])
+        interpreter.allocate_tensors()
+        
+        losses = []
+        for start in range(0, len(data), batch_size):
+            batch = np.asarray(data[start:start + batch_size], dtype=np.float32)
+            n = len(batch)
+            if n < batch_size:
+                # Ultimo batch completato con zeri (shape fissa dopo allocate_tensors)
+                batch = np.pad(batch, ((0, batch_size - n), (0, 0)))
+            interpreter.set_tensor(input_index, batch)
+            interpreter.invoke()
+            reconstructed = interpreter.get_tensor(output_index).reshape(batch_size, -1)
+            losses.append(np.mean(np.square(reconstructed[:n] - batch[:n]), axis=-1))
+        return np.concatenate(losses)
+    
+    def save_model(self, model_config, train_data=None):
+        """
+        Save model in TFLite format
+        
+        Con train_data il threshold viene ricalcolato sul modello TFLite
+        (quantizzato int8, errori diversi dal Keras float): è quello il
+        modello che gira sul Raspberry
+        """
         print(f"\n[ECGTrainer] Saving model...")
         
+        # Export sempre da un modello float32: con mixed precision si ricrea
+        # l'architettura e si copiano i pesi (le variabili sono già float32)
+        export_model = self.autoencoder
+        if self.mixed_precision_policy:
+            export_model = self._create_autoencoder()
+            export_model.set_weights(self.autoencoder.get_weights())
+        
         # Convert to TFLite quantized (best for RPi)
-        converter = tf.lite.TFLiteConverter.from_keras_model(self.autoencoder)
+        converter = tf.lite.TFLiteConverter.from_keras_model(export_model)
         converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if self._rep_samples is not None and len(self._rep_samples):
+            # Quantizzazione intera di pesi e attivazioni (kernel int8 XNNPACK
+            # su ARM) calibrata sui segmenti di training; input/output restano
+            # float32 come prima, quindi l'inferenza sul Raspberry non cambia.
+            # Gli op senza kernel int8 ricadono sui builtin float
+            rep_samples = self._rep_samples
+            converter.representative_dataset = lambda: (
+                [sample.reshape(1, -1)] for sample in rep_samples
+            )
+            converter.target_spec.supported_ops = [
+                tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+                tf.lite.OpsSet.TFLITE_BUILTINS
+            ]
         quantized_model = converter.convert()
         
         model_path = self.training_dir / 'model.tflite'
@@ -245,10 +507,15 @@ class ECGModelTrainer:
         print(f"  Model saved: {model_path}")
         print(f"  Size: {model_size:.1f} KB")
         
+        if train_data is not None and len(train_data):
+            print(f"  Calculating threshold with the TFLite model...")
+            self.keras_threshold = self.threshold
+            self.threshold, self.tflite_threshold_stats = self._threshold_stats(
+                self.tflite_reconstruction_losses(quantized_model, train_data))
+        
         # Save config.json (user-provided metadata)
         config_path = self.training_dir / 'config.json'
-        with open(config_path, 'w') as f:
-            json.dump(model_config, f, indent=2, cls=NumpyEncoder)
+        _write_json(config_path, model_config)
         
         print(f"  Config saved: {config_path}")
         
@@ -265,6 +532,9 @@ class ECGModelTrainer:
             },
             'threshold': self.threshold,
             'threshold_stats': threshold_stats,
+            # Threshold del Keras float (threshold_stats) e del TFLite deployato
+            'keras_threshold': self.keras_threshold,
+            'tflite_threshold_stats': self.tflite_threshold_stats,
             'training_params': {
                 'epochs': self.EPOCHS,
                 'batch_size': self.BATCH_SIZE,
@@ -275,131 +545,82 @@ class ECGModelTrainer:
         }
         
         config_path = self.training_dir / 'training_config.json'
-        with open(config_path, 'w') as f:
-            json.dump(config, f, indent=2, cls=NumpyEncoder)
+        _write_json(config_path, config)
         
         print(f"  Training config saved: {config_path}")
         
         return config_path
     
+    def start_plot_pool(self, max_workers=4):
+        """
+        Process pool per il rendering dei PNG (matplotlib è CPU-bound e i
+        grafici sono indipendenti): ogni plot_* invia il lavoro e prosegue
+        """
+        try:
+            # Worker da forkserver (niente fork() dopo l'import di TensorFlow e
+            # con i thread del server attivi), con training_plots precaricato
+            self._plot_pool = SafeProcessPool(max_workers=max_workers)
+        except (OSError, ValueError) as e:
+            print(f"  Plot pool unavailable ({e}), rendering inline")
+            self._plot_pool = None
+    
+    def _render(self, plot_fn, *args):
+        """Esegue plot_fn(*args) nel pool se attivo, altrimenti subito"""
+        if not self.charts_dir.is_dir():
+            print(f"  Charts directory missing ({self.charts_dir}), skipping {plot_fn.__name__}")
+            return
+        if self._plot_pool is not None:
+            try:
+                self._plot_jobs.append((self._plot_pool.submit(plot_fn, *args), plot_fn, args))
+                return
+            except (BrokenProcessPool, RuntimeError) as e:
+                print(f"  Plot pool unavailable ({e}), rendering inline")
+                self.close_plot_pool()
+        plot_fn(*args)
+    
+    def wait_for_plots(self):
+        """Attende tutti i grafici in rendering e chiude il pool"""
+        jobs, self._plot_jobs = self._plot_jobs, []
+        try:
+            for future, plot_fn, args in jobs:
+                try:
+                    future.result()
+                except BrokenProcessPool:
+                    plot_fn(*args)  # worker terminato: si rifà il grafico inline
+        finally:
+            self.close_plot_pool()
+    
+    def close_plot_pool(self):
+        """Chiude il pool dei grafici (se presente)"""
+        if self._plot_pool is not None:
+            self._plot_pool.shutdown(wait=True)
+            self._plot_pool = None
+    
     def plot_examples(self, data, n_examples=6):
         """Plot example signals"""
-        fig, axes = plt.subplots(2, 3, figsize=(18, 8))
-        axes = axes.flatten()
-        
-        for i in range(n_examples):
-            idx = np.random.randint(0, len(data))
-            axes[i].plot(data[idx], linewidth=1.5, color='blue')
-            axes[i].set_title(f"ECG Sample {idx}", fontsize=11)
-            axes[i].set_xlabel("Time (samples)", fontsize=9)
-            axes[i].set_ylabel("Normalized Amplitude", fontsize=9)
-            axes[i].grid(True, alpha=0.3)
-        
-        plt.tight_layout()
-        chart_path = self.charts_dir / 'examples.png'
-        plt.savefig(chart_path, dpi=150, bbox_inches='tight')
-        plt.close()
-        
-        print(f"  Saved: examples.png")
+        indices = self.rng.integers(0, len(data), size=n_examples)
+        self._render(training_plots.plot_examples, data[indices], indices,
+                     self.charts_dir / 'examples.png', 'ECG')
     
     def plot_training_history(self, history):
         """Plot training curves"""
-        fig, axes = plt.subplots(1, 2, figsize=(15, 5))
-        
-        axes[0].plot(history.history['loss'], label='Training Loss', linewidth=2)
-        axes[0].plot(history.history['val_loss'], label='Validation Loss', linewidth=2)
-        axes[0].set_xlabel('Epoch', fontsize=12)
-        axes[0].set_ylabel('Loss (MSE)', fontsize=12)
-        axes[0].set_title('Training Loss', fontsize=14)
-        axes[0].legend(fontsize=11)
-        axes[0].grid(True, alpha=0.3)
-        
-        axes[1].plot(history.history['mae'], label='Training MAE', linewidth=2)
-        axes[1].plot(history.history['val_mae'], label='Validation MAE', linewidth=2)
-        axes[1].set_xlabel('Epoch', fontsize=12)
-        axes[1].set_ylabel('MAE', fontsize=12)
-        axes[1].set_title('Mean Absolute Error', fontsize=14)
-        axes[1].legend(fontsize=11)
-        axes[1].grid(True, alpha=0.3)
-        
-        plt.tight_layout()
-        chart_path = self.charts_dir / 'training_history.png'
-        plt.savefig(chart_path, dpi=150, bbox_inches='tight')
-        plt.close()
-        
-        print(f"  Saved: training_history.png")
+        self._render(training_plots.plot_training_history, dict(history.history),
+                     self.charts_dir / 'training_history.png')
     
     def plot_reconstruction(self, data, n_examples=4):
         """Plot reconstruction examples"""
-        indices = np.random.choice(len(data), n_examples, replace=False)
-        reconstructions = self.autoencoder.predict(data[indices], verbose=0)
-        
-        fig, axes = plt.subplots(n_examples, 1, figsize=(15, 3*n_examples))
-        if n_examples == 1:
-            axes = [axes]
-        
-        for i, idx in enumerate(indices):
-            mse = np.mean((data[idx] - reconstructions[i])**2)
-            
-            axes[i].plot(data[idx], 'b', label='Original ECG', linewidth=1.5)
-            axes[i].plot(reconstructions[i], 'r', label='Reconstructed', linewidth=1.5, alpha=0.8)
-            axes[i].fill_between(
-                range(self.SEQUENCE_LENGTH),
-                data[idx],
-                reconstructions[i],
-                color='lightcoral',
-                alpha=0.3,
-                label='Error'
-            )
-            axes[i].set_title(f'ECG Sample - MSE: {mse:.6f}', fontsize=12)
-            axes[i].set_xlabel('Time (samples)', fontsize=10)
-            axes[i].set_ylabel('Normalized Amplitude', fontsize=10)
-            axes[i].legend(fontsize=10)
-            axes[i].grid(True, alpha=0.3)
-        
-        plt.tight_layout()
-        chart_path = self.charts_dir / 'reconstruction.png'
-        plt.savefig(chart_path, dpi=150, bbox_inches='tight')
-        plt.close()
-        
-        print(f"  Saved: reconstruction.png")
+        indices = self.rng.choice(len(data), n_examples, replace=False)
+        # Chiamata diretta al modello: per 4 campioni predict() costa solo in setup
+        reconstructions = self.autoencoder(tf.constant(data[indices]), training=False).numpy()
+        self._render(training_plots.plot_reconstruction, data[indices], reconstructions,
+                     self.SEQUENCE_LENGTH, self.charts_dir / 'reconstruction.png', 'ECG')
     
     def plot_threshold_distribution(self, train_data):
         """Plot threshold distribution"""
-        reconstructions = self.autoencoder.predict(train_data, batch_size=256, verbose=0)
-        train_loss = tf.keras.losses.mse(train_data, reconstructions).numpy()
-        
-        fig, axes = plt.subplots(1, 2, figsize=(14, 6))
-        
-        # Histogram
-        axes[0].hist(train_loss, bins=100, color='lightblue', edgecolor='black', alpha=0.7)
-        axes[0].axvline(self.threshold, color='r', linestyle='--', linewidth=2, 
-                       label=f'Threshold ({self.SIGMA_THRESHOLD}σ)')
-        axes[0].axvline(np.mean(train_loss), color='g', linestyle='--', linewidth=2, label='Mean')
-        axes[0].set_xlabel('Reconstruction Error (MSE)', fontsize=12)
-        axes[0].set_ylabel('Frequency', fontsize=12)
-        axes[0].set_title('Distribution of Reconstruction Errors', fontsize=14)
-        axes[0].legend(fontsize=11)
-        axes[0].grid(True, alpha=0.3)
-        
-        # Cumulative
-        axes[1].hist(train_loss, bins=100, color='lightblue', edgecolor='black', alpha=0.7,
-                    cumulative=True, density=True)
-        axes[1].axhline(0.997, color='r', linestyle='--', linewidth=2, label='99.7% (3σ)')
-        axes[1].axvline(self.threshold, color='r', linestyle='--', linewidth=2, alpha=0.5)
-        axes[1].set_xlabel('Reconstruction Error (MSE)', fontsize=12)
-        axes[1].set_ylabel('Cumulative Probability', fontsize=12)
-        axes[1].set_title('Cumulative Distribution', fontsize=14)
-        axes[1].legend(fontsize=11)
-        axes[1].grid(True, alpha=0.3)
-        
-        plt.tight_layout()
-        chart_path = self.charts_dir / 'threshold_distribution.png'
-        plt.savefig(chart_path, dpi=150, bbox_inches='tight')
-        plt.close()
-        
-        print(f"  Saved: threshold_distribution.png")
-
+        # Stessi errori di calculate_threshold: nessun secondo forward pass
+        train_loss = self.cached_losses(train_data)
+        self._render(training_plots.plot_threshold_distribution, train_loss, self.threshold,
+                     self.SIGMA_THRESHOLD, self.charts_dir / 'threshold_distribution.png')
 
 def train_ecg_model(training_id, session_ids, model_config, training_manager):
     """
@@ -414,6 +635,7 @@ def train_ecg_model(training_id, session_ids, model_config, training_manager):
     Returns:
         bool: Success status
     """
+    trainer = None
     try:
         print(f"\n{'='*60}")
         print(f"STARTING ECG MODEL TRAINING")
@@ -439,12 +661,14 @@ def train_ecg_model(training_id, session_ids, model_config, training_manager):
         # STEP 2: Prepare data
         data = trainer.prepare_data(raw_signal)
         
-        # STEP 3: Plot examples
+        # STEP 3: Plot examples (rendering nel pool, in parallelo al training)
+        trainer.start_plot_pool()
         print("\nSTEP 3: Plotting example signals...")
         trainer.plot_examples(data, n_examples=6)
         
         # STEP 4: Split data
         print("\nSTEP 4: Splitting data...")
+        from sklearn.model_selection import train_test_split
         train_data, temp_data = train_test_split(data, test_size=0.3, random_state=42, shuffle=True)
         val_data, test_data = train_test_split(temp_data, test_size=0.5, random_state=42)
         
@@ -474,12 +698,22 @@ def train_ecg_model(training_id, session_ids, model_config, training_manager):
         # STEP 10: Plot threshold distribution
         print("\nSTEP 10: Plotting threshold distribution...")
         trainer.plot_threshold_distribution(train_data)
+        trainer.clear_inference_cache()
+        trainer.wait_for_plots()  # i PNG servono al pacchetto di deploy
         
         # STEP 11: Save model
         print("\nSTEP 11: Saving model...")
-        trainer.save_model(model_config)
+        trainer.save_model(model_config, train_data)
+        threshold = trainer.threshold  # threshold del modello TFLite
         trainer.save_training_config(threshold_stats, sessions_info)
         
+        # Modello già esportato: si rilasciano i riferimenti (modello e
+        # tf.function) prima dell'upload. Niente clear_session(): azzera lo
+        # stato Keras globale anche per un training concorrente nel server
+        trainer.autoencoder = None
+        trainer._recon_mse = None
+        gc.collect()
+        
         # STEP 12: Mark as completed
         final_epoch = len(history.history['loss'])
         final_loss = history.history['loss'][-1]
@@ -506,6 +740,8 @@ def train_ecg_model(training_id, session_ids, model_config, training_manager):
         print(f"\n❌ Training failed: {e}")
         import traceback
         traceback.print_exc()
+        if trainer is not None:
+            trainer.close_plot_pool()
         training_manager.fail_training(training_id, str(e))
         return False
 
@@ -526,8 +762,16 @@ def package_and_upload_to_raspberry(model_folder, model_type='ecg'):
     """
     import zipfile
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     from pathlib import Path
     
+    # requests_toolbelt opzionale: upload multipart in streaming (memoria costante)
+    try:
+        from requests_toolbelt import MultipartEncoder
+    except ImportError:
+        MultipartEncoder = None
+    
     print(f"\n{'='*60}")
     print(f"📦 PACKAGING MODEL FOR DEPLOYMENT")
     print(f"{'='*60}")
@@ -589,11 +833,15 @@ def package_and_upload_to_raspberry(model_folder, model_type='ecg'):
     
     print(f"\n📦 Creating package: {zip_filename}")
     
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+    # PNG già compressi (deflate interno): STORED; il resto DEFLATED a livello 1
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zipf:
         for source_file, target_name in files_to_package.items():
             file_path = model_path / source_file
             if file_path.exists():
-                zipf.write(file_path, target_name)
+                if target_name.endswith('.png'):
+                    zipf.write(file_path, target_name, compress_type=zipfile.ZIP_STORED)
+                else:
+                    zipf.write(file_path, target_name)
                 file_size = file_path.stat().st_size / 1024
                 print(f"  ✓ {target_name} ({file_size:.1f} KB)")
             else:
@@ -613,7 +861,10 @@ def package_and_upload_to_raspberry(model_folder, model_type='ecg'):
         date_str = datetime.now().strftime("%Y%m%d")
         proper_model_name = f"{model_type}_model_v1_{date_str}"
         
-        with open(zip_path, 'rb') as f:
+        # Session con retry sugli errori di connessione (WiFi instabile)
+        with requests.Session() as session, open(zip_path, 'rb') as f:
+            session.mount('http://', HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.5)))
+            
             files = {'model_package': (zip_filename, f, 'application/zip')}
             data = {
                 'model_type': model_type,
@@ -621,13 +872,24 @@ def package_and_upload_to_raspberry(model_folder, model_type='ecg'):
             }
             headers = {'X-API-Key': api_key}
             
-            response = requests.post(
-                url, 
-                files=files, 
-                data=data, 
-                headers=headers,
-                timeout=120  # 2 minutes timeout
-            )
+            if MultipartEncoder is not None:
+                # Il body viene letto dal file a blocchi durante l'invio
+                encoder = MultipartEncoder(fields={**data, **files})
+                headers['Content-Type'] = encoder.content_type
+                response = session.post(
+                    url,
+                    data=encoder,
+                    headers=headers,
+                    timeout=120  # 2 minutes timeout
+                )
+            else:
+                response = session.post(
+                    url, 
+                    files=files, 
+                    data=data, 
+                    headers=headers,
+                    timeout=120  # 2 minutes timeout
+                )
         
         if response.status_code == 200:
             result = response.json()
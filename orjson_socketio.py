@@ -0,0 +1,40 @@
+"""
+Modulo json per Flask-SocketIO basato su orjson
+Serializza direttamente array NumPy (niente .tolist() intermedio);
+senza orjson ricade su json della standard library
+"""
+
+import json
+
+def _default(obj):
+    """Fallback per tipi non nativi (array/scalari NumPy non contigui o sconosciuti)"""
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+try:
+    import orjson
+    
+    _OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC
+    
+    def dumps(obj, **kwargs):
+        # kwargs (es. separators) ignorati: orjson produce già JSON compatto
+        return orjson.dumps(obj, default=_default, option=_OPTIONS).decode('utf-8')
+    
+    def dumps_bytes(obj):
+        """Come dumps, ma restituisce bytes UTF-8 (corpo di risposte HTTP)"""
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+    
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
+except ImportError:
+    def dumps(obj, **kwargs):
+        kwargs.setdefault('default', _default)
+        return json.dumps(obj, **kwargs)
+    
+    def dumps_bytes(obj):
+        """Come dumps, ma restituisce bytes UTF-8 (corpo di risposte HTTP)"""
+        return dumps(obj).encode('utf-8')
+    
+    loads = json.loads
@@ -0,0 +1,57 @@
+"""
+Process pool sicuro per un processo multi-thread (server dashboard)
+I worker partono da un forkserver (o spawn) invece che da fork() del server,
+e non re-importano il modulo __main__
+"""
+
+import multiprocessing
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Moduli leggeri importati una volta nel forkserver: i worker li ereditano già
+# caricati (le funzioni inviate ai pool vivono qui, non in __main__)
+FORKSERVER_PRELOAD = ['data_loader', 'training_plots']
+
+_context = None
+_context_lock = threading.Lock()
+_main_lock = threading.Lock()
+
+def _get_context():
+    """Contesto forkserver (spawn dove non disponibile), configurato una volta"""
+    global _context
+    with _context_lock:
+        if _context is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                _context = multiprocessing.get_context('forkserver')
+                _context.set_forkserver_preload(FORKSERVER_PRELOAD)
+            else:
+                _context = multiprocessing.get_context('spawn')
+        return _context
+
+class SafeProcessPool(ProcessPoolExecutor):
+    """
+    ProcessPoolExecutor con worker forkserver/spawn.
+
+    fork() da un processo con thread attivi (MQTT, SocketIO, watcher, runtime
+    TensorFlow) può copiare nel figlio un lock tenuto da un altro thread e
+    bloccarlo per sempre. Con forkserver/spawn ogni worker però re-importa
+    __main__: per il server significherebbe ricreare AuthDB, TrainingManager,
+    ecc. in ogni worker, quindi __main__ viene nascosto mentre i worker partono.
+    Le funzioni eseguite nel pool devono quindi stare in un modulo importabile.
+    """
+
+    def __init__(self, max_workers=None):
+        super().__init__(max_workers=max_workers, mp_context=_get_context())
+
+    def _spawn_process(self):
+        main = sys.modules['__main__']
+        with _main_lock:
+            # get_preparation_data cerca il main da __spec__ e __file__
+            saved = {name: main.__dict__[name] for name in ('__spec__', '__file__') if name in main.__dict__}
+            main.__spec__ = None
+            main.__dict__.pop('__file__', None)
+            try:
+                super()._spawn_process()
+            finally:
+                main.__dict__.update(saved)
@@ -14,15 +14,44 @@ Run as service:
     sudo systemctl enable mqtt_receiver
     sudo systemctl start mqtt_receiver
 """
+import functools
+import itertools
 import json
 import os
+import queue
+import socket
 import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 import paho.mqtt.client as mqtt
 import logging
 
+# orjson opzionale: parsa direttamente i bytes del payload ed emette bytes
+try:
+    import orjson
+    _json_loads = orjson.loads
+    
+    def _json_dumps(obj, indent: bool = False) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+except ImportError:
+    orjson = None
+    # json.loads accetta anche bytes, ma a ogni messaggio rileva l'encoding:
+    # i payload MQTT sono UTF-8, si decodifica direttamente col decoder stdlib
+    _json_decode = json.JSONDecoder().decode
+    
+    def _json_loads(data):
+        if not isinstance(data, str):
+            data = data.decode('utf-8')
+        return _json_decode(data)
+    
+    def _json_dumps(obj, indent: bool = False) -> bytes:
+        return json.dumps(obj, indent=2 if indent else None).encode('utf-8')
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -35,17 +64,72 @@ logging.basicConfig(
 logger = logging.getLogger('MQTTReceiver')
 
 
+@functools.lru_cache(maxsize=1024)
+def _ensure_dir(dir_path: str):
+    """mkdir -p memoizzato: ripetuti update nella stessa cartella non fanno syscall"""
+    os.makedirs(dir_path, exist_ok=True)
+
+
+def _ts_millis(ts: str) -> str:
+    """Millisecondi di un timestamp ISO, troncati a 3 cifre come %f[:-3]"""
+    if len(ts) > 20 and ts[19] == '.':
+        end = 20
+        while end < len(ts) and ts[end].isdigit():
+            end += 1
+        return (ts[20:end] + '000')[:3]
+    return '000'
+
+
+def _fast_ts(ts: str) -> Tuple[str, str, str]:
+    """
+    (YYYYMMDD, YYYY-MM-DD, HH:MM:SS.fff) di un timestamp ISO
+    YYYY-MM-DDTHH:MM:SS[.f]... per slicing, senza costruire un datetime
+    """
+    if len(ts) >= 19 and ts[4] == '-' and ts[7] == '-' and ts[13] == ':' and ts[16] == ':':
+        return ts[:4] + ts[5:7] + ts[8:10], ts[:10], f"{ts[11:19]}.{_ts_millis(ts)}"
+    
+    # Formato non standard: parsing completo
+    dt = datetime.fromisoformat(ts.replace('Z', '+00:00'))
+    return dt.strftime("%Y%m%d"), dt.strftime("%Y-%m-%d"), dt.strftime("%H:%M:%S.%f")[:-3]
+
+
 class MQTTReceiver:
     """
     MQTT Receiver that maintains synchronized storage with local device
     """
     
+    # Finestra di coalescenza delle scritture su disco (secondi)
+    FLUSH_INTERVAL = 0.1
+    STAT_KEYS = (
+        'messages_received',
+        'realtime_packets',
+        'storage_packets',
+        'anomalies_received',
+        'files_synced',
+        'files_deleted',
+        'errors'
+    )
+    
+    # Token bucket dei log di errore per messaggio: burst massimo e ricarica al secondo
+    ERROR_LOG_BURST = 100
+    ERROR_LOG_RATE = 10
+    # fd di log in append tenuti aperti (LRU)
+    MAX_LOG_FDS = 32
+    # Worker per le write+fsync di un ciclo di flush (un file per worker)
+    IO_WORKERS = 4
+    # Intervallo minimo tra due scritture di {signal}_latest.json (secondi)
+    REALTIME_FLUSH_INTERVAL = 0.5
+    # Messaggi QoS>0 in volo e buffer di ricezione del socket verso il broker
+    MAX_INFLIGHT_MESSAGES = 200
+    SOCKET_RCVBUF = 4 * 1024 * 1024
+    
     def __init__(self, 
                  broker: str = "localhost",
                  port: int = 1883,
                  username: str = None,
                  password: str = None,
-                 base_storage_dir: str = "./var/iit_data"):
+                 base_storage_dir: str = "./var/iit_data",
+                 enable_legacy_topics: bool = False):
         """
         Initialize MQTT Receiver
         
@@ -55,6 +139,8 @@ class MQTTReceiver:
             username: MQTT username (optional)
             password: MQTT password (optional)
             base_storage_dir: Base directory for storing all data
+            enable_legacy_topics: Also subscribe to topics without device ID
+                (iit/device/<type>), for devices using the old topic layout
         """
         self.broker = broker
         self.port = port
@@ -67,6 +153,17 @@ class MQTTReceiver:
         self.anomaly_logs_dir = self.base_storage_dir / "anomaly_logs"
         self.realtime_buffer_dir = self.base_storage_dir / "realtime_buffer"
         
+        # Forme str delle directory: i path per messaggio sono concatenazioni
+        # di stringhe, senza costruire oggetti Path
+        self._anomaly_logs_dir_s = os.fspath(self.anomaly_logs_dir)
+        self._realtime_files: Dict[str, str] = {}
+        
+        # Radici di destinazione dei path sincronizzati dal device
+        self._sync_roots = (
+            ('/data_storage/', os.fspath(self.data_storage_dir)),
+            ('/anomaly_logs/', self._anomaly_logs_dir_s)
+        )
+        
         # Create directories
         self._create_directories()
         
@@ -75,28 +172,118 @@ class MQTTReceiver:
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
+        # Più messaggi in volo (default 20) durante i burst; coda in uscita illimitata
+        self.client.max_inflight_messages_set(self.MAX_INFLIGHT_MESSAGES)
+        self.client.max_queued_messages_set(0)
+        
+        # Routing per filtro di topic: il match avviene nel matcher di paho,
+        # on_message resta solo per i topic sconosciuti
+        # (suffisso del topic, handler, il handler riceve anche il topic)
+        self._topic_routes = (
+            ('realtime/+', self._handle_realtime, True),
+            ('storage/+', self._handle_storage, True),
+            ('anomalies/+', self._handle_anomaly, True),
+            ('session', self._handle_session, False),
+            ('status', self._handle_status, False),
+            ('metadata', self._handle_metadata, False),
+            ('sync/+', self._handle_sync, True)
+        )
+        # Filtri con device ID, e senza solo se richiesti (compatibilità):
+        # ogni filtro in più è un match in più sul broker per ogni messaggio
+        prefixes = ['iit/device/+/']
+        if enable_legacy_topics:
+            prefixes.append('iit/device/')
+        self._subscriptions = []
+        # Tipo di topic ('realtime', 'session', ...) -> callback, per on_message
+        self._topic_handlers = {}
+        for suffix, handler, with_topic in self._topic_routes:
+            route = self._make_route(handler, with_topic)
+            self._topic_handlers[suffix.split('/')[0]] = route
+            for prefix in prefixes:
+                self.client.message_callback_add(prefix + suffix, route)
+                self._subscriptions.append((prefix + suffix, 1))
         
         # Set credentials if provided
         if username and password:
             self.client.username_pw_set(username, password)
         
-        # Statistics
-        self.stats = {
-            'messages_received': 0,
-            'realtime_packets': 0,
-            'storage_packets': 0,
-            'anomalies_received': 0,
-            'files_synced': 0,
-            'files_deleted': 0,
-            'errors': 0,
-            'start_time': datetime.now().isoformat()
-        }
+        # Statistics: un itertools.count per chiave, next() è atomico sotto il
+        # GIL (incrementi dal thread di rete e da quello di flush senza lock)
+        self._stat_counters = {key: itertools.count() for key in self.STAT_KEYS}
+        self._stat_reads = 0
+        self._stats_lock = threading.Lock()  # solo per gli snapshot
+        self._start_time = datetime.now().isoformat()
         
         # Active sessions
         self.active_sessions = {}
         
+        # Rate limit dei log di errore: un burst di payload malformati non
+        # deve trasformarsi in una riga di log (e una write) per messaggio
+        self._err_lock = threading.Lock()
+        self._err_tokens = float(self.ERROR_LOG_BURST)
+        self._err_last = time.monotonic()
+        self._err_dropped = 0
+        self._err_last_report = self._err_last
+        
+        # Log anomalie giornalieri (JSONL): fd aperti in O_APPEND, LRU per path
+        self._log_fds = OrderedDict()
+        self._log_fds_date = None
+        
+        # I/O su disco fuori dal thread di rete MQTT: le scritture vanno in coda
+        # come (path, bytes, mode), le altre operazioni (delete, cleanup,
+        # cartelle) come (None, callable, 'call'), e il flusher le esegue in ordine
+        self._write_queue = queue.Queue()
+        self._io_lock = threading.RLock()
+        self._io_pool = ThreadPoolExecutor(max_workers=self.IO_WORKERS, thread_name_prefix='iit-io')
+        # Ultimo snapshot real-time per segnale: su disco al massimo ogni
+        # REALTIME_FLUSH_INTERVAL, conta solo l'ultimo pacchetto
+        self._realtime_latest: Dict[str, bytes] = {}
+        self._realtime_dirty = set()
+        self._realtime_lock = threading.Lock()
+        self._realtime_last_flush = 0.0
+        self._flush_stop = threading.Event()
+        self._flush_thread = threading.Thread(target=self._flusher_loop, daemon=True)
+        self._flush_thread.start()
+        
         logger.info(f"Initialized MQTT Receiver - Storage: {self.base_storage_dir}")
     
+    @property
+    def stats(self) -> Dict:
+        """Snapshot delle statistiche"""
+        with self._stats_lock:
+            # Leggere il valore corrente fa avanzare il contatore: si sottrae
+            # il numero di snapshot già presi
+            snapshot = {
+                key: next(counter) - self._stat_reads
+                for key, counter in self._stat_counters.items()
+            }
+            self._stat_reads += 1
+        snapshot['start_time'] = self._start_time
+        return snapshot
+    
+    def _log_error(self, msg: str, *args, level: int = logging.ERROR):
+        """logger.log con formattazione lazy, scartato se il token bucket è vuoto"""
+        with self._err_lock:
+            now = time.monotonic()
+            self._err_tokens = min(
+                self.ERROR_LOG_BURST,
+                self._err_tokens + (now - self._err_last) * self.ERROR_LOG_RATE
+            )
+            self._err_last = now
+            if self._err_tokens < 1:
+                self._err_dropped += 1
+                return
+            self._err_tokens -= 1
+        logger.log(level, msg, *args)
+    
+    def _report_dropped_errors(self):
+        """Una riga di riepilogo con i log scartati dal rate limit"""
+        with self._err_lock:
+            dropped, self._err_dropped = self._err_dropped, 0
+            self._err_last_report = time.monotonic()
+        if dropped:
+            logger.error("%d log messages suppressed by rate limit", dropped)
+    
     def _create_directories(self):
         """Create all necessary storage directories"""
         dirs = [
@@ -114,75 +301,68 @@ class MQTTReceiver:
         """Callback when connected to MQTT broker"""
         if rc == 0:
             logger.info(f"Connected to MQTT broker {self.broker}:{self.port}")
+            self._tune_socket(client)
             
-            # Subscribe to all topics
-            topics = [
-                ('iit/device/+/realtime/+', 1),
-                ('iit/device/+/storage/+', 1),
-                ('iit/device/+/anomalies/+', 1),
-                ('iit/device/+/session', 1),
-                ('iit/device/+/status', 1),
-                ('iit/device/+/metadata', 1),
-                ('iit/device/+/sync/+', 1)
-            ]
-            
-            # Subscribe with wildcard for all devices
-            for topic, qos in topics:
-                client.subscribe(topic, qos)
+            # Una sola SUBSCRIBE con tutti i filtri (un solo round-trip SUBACK)
+            client.subscribe(self._subscriptions)
+            for topic, qos in self._subscriptions:
                 logger.info(f"Subscribed to: {topic}")
             
-            # Also subscribe without device ID for backward compatibility
-            simple_topics = [
-                ('iit/device/realtime/+', 1),
-                ('iit/device/storage/+', 1),
-                ('iit/device/anomalies/+', 1),
-                ('iit/device/session', 1),
-                ('iit/device/status', 1),
-                ('iit/device/metadata', 1),
-                ('iit/device/sync/+', 1)
-            ]
-            
-            for topic, qos in simple_topics:
-                client.subscribe(topic, qos)
-            
         else:
-            logger.error(f"Connection failed with code {rc}")
+            logger.error("Connection failed with code %s", rc)
+    
+    def _tune_socket(self, client):
+        """Nagle disattivato e buffer di ricezione più grande sul socket del broker"""
+        sock = client.socket()
+        if sock is None:
+            return
+        try:
+            # Nagle accorpa i pacchetti piccoli in attesa dell'ACK: PUBACK e
+            # PINGREQ partirebbero in ritardo, rallentando il flusso QoS 1
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.SOCKET_RCVBUF)
+        except (OSError, AttributeError) as e:
+            logger.warning("Could not tune MQTT socket: %s", e)
     
     def _on_disconnect(self, client, userdata, rc):
         """Callback when disconnected from broker"""
         if rc != 0:
-            logger.warning(f"Unexpected disconnection (code: {rc})")
+            logger.warning("Unexpected disconnection (code: %s)", rc)
+    
+    def _make_route(self, handler, with_topic: bool):
+        """Callback paho per un filtro di topic: parsing del payload e handler"""
+        def on_routed_message(client, userdata, msg):
+            try:
+                next(self._stat_counters['messages_received'])
+                payload = _json_loads(msg.payload)
+                if with_topic:
+                    handler(payload, msg.topic)
+                else:
+                    handler(payload)
+            except Exception as e:
+                self._log_error("Error processing message: %s", e)
+                next(self._stat_counters['errors'])
+        return on_routed_message
     
     def _on_message(self, client, userdata, msg):
-        """Main message handler - routes to specific handlers"""
-        try:
-            self.stats['messages_received'] += 1
-            
-            # Parse message
-            payload = json.loads(msg.payload.decode())
-            topic = msg.topic
-            
-            # Route to appropriate handler
-            if '/realtime/' in topic:
-                self._handle_realtime(payload, topic)
-            elif '/storage/' in topic:
-                self._handle_storage(payload, topic)
-            elif '/anomalies/' in topic:
-                self._handle_anomaly(payload, topic)
-            elif '/session' in topic:
-                self._handle_session(payload)
-            elif '/status' in topic:
-                self._handle_status(payload)
-            elif '/metadata' in topic:
-                self._handle_metadata(payload)
-            elif '/sync/' in topic:
-                self._handle_sync(payload, topic)
-            else:
-                logger.warning(f"Unknown topic: {topic}")
-            
-        except Exception as e:
-            logger.error(f"Error processing message: {e}")
-            self.stats['errors'] += 1
+        """
+        Default handler, for topics not matched by any registered route:
+        un solo split e un lookup sul tipo (iit/device/<id>/<tipo>/... o
+        iit/device/<tipo>/...) invece di una catena di ricerche di sottostringhe
+        """
+        parts = msg.topic.split('/')
+        handlers = self._topic_handlers
+        route = None
+        if len(parts) > 3:
+            route = handlers.get(parts[3])
+        if route is None and len(parts) > 2:
+            route = handlers.get(parts[2])
+        
+        if route is not None:
+            route(client, userdata, msg)
+        else:
+            next(self._stat_counters['messages_received'])
+            self._log_error("Unknown topic: %s", msg.topic, level=logging.WARNING)
     
     def _handle_realtime(self, payload: Dict, topic: str):
         """Handle real-time data packets"""
@@ -191,22 +371,23 @@ class MQTTReceiver:
             frames = payload.get('frames', [])
             timestamp = payload.get('timestamp')
             
-            self.stats['realtime_packets'] += 1
+            next(self._stat_counters['realtime_packets'])
             
             # Save to real-time buffer (optional - for debugging)
-            buffer_file = self.realtime_buffer_dir / f"{signal}_latest.json"
-            with open(buffer_file, 'w') as f:
-                json.dump({
-                    'signal': signal,
-                    'timestamp': timestamp,
-                    'frame_count': len(frames),
-                    'last_values': frames[-10:] if len(frames) > 10 else frames
-                }, f, indent=2)
+            snapshot = _json_dumps({
+                'signal': signal,
+                'timestamp': timestamp,
+                'frame_count': len(frames),
+                'last_values': frames[-10:] if len(frames) > 10 else frames
+            })
+            with self._realtime_lock:
+                self._realtime_latest[signal] = snapshot
+                self._realtime_dirty.add(signal)
             
             logger.debug(f"Real-time: {signal} - {len(frames)} frames")
             
         except Exception as e:
-            logger.error(f"Error handling real-time data: {e}")
+            self._log_error("Error handling real-time data: %s", e)
     
     def _handle_storage(self, payload: Dict, topic: str):
         """Handle storage data packets - save to session files"""
@@ -215,7 +396,7 @@ class MQTTReceiver:
             frames = payload.get('frames', [])
             timestamp = payload.get('timestamp')
             
-            self.stats['storage_packets'] += 1
+            next(self._stat_counters['storage_packets'])
             
             # Storage data should be associated with an active session
             # For now, buffer it if no session is active
@@ -224,7 +405,7 @@ class MQTTReceiver:
             logger.debug(f"Storage: {signal} - {len(frames)} frames")
             
         except Exception as e:
-            logger.error(f"Error handling storage data: {e}")
+            self._log_error("Error handling storage data: %s", e)
     
     def _handle_anomaly(self, payload: Dict, topic: str):
         """Handle anomaly detection results"""
@@ -233,7 +414,7 @@ class MQTTReceiver:
             timestamp = payload.get('timestamp')
             data = payload.get('data', {})
             
-            self.stats['anomalies_received'] += 1
+            next(self._stat_counters['anomalies_received'])
             
             # Check if this is a full log file or single anomaly
             if 'anomalies' in payload:
@@ -244,14 +425,13 @@ class MQTTReceiver:
                 self._save_single_anomaly(anomaly_type, data, timestamp)
             
         except Exception as e:
-            logger.error(f"Error handling anomaly: {e}")
+            self._log_error("Error handling anomaly: %s", e)
     
     def _save_single_anomaly(self, anomaly_type: str, data: Dict, timestamp: str):
         """Save single anomaly to daily log file"""
         try:
             # Get date from timestamp
-            dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-            date_str = dt.strftime("%Y%m%d")
+            date_str, date_iso, time_ms = _fast_ts(timestamp)
             
             # Determine filename based on type
             if anomaly_type == 'ECG':
@@ -261,37 +441,221 @@ class MQTTReceiver:
             elif anomaly_type == 'TEMP':
                 filename = f"temp_anomalies_{date_str}.json"
             else:
-                logger.warning(f"Unknown anomaly type: {anomaly_type}")
+                self._log_error("Unknown anomaly type: %s", anomaly_type, level=logging.WARNING)
                 return
             
-            log_file = self.anomaly_logs_dir / filename
+            # Cambio di giorno: chiude i file dei giorni precedenti
+            if date_str != self._log_fds_date:
+                self._log_fds_date = date_str
+                self._submit_io(self._rollover_log_fds, date_str)
             
-            # Read existing data
-            if log_file.exists():
-                with open(log_file, 'r') as f:
-                    anomalies = json.load(f)
-            else:
-                anomalies = []
+            log_file = f"{self._anomaly_logs_dir_s}/{filename}"
             
             # Prepare anomaly entry
             entry = {
                 'timestamp': timestamp,
-                'date': dt.strftime("%Y-%m-%d"),
-                'time': dt.strftime("%H:%M:%S.%f")[:-3],
+                'date': date_iso,
+                'time': time_ms,
                 **data
             }
             
-            # Append
-            anomalies.append(entry)
+            # Append di una riga JSONL: niente rilettura/riscrittura del file
+            self._write_queue.put((log_file, _json_dumps(entry) + b'\n', 'ab'))
             
-            # Write back
-            with open(log_file, 'w') as f:
-                json.dump(anomalies, f, indent=2)
+            logger.info(f"Anomaly saved: {anomaly_type} at {time_ms[:8]}")
             
-            logger.info(f"Anomaly saved: {anomaly_type} at {dt.strftime('%H:%M:%S')}")
+        except Exception as e:
+            self._log_error("Error saving single anomaly: %s", e)
+    
+    def _log_fd(self, log_file: str, evicted: List[int]) -> int:
+        """
+        fd in append del log (convertito a JSONL se legacy): open solo al primo
+        uso, poi una sola os.write per ciclo. Gli fd usciti dalla LRU finiscono
+        in evicted e vanno chiusi dal chiamante a scritture completate.
+        """
+        fd = self._log_fds.get(log_file)
+        if fd is not None:
+            self._log_fds.move_to_end(log_file)
+            return fd
+        
+        self._migrate_anomaly_log(log_file)
+        fd = os.open(log_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._log_fds[log_file] = fd
+        if len(self._log_fds) > self.MAX_LOG_FDS:
+            evicted.append(self._log_fds.popitem(last=False)[1])
+        return fd
+    
+    def _close_log_fd(self, log_file: str):
+        """Chiude l'fd in append (prima che il log venga riscritto o cancellato)"""
+        with self._io_lock:
+            fd = self._log_fds.pop(log_file, None)
+            if fd is not None:
+                os.close(fd)
+    
+    def _flusher_loop(self):
+        """Thread di scrittura: svuota la coda ogni FLUSH_INTERVAL"""
+        while not self._flush_stop.wait(self.FLUSH_INTERVAL):
+            try:
+                self._flush_pending()
+                now = time.monotonic()
+                if now - self._realtime_last_flush >= self.REALTIME_FLUSH_INTERVAL:
+                    self._realtime_last_flush = now
+                    self._flush_realtime()
+                if now - self._err_last_report >= 1.0:
+                    self._report_dropped_errors()
+            except Exception as e:
+                self._log_error("Error flushing pending writes: %s", e)
+    
+    def _flush_realtime(self):
+        """Scrive su disco gli snapshot real-time cambiati dall'ultimo flush"""
+        with self._realtime_lock:
+            if not self._realtime_dirty:
+                return
+            dirty = [(signal, self._realtime_latest[signal]) for signal in self._realtime_dirty]
+            self._realtime_dirty.clear()
+        
+        for signal, snapshot in dirty:
+            buffer_file = self._realtime_files.get(signal)
+            if buffer_file is None:
+                buffer_file = os.path.join(self.realtime_buffer_dir, f"{signal}_latest.json")
+                self._realtime_files[signal] = buffer_file
+            tmp_file = buffer_file + '.tmp'
+            try:
+                with open(tmp_file, 'wb') as f:
+                    f.write(snapshot)
+                # Rename atomico: chi legge vede sempre un file completo
+                os.replace(tmp_file, buffer_file)
+            except Exception as e:
+                self._log_error("Error writing real-time buffer %s: %s", buffer_file, e)
+    
+    def _submit_io(self, fn, *args):
+        """Esegue fn(*args) sul thread di flush, dopo le scritture già in coda"""
+        self._write_queue.put((None, functools.partial(fn, *args), 'call'))
+    
+    def _flush_pending(self):
+        """
+        Esegue le operazioni in coda: le append sullo stesso file diventano una
+        sola write, una riscrittura ('wb') annulla quelle precedenti, e ogni
+        file riceve un solo fsync per ciclo. Una 'call' viene eseguita dopo
+        aver scritto tutto ciò che la precede nella coda.
+        """
+        with self._io_lock:
+            pending = {}
+            while True:
+                try:
+                    path, data, mode = self._write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if mode == 'call':
+                    self._write_batch(pending)
+                    pending = {}
+                    try:
+                        data()
+                    except Exception as e:
+                        self._log_error("Error in queued I/O operation: %s", e)
+                elif mode == 'wb' or path not in pending:
+                    pending[path] = [mode, [data]]
+                elif pending[path][0] == 'wb':
+                    # Mai unire append a una riscrittura: il contenuto 'wb' (es. un
+                    # array JSON legacy da file_update) va su disco prima, così
+                    # l'append riapre il file e lo migra a JSONL se serve
+                    self._write_batch(pending)
+                    pending = {path: [mode, [data]]}
+                else:
+                    pending[path][1].append(data)
             
+            self._write_batch(pending)
+    
+    def _write_batch(self, pending: Dict):
+        """Scrive in parallelo sul pool di I/O un file per path (path distinti)"""
+        jobs = []
+        evicted = []
+        for path, (mode, chunks) in pending.items():
+            try:
+                if mode == 'ab':
+                    fd = self._log_fd(path, evicted)
+                else:
+                    self._close_log_fd(path)
+                    fd = None
+                jobs.append(self._io_pool.submit(self._write_file, path, fd, b''.join(chunks)))
+            except Exception as e:
+                self._log_error("Error writing %s: %s", path, e)
+        # Il ciclo successivo parte solo a scritture completate (ordine per file)
+        for job in jobs:
+            job.result()
+        for fd in evicted:
+            os.close(fd)
+    
+    @staticmethod
+    def _write_all(fd: int, data: bytes):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    
+    def _write_file(self, path: str, fd, data: bytes):
+        """
+        write + fsync: su un fd in append già aperto, o riscrittura completa.
+        
+        Le riscritture passano da un file temporaneo e os.replace: un crash a
+        metà scrittura non lascia mai un metadata.json (o log) troncato.
+        """
+        try:
+            if fd is not None:
+                self._write_all(fd, data)
+                os.fsync(fd)
+            else:
+                tmp_path = path + '.tmp'
+                tmp_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    self._write_all(tmp_fd, data)
+                    os.fsync(tmp_fd)
+                finally:
+                    os.close(tmp_fd)
+                os.replace(tmp_path, path)
         except Exception as e:
-            logger.error(f"Error saving single anomaly: {e}")
+            self._log_error("Error writing %s: %s", path, e)
+    
+    def _rollover_log_fds(self, date_str: str = None):
+        """Chiude gli fd che non appartengono alla data corrente (tutti se None)"""
+        with self._io_lock:
+            for log_file in list(self._log_fds):
+                if date_str is None or not log_file.endswith(f"_{date_str}.json"):
+                    self._close_log_fd(log_file)
+    
+    @staticmethod
+    def _migrate_anomaly_log(log_file: str) -> bool:
+        """
+        Converte un log anomalie in formato array JSON (legacy) in JSONL.
+        
+        Il nome del file resta invariato: la dashboard riconosce entrambi i
+        formati dal primo carattere. Restituisce True se il file è stato convertito.
+        """
+        try:
+            with open(log_file, 'rb') as f:
+                if f.read(64).lstrip()[:1] != b'[':
+                    return False
+                f.seek(0)
+                anomalies = _json_loads(f.read())
+        except FileNotFoundError:
+            return False
+        
+        tmp_file = log_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(b''.join(_json_dumps(entry) + b'\n' for entry in anomalies))
+        os.replace(tmp_file, log_file)
+        logger.info(f"Migrated anomaly log to JSONL: {os.path.basename(log_file)} ({len(anomalies)} anomalies)")
+        return True
+    
+    @staticmethod
+    def _anomaly_log_content(data: bytes) -> bytes:
+        """Contenuto di un log anomalie sincronizzato, normalizzato a JSONL"""
+        if data.lstrip()[:1] != b'[':
+            return data
+        try:
+            anomalies = _json_loads(data)
+        except ValueError:
+            return data  # non valido: scritto così com'è, come prima
+        return b''.join(_json_dumps(entry) + b'\n' for entry in anomalies)
     
     def _handle_anomaly_log_file(self, payload: Dict):
         """Handle complete anomaly log file"""
@@ -301,16 +665,16 @@ class MQTTReceiver:
             anomalies = payload.get('anomalies', [])
             
             # Save to anomaly logs directory
-            log_file = self.anomaly_logs_dir / file_name
-            
-            with open(log_file, 'w') as f:
-                json.dump(anomalies, f, indent=2)
+            log_file = f"{self._anomaly_logs_dir_s}/{file_name}"
+            # Compatto e già in JSONL: le append successive non devono migrarlo
+            data = b''.join(_json_dumps(entry) + b'\n' for entry in anomalies)
+            self._write_queue.put((log_file, data, 'wb'))
             
             logger.info(f"Anomaly log file saved: {file_name} ({len(anomalies)} anomalies)")
-            self.stats['files_synced'] += 1
+            next(self._stat_counters['files_synced'])
             
         except Exception as e:
-            logger.error(f"Error handling anomaly log file: {e}")
+            self._log_error("Error handling anomaly log file: %s", e)
     
     def _handle_session(self, payload: Dict):
         """Handle session events (start/end)"""
@@ -326,7 +690,7 @@ class MQTTReceiver:
                 self._end_session(session_id, statistics)
             
         except Exception as e:
-            logger.error(f"Error handling session event: {e}")
+            self._log_error("Error handling session event: %s", e)
     
     def _start_session(self, session_id: str, metadata: Dict):
         """Start new data collection session"""
@@ -342,9 +706,8 @@ class MQTTReceiver:
             session_dir.mkdir(exist_ok=True)
             
             # Save metadata
-            metadata_file = session_dir / "metadata.json"
-            with open(metadata_file, 'w') as f:
-                json.dump(metadata, f, indent=2)
+            metadata_file = f"{session_dir}/metadata.json"
+            self._write_queue.put((metadata_file, _json_dumps(metadata, indent=True), 'wb'))
             
             # Track active session
             self.active_sessions[session_id] = {
@@ -356,7 +719,7 @@ class MQTTReceiver:
             logger.info(f"Session started: {session_id}")
             
         except Exception as e:
-            logger.error(f"Error starting session: {e}")
+            self._log_error("Error starting session: %s", e)
     
     def _end_session(self, session_id: str, statistics: Dict):
         """End data collection session"""
@@ -366,17 +729,16 @@ class MQTTReceiver:
                 session_dir = session_info['dir']
                 
                 # Update metadata with final statistics
-                metadata_file = session_dir / "metadata.json"
-                if metadata_file.exists():
-                    with open(metadata_file, 'r') as f:
-                        metadata = json.load(f)
-                    
-                    metadata['end_time'] = datetime.now().isoformat()
-                    metadata['status'] = 'completed'
-                    metadata['total_samples'] = statistics
-                    
-                    with open(metadata_file, 'w') as f:
-                        json.dump(metadata, f, indent=2)
+                # (copia in memoria, aggiornata da _handle_metadata: niente
+                # rilettura del file, che può avere scritture ancora in coda)
+                metadata_file = f"{session_dir}/metadata.json"
+                metadata = session_info['metadata']
+                
+                metadata['end_time'] = datetime.now().isoformat()
+                metadata['status'] = 'completed'
+                metadata['total_samples'] = statistics
+                
+                self._write_queue.put((metadata_file, _json_dumps(metadata, indent=True), 'wb'))
                 
                 # Remove from active sessions
                 del self.active_sessions[session_id]
@@ -384,7 +746,7 @@ class MQTTReceiver:
                 logger.info(f"Session ended: {session_id}")
             
         except Exception as e:
-            logger.error(f"Error ending session: {e}")
+            self._log_error("Error ending session: %s", e)
     
     def _handle_status(self, payload: Dict):
         """Handle device status updates"""
@@ -395,7 +757,7 @@ class MQTTReceiver:
             logger.info(f"Device status: {client_id} - {status}")
             
         except Exception as e:
-            logger.error(f"Error handling status: {e}")
+            self._log_error("Error handling status: %s", e)
     
     def _handle_metadata(self, payload: Dict):
         """Handle metadata updates"""
@@ -404,40 +766,49 @@ class MQTTReceiver:
             metadata = payload.get('metadata', {})
             
             if session_id and session_id in self.active_sessions:
-                session_dir = self.active_sessions[session_id]['dir']
-                metadata_file = session_dir / "metadata.json"
+                session_info = self.active_sessions[session_id]
+                metadata_file = f"{session_info['dir']}/metadata.json"
                 
-                # Update metadata file
-                if metadata_file.exists():
-                    with open(metadata_file, 'r') as f:
-                        existing = json.load(f)
-                    existing.update(metadata)
-                    metadata = existing
+                # Merge sulla copia in memoria: il file su disco può avere
+                # ancora scritture in coda
+                existing = session_info['metadata']
+                existing.update(metadata)
                 
-                with open(metadata_file, 'w') as f:
-                    json.dump(metadata, f, indent=2)
+                self._write_queue.put((metadata_file, _json_dumps(existing, indent=True), 'wb'))
             
         except Exception as e:
-            logger.error(f"Error handling metadata: {e}")
+            self._log_error("Error handling metadata: %s", e)
     
     def _handle_sync(self, payload: Dict, topic: str):
         """Handle file synchronization events"""
         try:
             action = payload.get('action')
             
+            # delete, cartelle e cleanup girano sul thread di flush, in ordine
+            # rispetto alle scritture già in coda
             if action == 'file_update':
                 self._sync_file_update(payload)
             elif action == 'file_delete':
-                self._sync_file_delete(payload)
+                self._submit_io(self._sync_file_delete, payload)
             elif action == 'structure_sync':
-                self._sync_folder_structure(payload)
+                self._submit_io(self._sync_folder_structure, payload)
             elif action == 'cleanup':
-                self._sync_cleanup(payload)
+                self._submit_io(self._sync_cleanup, payload)
             else:
-                logger.warning(f"Unknown sync action: {action}")
+                self._log_error("Unknown sync action: %s", action, level=logging.WARNING)
             
         except Exception as e:
-            logger.error(f"Error handling sync: {e}")
+            self._log_error("Error handling sync: %s", e)
+    
+    def _resolve_sync_target(self, file_path: str) -> Optional[str]:
+        """Path sul server di un file del device (None se fuori dalle radici note)"""
+        # '/' iniziale: anche i path relativi ('data_storage/...') trovano il marker
+        s = '/' + os.fspath(file_path)
+        for marker, root in self._sync_roots:
+            _, sep, tail = s.partition(marker)
+            if sep:
+                return f"{root}/{tail}"
+        return None
     
     def _sync_file_update(self, payload: Dict):
         """Sync file update from device"""
@@ -447,36 +818,26 @@ class MQTTReceiver:
             file_type = payload.get('file_type')
             
             # Reconstruct path on server
-            path = Path(file_path)
-            
-            # Determine target directory
-            if 'data_storage' in str(path):
-                # Extract relative path from data_storage
-                parts = path.parts
-                idx = parts.index('data_storage')
-                rel_path = Path(*parts[idx+1:])
-                target_path = self.data_storage_dir / rel_path
-            elif 'anomaly_logs' in str(path):
-                parts = path.parts
-                idx = parts.index('anomaly_logs')
-                rel_path = Path(*parts[idx+1:])
-                target_path = self.anomaly_logs_dir / rel_path
-            else:
-                logger.warning(f"Unknown file path structure: {file_path}")
+            target_path = self._resolve_sync_target(file_path)
+            if target_path is None:
+                self._log_error("Unknown file path structure: %s", file_path, level=logging.WARNING)
                 return
             
             # Create parent directories
-            target_path.parent.mkdir(parents=True, exist_ok=True)
+            _ensure_dir(os.path.dirname(target_path))
+            
+            data = content.encode('utf-8')
+            if target_path.startswith(self._anomaly_logs_dir_s + '/'):
+                data = self._anomaly_log_content(data)
             
             # Write content
-            with open(target_path, 'w') as f:
-                f.write(content)
+            self._write_queue.put((target_path, data, 'wb'))
             
-            self.stats['files_synced'] += 1
-            logger.info(f"File synced: {target_path.name}")
+            next(self._stat_counters['files_synced'])
+            logger.info(f"File synced: {os.path.basename(target_path)}")
             
         except Exception as e:
-            logger.error(f"Error syncing file update: {e}")
+            self._log_error("Error syncing file update: %s", e)
     
     def _sync_file_delete(self, payload: Dict):
         """Sync file deletion from device"""
@@ -484,67 +845,86 @@ class MQTTReceiver:
             file_path = payload.get('file_path')
             
             # Reconstruct path on server
-            path = Path(file_path)
-            
-            if 'data_storage' in str(path):
-                parts = path.parts
-                idx = parts.index('data_storage')
-                rel_path = Path(*parts[idx+1:])
-                target_path = self.data_storage_dir / rel_path
-            elif 'anomaly_logs' in str(path):
-                parts = path.parts
-                idx = parts.index('anomaly_logs')
-                rel_path = Path(*parts[idx+1:])
-                target_path = self.anomaly_logs_dir / rel_path
-            else:
-                logger.warning(f"Unknown file path structure: {file_path}")
+            target_path = self._resolve_sync_target(file_path)
+            if target_path is None:
+                self._log_error("Unknown file path structure: %s", file_path, level=logging.WARNING)
                 return
             
             # Delete file if exists
-            if target_path.exists():
-                target_path.unlink()
-                self.stats['files_deleted'] += 1
-                logger.info(f"File deleted: {target_path.name}")
+            self._close_log_fd(target_path)
+            if os.path.exists(target_path):
+                os.unlink(target_path)
+                _ensure_dir.cache_clear()
+                next(self._stat_counters['files_deleted'])
+                logger.info(f"File deleted: {os.path.basename(target_path)}")
             
         except Exception as e:
-            logger.error(f"Error syncing file deletion: {e}")
+            self._log_error("Error syncing file deletion: %s", e)
     
     def _sync_folder_structure(self, payload: Dict):
-        """Sync entire folder structure"""
+        """
+        Sync entire folder structure.
+        
+        Formato v2: {'v': 2, 'data_storage': [...], 'anomaly_logs': [...]},
+        liste piatte di cartelle relative (foglie). Il formato v1, un albero
+        annidato in payload['structure'], è ancora accettato per compatibilità.
+        """
         try:
-            structure = payload.get('structure', {})
-            
             logger.info("Syncing folder structure...")
             
-            # Sync data_storage
-            if 'data_storage' in structure:
-                self._create_folder_structure(
-                    structure['data_storage'],
-                    self.data_storage_dir
-                )
+            roots = (
+                ('data_storage', self.data_storage_dir),
+                ('anomaly_logs', self.anomaly_logs_dir)
+            )
             
-            # Sync anomaly_logs
-            if 'anomaly_logs' in structure:
-                self._create_folder_structure(
-                    structure['anomaly_logs'],
-                    self.anomaly_logs_dir
-                )
+            if payload.get('v', 1) >= 2:
+                for key, base_path in roots:
+                    self._create_folders(payload.get(key, ()), base_path)
+            else:
+                structure = payload.get('structure', {})
+                for key, base_path in roots:
+                    if key in structure:
+                        self._create_folder_structure(structure[key], base_path)
             
             logger.info("Folder structure synced")
             
         except Exception as e:
-            logger.error(f"Error syncing folder structure: {e}")
+            self._log_error("Error syncing folder structure: %s", e)
+    
+    @staticmethod
+    def _create_folders(rel_paths: List[str], base_path: Path):
+        """Crea le cartelle (relative a base_path) di una lista piatta v2"""
+        base = os.fspath(base_path)
+        for rel in rel_paths:
+            # Solo path relativi dentro base_path
+            if os.path.isabs(rel) or '..' in rel.split('/'):
+                logger.warning("Skipping invalid folder path: %s", rel)
+                continue
+            os.makedirs(os.path.join(base, rel), exist_ok=True)
     
     def _create_folder_structure(self, structure: Dict, base_path: Path):
-        """Recursively create folder structure"""
-        if structure.get('type') == 'directory':
-            base_path.mkdir(parents=True, exist_ok=True)
-            
-            for name, child in structure.get('children', {}).items():
-                child_path = base_path / name
-                if child.get('type') == 'directory':
-                    self._create_folder_structure(child, child_path)
+        """
+        Create folder structure (formato v1, albero annidato): visita iterativa dell'albero e un solo
+        os.makedirs per cartella foglia (crea anche le intermedie)
+        """
+        if structure.get('type') != 'directory':
+            return
+        
+        leaves = []
+        worklist = deque([(structure, os.fspath(base_path))])
+        while worklist:
+            node, dir_path = worklist.popleft()
+            has_subdirs = False
+            for name, child in node.get('children', {}).items():
                 # Files will be synced via file_update messages
+                if child.get('type') == 'directory':
+                    has_subdirs = True
+                    worklist.append((child, os.path.join(dir_path, name)))
+            if not has_subdirs:
+                leaves.append(dir_path)
+        
+        for dir_path in leaves:
+            os.makedirs(dir_path, exist_ok=True)
     
     def _sync_cleanup(self, payload: Dict):
         """Sync cleanup event (files deleted due to retention)"""
@@ -552,36 +932,28 @@ class MQTTReceiver:
             deleted_items = payload.get('deleted_items', [])
             
             for item in deleted_items:
-                path = Path(item)
-                
                 # Determine target path on server
-                if 'data_storage' in str(path):
-                    parts = path.parts
-                    idx = parts.index('data_storage')
-                    rel_path = Path(*parts[idx+1:])
-                    target_path = self.data_storage_dir / rel_path
-                elif 'anomaly_logs' in str(path):
-                    parts = path.parts
-                    idx = parts.index('anomaly_logs')
-                    rel_path = Path(*parts[idx+1:])
-                    target_path = self.anomaly_logs_dir / rel_path
-                else:
+                target_path = self._resolve_sync_target(item)
+                if target_path is None:
                     continue
                 
                 # Delete if exists
-                if target_path.exists():
-                    if target_path.is_dir():
+                self._close_log_fd(target_path)
+                if os.path.exists(target_path):
+                    if os.path.isdir(target_path):
                         import shutil
                         shutil.rmtree(target_path)
                     else:
-                        target_path.unlink()
+                        os.unlink(target_path)
                     
                     logger.info(f"Cleanup deleted: {target_path}")
             
+            # Le cartelle rimosse non devono restare nella cache di _ensure_dir
+            _ensure_dir.cache_clear()
             logger.info(f"Cleanup synced: {len(deleted_items)} items")
             
         except Exception as e:
-            logger.error(f"Error syncing cleanup: {e}")
+            self._log_error("Error syncing cleanup: %s", e)
     
     def start(self):
         """Start the MQTT receiver"""
@@ -596,7 +968,7 @@ class MQTTReceiver:
             logger.info("Shutting down...")
             self.stop()
         except Exception as e:
-            logger.error(f"Error starting receiver: {e}")
+            logger.error("Error starting receiver: %s", e)
     
     def stop(self):
         """Stop the MQTT receiver"""
@@ -604,6 +976,14 @@ class MQTTReceiver:
         self.client.loop_stop()
         self.client.disconnect()
         
+        self._flush_stop.set()
+        self._flush_thread.join(timeout=2)
+        self._flush_pending()
+        self._flush_realtime()
+        self._rollover_log_fds()
+        self._io_pool.shutdown(wait=True)
+        self._report_dropped_errors()
+        
         # Print final statistics
         logger.info("=" * 60)
         logger.info("FINAL STATISTICS")
@@ -624,6 +1004,8 @@ def main():
     parser.add_argument('--password', help='MQTT password')
     parser.add_argument('--storage-dir', default='./var/iit_data', 
                        help='Base storage directory')
+    parser.add_argument('--legacy-topics', action='store_true',
+                       help='Also subscribe to topics without device ID')
     
     args = parser.parse_args()
     
@@ -633,7 +1015,8 @@ def main():
         port=args.port,
         username=args.username,
         password=args.password,
-        base_storage_dir=args.storage_dir
+        base_storage_dir=args.storage_dir,
+        enable_legacy_topics=args.legacy_topics
     )
     
     # Start receiver
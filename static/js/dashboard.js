@@ -146,9 +146,9 @@ function showDebugView() {
         
         // Setup SocketIO listener for real-time logs (only once)
         if (!socket._debugListenerAdded) {
-            socket.on('system_log', function(logEntry) {
+            socket.on('system_log_batch', function(logEntries) {
                 if (typeof addDebugLogToConsole === 'function') {
-                    addDebugLogToConsole(logEntry);
+                    logEntries.forEach(logEntry => addDebugLogToConsole(logEntry));
                 }
             });
             socket._debugListenerAdded = true;
@@ -403,14 +403,25 @@ socket.on('disconnect', () => {
     console.log('Disconnected from server');
 });
 
-socket.on('data_update', (data) => {
-    if (data.signal === 'TEMP') {
-        updateChart(data.signal, data.data);
+function handleSignalUpdate(signal, chartData) {
+    if (signal === 'TEMP') {
+        updateChart(signal, chartData);
     } else {
         if (shouldUpdateCharts) {
-            updateChart(data.signal, data.data);
+            updateChart(signal, chartData);
         }
     }
+}
+
+socket.on('data_update', (data) => {
+    // Aggiornamento aggregato: { signals: { ECG: {...}, ADC: {...} } }
+    if (data.signals) {
+        Object.entries(data.signals).forEach(([signal, chartData]) => {
+            handleSignalUpdate(signal, chartData);
+        });
+    } else {
+        handleSignalUpdate(data.signal, data.data);
+    }
 });
 
 socket.on('status_update', (data) => {
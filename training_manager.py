@@ -5,44 +5,252 @@ Handles model training jobs, progress tracking, and file management
 
 import json
 import os
+import sys
 import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
+from types import MappingProxyType
 import shutil
+import sqlite3
+
+# orjson opzionale (parse/dump in C, lavora direttamente su bytes)
+try:
+    import orjson
+    
+    def _dumps(obj, indent=False):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    
+    def _dumps(obj, indent=False):
+        if indent:
+            return json.dumps(obj, indent=2).encode('utf-8')
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+    
+    _loads = json.loads
+
+def _load_json(path):
+    """Legge e parsa un file JSON"""
+    with open(path, 'rb') as f:
+        return _loads(f.read())
+
+def _write_atomic(path, data):
+    """Scrive bytes su un file temporaneo e lo pubblica con os.replace"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _dump_json(path, obj):
+    """Scrive un file JSON indentato (metadata e snapshot restano leggibili)"""
+    # Pubblicazione atomica: chi legge non vede mai un file troncato
+    _write_atomic(path, _dumps(obj, indent=True))
+
+# Campi dell'indice a bassa cardinalità: internati, una sola copia per valore
+_INTERNED_FIELDS = ('model_type', 'status', 'name', 'version')
+
+def _intern_fields(entry):
+    """Interna in-place le stringhe ripetute di una voce dell'indice"""
+    for field in _INTERNED_FIELDS:
+        value = entry.get(field)
+        if type(value) is str:
+            entry[field] = sys.intern(value)
+    return entry
+
+# File di una training dir: (file_type, nome file)
+_FILE_SCHEMA = (
+    ('model', 'model.tflite'),
+    ('config', 'config.json'),
+    ('training_config', 'training_config.json'),
+    ('sessions', 'training_sessions.json'),
+    ('log', 'training_log.txt'),
+    ('metadata', 'metadata.json'),
+)
+_FILE_TYPE_MAP = dict(_FILE_SCHEMA)
+# File riportati in available_files (metadata è sempre presente)
+_AVAILABLE_FILES = _FILE_SCHEMA[:-1]
 
 class TrainingManager:
     """
     Manages training jobs and their lifecycle
     """
     
+    # Colonne della tabella trainings (oltre a training_id)
+    INDEX_COLUMNS = ('model_type', 'name', 'version', 'created_at', 'status', 'sessions_count')
+    # PRAGMA user_version del database a import dei file JSON completato
+    INDEX_DB_VERSION = 1
+    # Voci massime nella cache di get_training_details
+    DETAILS_CACHE_MAX = 256
+    # Intervallo minimo (secondi) tra due scritture di progress.json
+    PROGRESS_FLUSH_INTERVAL = 1.0
+    
     def __init__(self, models_path='var/iit_data/models'):
         self.models_path = Path(models_path)
         self.models_path.mkdir(parents=True, exist_ok=True)
         
+        # Indice: SQLite (modifiche a livello di riga); models_index.json resta
+        # come export in sola lettura, rigenerato all'avvio
+        self.index_db_file = self.models_path / 'models_index.sqlite'
         self.index_file = self.models_path / 'models_index.json'
+        self.index_log_file = self.models_path / 'models_index.jsonl'
         self.active_trainings = {}  # training_id -> training_info
         
+        # Serializza le modifiche di indice/trainings attivi (thread di training
+        # e richieste Flask); update_progress e get_progress restano senza lock
+        self._lock = threading.RLock()
+        
+        # get_training_details: training_id -> (stat key, dettagli)
+        self._details_cache = {}
+        # Dettagli dei training in stato finale (completed/failed): non cambiano
+        # più, serviti senza alcun accesso al filesystem fino alla delete
+        self._details_frozen = {}
+        # get_file_path: training_id -> {file_type: Path}
+        self._path_cache = {}
+        
+        # Progressi da persistere: training_id -> ultimo snapshot; il thread
+        # di flush scrive solo l'ultimo valore, al massimo una volta per intervallo
+        self._dirty_progress = {}
+        self._flush_event = threading.Event()
+        
         # Load existing index
         self._load_index()
+        
+        self._flush_thread = threading.Thread(target=self._progress_flush_loop, daemon=True)
+        self._flush_thread.start()
+        
+        # Persistenza di complete/fail fuori dal thread del trainer; un solo
+        # worker mantiene l'ordine delle scritture sullo stesso training
+        self._io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='training-io')
+        
+        # Directory rimaste da eliminazioni interrotte
+        for entry in os.scandir(self.models_path):
+            if entry.name.endswith('.deleting') and entry.is_dir(follow_symlinks=False):
+                self._purge_dir(entry.path)
+    
+    def _open_index_db(self):
+        """Apre (o crea) il database dell'indice"""
+        # Connessione condivisa tra thread: le scritture avvengono sotto self._lock
+        db = sqlite3.connect(self.index_db_file, isolation_level=None, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS trainings ('
+            'training_id TEXT PRIMARY KEY, model_type TEXT, name TEXT, version TEXT, '
+            'created_at TEXT, status TEXT, sessions_count INTEGER) WITHOUT ROWID'
+        )
+        return db
     
     def _load_index(self):
-        """Load models index from file"""
-        if self.index_file.exists():
-            with open(self.index_file, 'r') as f:
-                self.index = json.load(f)
+        """Load models index dal database (import una tantum dei file JSON)"""
+        # training_id -> entry, e ordine di visualizzazione (newest first)
+        self._by_id = {}
+        self._order = deque()  # appendleft O(1) per i nuovi training
+        
+        self._db = self._open_index_db()
+        
+        # L'import è completo solo se user_version è stato scritto nella sua
+        # transazione: un primo avvio fallito a metà lo ripete. Una tabella già
+        # popolata (import precedente all'uso di user_version) vale come importata.
+        migrated = (self._db.execute('PRAGMA user_version').fetchone()[0] >= self.INDEX_DB_VERSION
+                    or self._db.execute('SELECT 1 FROM trainings LIMIT 1').fetchone() is not None)
+        
+        if not migrated:
+            self._import_json_index()
         else:
-            self.index = {'trainings': []}
+            columns = ', '.join(('training_id',) + self.INDEX_COLUMNS)
+            for row in self._db.execute(f'SELECT {columns} FROM trainings ORDER BY created_at DESC'):
+                training = _intern_fields(dict(zip(('training_id',) + self.INDEX_COLUMNS, row)))
+                self._by_id[training['training_id']] = training
+                self._order.append(training['training_id'])
+            self._db.execute(f'PRAGMA user_version = {self.INDEX_DB_VERSION}')
+        
+        self._save_index()
+    
+    def _import_json_index(self):
+        """Importa nel database l'indice JSON precedente (snapshot + log)"""
+        if self.index_file.exists():
+            for training in _load_json(self.index_file).get('trainings', []):
+                # Voci malformate ignorate; duplicati: vale la prima (la più recente)
+                training_id = training.get('training_id') if isinstance(training, dict) else None
+                if not isinstance(training_id, str):
+                    print(f"[TrainingManager] Skipping malformed index entry: {training!r}")
+                    continue
+                if training_id not in self._by_id:
+                    self._by_id[training_id] = _intern_fields(training)
+                    self._order.append(training_id)
+        
+        if self.index_log_file.exists():
+            with open(self.index_log_file, 'rb') as f:
+                for line in f:
+                    try:
+                        self._apply_index_op(_loads(line))
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        # Riga troncata (crash durante l'append) o malformata: ignorata
+                        continue
+        
+        # Righe e user_version nella stessa transazione
+        self._db.execute('BEGIN')
+        try:
+            for training in self._by_id.values():
+                self._persist_index_op('upsert', training['training_id'], training)
+            self._db.execute(f'PRAGMA user_version = {self.INDEX_DB_VERSION}')
+            self._db.execute('COMMIT')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        
+        if self.index_log_file.exists():
+            self.index_log_file.unlink()
+        print(f"[TrainingManager] Imported models index into SQLite ({len(self._by_id)} trainings)")
+    
+    def _apply_index_op(self, record):
+        """Applica all'indice in memoria un'operazione (upsert/delete)"""
+        training_id = record['training_id']
+        if record['op'] == 'upsert':
+            fields = _intern_fields(record['fields'])
+            training = self._by_id.get(training_id)
+            if training is not None:
+                training.update(fields)
+                return
+            # La chiave e il campo 'training_id' condividono lo stesso oggetto stringa
+            self._by_id[training_id] = {'training_id': training_id, **fields}
+            self._order.appendleft(training_id)  # newest first, O(1)
+        elif record['op'] == 'delete':
+            if self._by_id.pop(training_id, None) is not None:
+                self._order.remove(training_id)
+    
+    def _persist_index_op(self, op, training_id, fields=None):
+        """Registra una modifica dell'indice: una riga del database, non una riscrittura"""
+        if op == 'delete':
+            self._db.execute('DELETE FROM trainings WHERE training_id = ?', (training_id,))
+            return
+        
+        columns = [column for column in self.INDEX_COLUMNS if column in fields]
+        names = ', '.join(columns)
+        placeholders = ', '.join('?' * (len(columns) + 1))
+        updates = ', '.join(f'{column} = excluded.{column}' for column in columns)
+        self._db.execute(
+            f'INSERT INTO trainings (training_id, {names}) VALUES ({placeholders}) '
+            f'ON CONFLICT(training_id) DO UPDATE SET {updates}',
+            (training_id, *(fields[column] for column in columns))
+        )
     
     def _save_index(self):
-        """Save models index to file"""
-        with open(self.index_file, 'w') as f:
-            json.dump(self.index, f, indent=2)
+        """Esporta l'indice in models_index.json (snapshot in sola lettura)"""
+        _dump_json(self.index_file, {'trainings': self.get_all_trainings()})
     
-    def generate_training_id(self):
+    def generate_training_id(self, now=None):
         """Generate unique training ID"""
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        return f"training_{timestamp}"
+        if now is None:
+            now = datetime.now()
+        # Formattazione a campi interi invece di strftime (locale-aware)
+        return (f"training_{now.year:04d}{now.month:02d}{now.day:02d}"
+                f"_{now.hour:02d}{now.minute:02d}{now.second:02d}")
     
     def create_training(self, model_type, model_config, sessions):
         """
@@ -56,7 +264,10 @@ class TrainingManager:
         Returns:
             training_id: Unique ID for this training
         """
-        training_id = self.generate_training_id()
+        # Un solo campionamento dell'orologio per id, started_at e started_at_ns
+        now_ns = time.time_ns()
+        now = datetime.fromtimestamp(now_ns / 1e9)
+        training_id = self.generate_training_id(now)
         training_dir = self.models_path / training_id
         training_dir.mkdir(parents=True, exist_ok=True)
         
@@ -70,7 +281,8 @@ class TrainingManager:
             'model_type': model_type,
             'model_config': model_config,
             'training_info': {
-                'started_at': datetime.now().isoformat(),
+                'started_at': now.isoformat(),
+                'started_at_ns': now_ns,
                 'completed_at': None,
                 'duration_minutes': None,
                 'final_epoch': None,
@@ -85,46 +297,50 @@ class TrainingManager:
         
         # Save metadata
         metadata_file = training_dir / 'metadata.json'
-        with open(metadata_file, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        _dump_json(metadata_file, metadata)
         
         # Add to index
-        self.index['trainings'].insert(0, {  # Insert at beginning (newest first)
-            'training_id': training_id,
+        entry = {
             'model_type': model_type,
             'name': model_config['name'],
             'version': model_config['version'],
             'created_at': metadata['training_info']['started_at'],
             'status': 'initializing',
             'sessions_count': len(sessions)
-        })
-        self._save_index()
-        
-        # Add to active trainings
-        self.active_trainings[training_id] = {
-            'metadata': metadata,
-            'progress': {
-                'status': 'initializing',
-                'epoch': 0,
-                'total_epochs': 100,
-                'loss': None,
-                'val_loss': None,
-                'progress_pct': 0,
-                'message': 'Initializing training...'
-            }
         }
+        with self._lock:
+            self._apply_index_op({'op': 'upsert', 'training_id': training_id, 'fields': entry})  # newest first
+            self._persist_index_op('upsert', training_id, entry)
+            
+            # Add to active trainings
+            self.active_trainings[training_id] = {
+                'metadata': metadata,
+                'progress': MappingProxyType({
+                    'status': 'initializing',
+                    'epoch': 0,
+                    'total_epochs': 100,
+                    'loss': None,
+                    'val_loss': None,
+                    'progress_pct': 0,
+                    'message': 'Initializing training...'
+                })
+            }
         
         print(f"[TrainingManager] Created training: {training_id}")
         return training_id
     
     def update_progress(self, training_id, epoch, total_epochs, loss, val_loss, message='Training...'):
         """Update training progress"""
-        if training_id not in self.active_trainings:
+        training = self.active_trainings.get(training_id)
+        if training is None:
             return
         
-        progress_pct = int((epoch / total_epochs) * 100)
+        # Aritmetica intera: niente float intermedio (int(0.29 * 100) == 28)
+        progress_pct = epoch * 100 // total_epochs
         
-        self.active_trainings[training_id]['progress'] = {
+        # Snapshot immutabile costruito per intero e pubblicato con un solo
+        # assegnamento: chi legge vede il precedente o il nuovo, mai uno parziale
+        progress = {
             'status': 'training',
             'epoch': epoch,
             'total_epochs': total_epochs,
@@ -133,20 +349,50 @@ class TrainingManager:
             'progress_pct': progress_pct,
             'message': message
         }
+        training['progress'] = MappingProxyType(progress)
+        # Il flush serializza direttamente il dict (nessuno lo modifica più)
+        self._dirty_progress[training_id] = progress
+        self._flush_event.set()
+    
+    def _progress_flush_loop(self):
+        """Thread di background: persiste i progressi modificati"""
+        while True:
+            self._flush_event.wait()
+            self._flush_event.clear()
+            self._flush_progress()
+            time.sleep(self.PROGRESS_FLUSH_INTERVAL)
+    
+    def _flush_progress(self):
+        """Scrive progress.json per ogni training con progresso in sospeso"""
+        while self._dirty_progress:
+            try:
+                training_id, progress = self._dirty_progress.popitem()
+            except KeyError:
+                break
+            
+            try:
+                _write_atomic(self.models_path / training_id / 'progress.json', _dumps(progress))
+            except FileNotFoundError:
+                pass  # training eliminato nel frattempo
+            except Exception as e:
+                print(f"[TrainingManager] Error saving progress for {training_id}: {e}")
     
     def get_progress(self, training_id):
-        """Get current training progress"""
-        if training_id in self.active_trainings:
-            return self.active_trainings[training_id]['progress']
+        """Get current training progress (read-only mapping for active trainings)"""
+        progress = self.active_trainings.get(training_id, {}).get('progress')
+        if progress is not None:
+            return progress
         
         # Check if training is completed
         training_dir = self.models_path / training_id
-        metadata_file = training_dir / 'metadata.json'
         
-        if metadata_file.exists():
-            with open(metadata_file, 'r') as f:
-                metadata = json.load(f)
-            
+        # open diretto, senza exists() preventivo (una syscall in meno)
+        try:
+            metadata = _load_json(training_dir / 'metadata.json')
+        except FileNotFoundError:
+            metadata = None
+        
+        if metadata is not None:
             if metadata['status'] == 'completed':
                 return {
                     'status': 'completed',
@@ -163,133 +409,198 @@ class TrainingManager:
                     'progress_pct': 0,
                     'message': 'Training failed'
                 }
+            
+            # Training non in memoria (es. dopo un riavvio): ultimo progresso salvato
+            try:
+                return _load_json(training_dir / 'progress.json')
+            except FileNotFoundError:
+                pass
         
         return None
     
     def complete_training(self, training_id, final_epoch, final_loss, final_val_loss, threshold):
-        """Mark training as completed"""
-        training_dir = self.models_path / training_id
-        metadata_file = training_dir / 'metadata.json'
+        """Mark training as completed (metadata salvati in background)"""
+        completed_ns = time.time_ns()
+        final_loss = float(final_loss)
+        final_val_loss = float(final_val_loss)
+        
+        with self._lock:
+            # Update index
+            training = self._by_id.get(training_id)
+            if training is not None:
+                training['status'] = 'completed'
+                self._persist_index_op('upsert', training_id, {'status': 'completed'})
+            
+            # Update active trainings
+            if training_id in self.active_trainings:
+                self.active_trainings[training_id]['progress'] = MappingProxyType({
+                    'status': 'completed',
+                    'epoch': final_epoch,
+                    'total_epochs': final_epoch,
+                    'loss': final_loss,
+                    'val_loss': final_val_loss,
+                    'progress_pct': 100,
+                    'message': 'Training completed!'
+                })
         
-        if not metadata_file.exists():
+        # Il thread del trainer non attende l'I/O su metadata.json
+        self._io_executor.submit(self._persist_completion, training_id, completed_ns,
+                                 final_epoch, final_loss, final_val_loss, float(threshold))
+    
+    def _persist_completion(self, training_id, completed_ns, final_epoch, final_loss, final_val_loss, threshold):
+        """Aggiorna metadata.json di un training completato (thread di I/O)"""
+        metadata_file = self.models_path / training_id / 'metadata.json'
+        
+        try:
+            metadata = _load_json(metadata_file)
+        except FileNotFoundError:
             print(f"[TrainingManager] Error: Metadata not found for {training_id}")
             return
         
-        # Load and update metadata
-        with open(metadata_file, 'r') as f:
-            metadata = json.load(f)
+        started_ns = metadata['training_info'].get('started_at_ns')
+        if started_ns is None:
+            # Metadata creati prima di started_at_ns
+            started_at = datetime.fromisoformat(metadata['training_info']['started_at'])
+            started_ns = int(started_at.timestamp() * 1e9)
+        duration_minutes = (completed_ns - started_ns) / 6e10
         
-        started_at = datetime.fromisoformat(metadata['training_info']['started_at'])
-        completed_at = datetime.now()
-        duration_minutes = (completed_at - started_at).total_seconds() / 60
-        
-        metadata['training_info']['completed_at'] = completed_at.isoformat()
+        metadata['training_info']['completed_at'] = datetime.fromtimestamp(completed_ns / 1e9).isoformat()
         metadata['training_info']['duration_minutes'] = round(duration_minutes, 2)
         metadata['training_info']['final_epoch'] = final_epoch
-        metadata['training_info']['final_loss'] = float(final_loss)
-        metadata['training_info']['final_val_loss'] = float(final_val_loss)
-        metadata['training_info']['threshold'] = float(threshold)
+        metadata['training_info']['final_loss'] = final_loss
+        metadata['training_info']['final_val_loss'] = final_val_loss
+        metadata['training_info']['threshold'] = threshold
         metadata['status'] = 'completed'
         
         # Save updated metadata
-        with open(metadata_file, 'w') as f:
-            json.dump(metadata, f, indent=2)
-        
-        # Update index
-        for training in self.index['trainings']:
-            if training['training_id'] == training_id:
-                training['status'] = 'completed'
-                break
-        self._save_index()
-        
-        # Update active trainings
-        if training_id in self.active_trainings:
-            self.active_trainings[training_id]['progress'] = {
-                'status': 'completed',
-                'epoch': final_epoch,
-                'total_epochs': final_epoch,
-                'loss': float(final_loss),
-                'val_loss': float(final_val_loss),
-                'progress_pct': 100,
-                'message': 'Training completed!'
-            }
+        try:
+            _dump_json(metadata_file, metadata)
+        except FileNotFoundError:
+            return  # training eliminato nel frattempo
         
         print(f"[TrainingManager] Training {training_id} completed in {duration_minutes:.1f} minutes")
     
     def fail_training(self, training_id, error_message):
-        """Mark training as failed"""
-        training_dir = self.models_path / training_id
-        metadata_file = training_dir / 'metadata.json'
+        """Mark training as failed (metadata salvati in background)"""
+        failed_at = datetime.now().isoformat()
         
-        if metadata_file.exists():
-            with open(metadata_file, 'r') as f:
-                metadata = json.load(f)
+        with self._lock:
+            # Update index
+            training = self._by_id.get(training_id)
+            if training is not None:
+                training['status'] = 'failed'
+                self._persist_index_op('upsert', training_id, {'status': 'failed'})
+            
+            # Update active trainings
+            if training_id in self.active_trainings:
+                self.active_trainings[training_id]['progress'] = MappingProxyType({
+                    'status': 'failed',
+                    'progress_pct': 0,
+                    'message': f'Training failed: {error_message}'
+                })
+        
+        self._io_executor.submit(self._persist_failure, training_id, failed_at, error_message)
+        print(f"[TrainingManager] Training {training_id} failed: {error_message}")
+    
+    def _persist_failure(self, training_id, failed_at, error_message):
+        """Aggiorna metadata.json di un training fallito (thread di I/O)"""
+        metadata_file = self.models_path / training_id / 'metadata.json'
+        
+        try:
+            metadata = _load_json(metadata_file)
             
             metadata['status'] = 'failed'
-            metadata['training_info']['completed_at'] = datetime.now().isoformat()
+            metadata['training_info']['completed_at'] = failed_at
             metadata['training_info']['error'] = error_message
             
-            with open(metadata_file, 'w') as f:
-                json.dump(metadata, f, indent=2)
-        
-        # Update index
-        for training in self.index['trainings']:
-            if training['training_id'] == training_id:
-                training['status'] = 'failed'
-                break
-        self._save_index()
-        
-        # Update active trainings
-        if training_id in self.active_trainings:
-            self.active_trainings[training_id]['progress'] = {
-                'status': 'failed',
-                'progress_pct': 0,
-                'message': f'Training failed: {error_message}'
-            }
-        
-        print(f"[TrainingManager] Training {training_id} failed: {error_message}")
+            _dump_json(metadata_file, metadata)
+        except FileNotFoundError:
+            pass
     
     def get_all_trainings(self):
         """Get list of all trainings"""
-        return self.index['trainings']
+        with self._lock:
+            return [self._by_id[training_id] for training_id in self._order]
+    
+    @staticmethod
+    def _details_key(training_dir):
+        """
+        (mtime_ns, size) di directory, charts, metadata e sessions (None se
+        assenti): cambia a ogni file creato o cancellato e a ogni riscrittura
+        dei due JSON
+        """
+        key = []
+        for path in (training_dir, training_dir / 'charts',
+                     training_dir / 'metadata.json', training_dir / 'training_sessions.json'):
+            try:
+                st = os.stat(path)
+                key.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                key.append(None)
+        return tuple(key)
     
     def get_training_details(self, training_id):
-        """Get full details of a training"""
+        """Get full details of a training (cached finché i file non cambiano)"""
+        frozen = self._details_frozen.get(training_id)
+        if frozen is not None:
+            return frozen
+        
         training_dir = self.models_path / training_id
         
-        if not training_dir.exists():
+        key = self._details_key(training_dir)
+        if key[0] is None or key[2] is None:
+            self._details_cache.pop(training_id, None)
+            return None
+        
+        cached = self._details_cache.get(training_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        
+        details = self._read_training_details(training_dir)
+        if details is None:
+            return None
+        
+        with self._lock:
+            if details['metadata'].get('status') in ('completed', 'failed'):
+                self._details_cache.pop(training_id, None)
+                self._details_frozen[training_id] = details
+                return details
+            
+            if training_id not in self._details_cache and len(self._details_cache) >= self.DETAILS_CACHE_MAX:
+                # FIFO: i dict mantengono l'ordine di inserimento
+                self._details_cache.pop(next(iter(self._details_cache)))
+            self._details_cache[training_id] = (key, details)
+        return details
+    
+    def _read_training_details(self, training_dir):
+        """Legge metadata, sessioni, file e grafici di una training dir"""
+        # Un solo scandir per i file presenti (DirEntry.is_file senza stat)
+        try:
+            with os.scandir(training_dir) as entries:
+                names = {entry.name for entry in entries if entry.is_file()}
+        except FileNotFoundError:
             return None
         
         # Load metadata
-        metadata_file = training_dir / 'metadata.json'
-        if not metadata_file.exists():
+        if 'metadata.json' not in names:
             return None
         
-        with open(metadata_file, 'r') as f:
-            metadata = json.load(f)
+        metadata = _load_json(training_dir / 'metadata.json')
         
         # Load training_sessions.json if exists
-        sessions_file = training_dir / 'training_sessions.json'
         sessions_info = None
-        if sessions_file.exists():
-            with open(sessions_file, 'r') as f:
-                sessions_info = json.load(f)
+        if 'training_sessions.json' in names:
+            sessions_info = _load_json(training_dir / 'training_sessions.json')
         
         # Check available files
-        available_files = {
-            'model': (training_dir / 'model.tflite').exists(),
-            'config': (training_dir / 'config.json').exists(),
-            'training_config': (training_dir / 'training_config.json').exists(),
-            'sessions': sessions_file.exists(),
-            'log': (training_dir / 'training_log.txt').exists()
-        }
+        available_files = {file_type: file_name in names for file_type, file_name in _AVAILABLE_FILES}
         
         # Check available charts
-        charts_dir = training_dir / 'charts'
-        available_charts = []
-        if charts_dir.exists():
-            for chart_file in charts_dir.glob('*.png'):
-                available_charts.append(chart_file.stem)
+        try:
+            with os.scandir(training_dir / 'charts') as entries:
+                available_charts = [entry.name[:-4] for entry in entries if entry.name.endswith('.png')]
+        except FileNotFoundError:
+            available_charts = []
         
         return {
             'metadata': metadata,
@@ -301,40 +612,54 @@ class TrainingManager:
     
     def delete_training(self, training_id):
         """Delete a training and all its files"""
-        training_dir = self.models_path / training_id
-        
-        if training_dir.exists():
-            shutil.rmtree(training_dir)
-            print(f"[TrainingManager] Deleted training directory: {training_dir}")
-        
-        # Remove from index
-        self.index['trainings'] = [
-            t for t in self.index['trainings'] 
-            if t['training_id'] != training_id
-        ]
-        self._save_index()
-        
-        # Remove from active trainings
-        if training_id in self.active_trainings:
-            del self.active_trainings[training_id]
-        
-        print(f"[TrainingManager] Deleted training: {training_id}")
-        return True
+        with self._lock:
+            training_dir = self.models_path / training_id
+            
+            self._details_cache.pop(training_id, None)
+            self._details_frozen.pop(training_id, None)
+            self._path_cache.pop(training_id, None)
+            # Rename atomico (una syscall) e rimozione dei file in background
+            trash_dir = self.models_path / f".{training_id}.deleting"
+            try:
+                os.replace(training_dir, trash_dir)
+            except FileNotFoundError:
+                pass
+            else:
+                self._purge_dir(trash_dir)
+                print(f"[TrainingManager] Deleted training directory: {training_dir}")
+            
+            # Remove from index
+            self._apply_index_op({'op': 'delete', 'training_id': training_id})
+            self._persist_index_op('delete', training_id)
+            
+            # Remove from active trainings
+            if training_id in self.active_trainings:
+                del self.active_trainings[training_id]
+            
+            print(f"[TrainingManager] Deleted training: {training_id}")
+            return True
+    
+    @staticmethod
+    def _purge_dir(path):
+        """Rimuove una directory già scollegata dall'albero in un thread di background"""
+        threading.Thread(target=shutil.rmtree, args=(path,), kwargs={'ignore_errors': True}, daemon=True).start()
     
     def get_file_path(self, training_id, file_type):
         """Get path to a specific file"""
+        file_paths = self._path_cache.get(training_id)
+        if file_paths is not None:
+            return file_paths.get(file_type)
+        
         training_dir = self.models_path / training_id
         
-        file_paths = {
-            'model': training_dir / 'model.tflite',
-            'config': training_dir / 'config.json',
-            'training_config': training_dir / 'training_config.json',
-            'sessions': training_dir / 'training_sessions.json',
-            'log': training_dir / 'training_log.txt',
-            'metadata': training_dir / 'metadata.json'
-        }
+        # Solo training presenti nell'indice: id arbitrari dalle URL non crescono la cache
+        if training_id in self._by_id:
+            file_paths = {key: training_dir / file_name for key, file_name in _FILE_SCHEMA}
+            self._path_cache[training_id] = file_paths
+            return file_paths.get(file_type)
         
-        return file_paths.get(file_type)
+        file_name = _FILE_TYPE_MAP.get(file_type)
+        return training_dir / file_name if file_name is not None else None
     
     def get_chart_path(self, training_id, chart_name):
         """Get path to a specific chart"""
@@ -0,0 +1,141 @@
+"""
+Grafici del training (ECG e PIEZO)
+Modulo leggero (solo NumPy; matplotlib importato al primo grafico): i worker
+del process pool dei grafici lo importano senza caricare TensorFlow
+"""
+
+import numpy as np
+
+# matplotlib importato al primo grafico: chi importa il modulo senza
+# generare grafici non ne paga il costo di import
+_plt = None
+
+def _pyplot():
+    """matplotlib.pyplot con backend Agg, importato una sola volta"""
+    global _plt
+    if _plt is None:
+        import matplotlib
+        matplotlib.use('Agg')  # Use non-interactive backend
+        import matplotlib.pyplot as plt
+        _plt = plt
+    return _plt
+
+def plot_examples(samples, indices, chart_path, signal):
+    """Plot example signals"""
+    plt = _pyplot()
+    
+    fig, axes = plt.subplots(2, 3, figsize=(18, 8))
+    axes = axes.flatten()
+    
+    for i, idx in enumerate(indices):
+        axes[i].plot(samples[i], linewidth=1.5, color='blue')
+        axes[i].set_title(f"{signal} Sample {idx}", fontsize=11)
+        axes[i].set_xlabel("Time (samples)", fontsize=9)
+        axes[i].set_ylabel("Normalized Amplitude", fontsize=9)
+        axes[i].grid(True, alpha=0.3)
+    
+    plt.tight_layout()
+    plt.savefig(chart_path, dpi=150, bbox_inches='tight')
+    plt.close()
+    
+    print(f"  Saved: examples.png")
+
+
+def plot_training_history(history, chart_path):
+    """Plot training curves (history: dict metrica -> valori per epoca)"""
+    plt = _pyplot()
+    
+    fig, axes = plt.subplots(1, 2, figsize=(15, 5))
+    
+    axes[0].plot(history['loss'], label='Training Loss', linewidth=2)
+    axes[0].plot(history['val_loss'], label='Validation Loss', linewidth=2)
+    axes[0].set_xlabel('Epoch', fontsize=12)
+    axes[0].set_ylabel('Loss (MSE)', fontsize=12)
+    axes[0].set_title('Training Loss', fontsize=14)
+    axes[0].legend(fontsize=11)
+    axes[0].grid(True, alpha=0.3)
+    
+    axes[1].plot(history['mae'], label='Training MAE', linewidth=2)
+    axes[1].plot(history['val_mae'], label='Validation MAE', linewidth=2)
+    axes[1].set_xlabel('Epoch', fontsize=12)
+    axes[1].set_ylabel('MAE', fontsize=12)
+    axes[1].set_title('Mean Absolute Error', fontsize=14)
+    axes[1].legend(fontsize=11)
+    axes[1].grid(True, alpha=0.3)
+    
+    plt.tight_layout()
+    plt.savefig(chart_path, dpi=150, bbox_inches='tight')
+    plt.close()
+    
+    print(f"  Saved: training_history.png")
+
+
+def plot_reconstruction(originals, reconstructions, sequence_length, chart_path, signal):
+    """Plot reconstruction examples (originals[i] ricostruito in reconstructions[i])"""
+    plt = _pyplot()
+    
+    n_examples = len(originals)
+    
+    fig, axes = plt.subplots(n_examples, 1, figsize=(15, 3*n_examples))
+    if n_examples == 1:
+        axes = [axes]
+    
+    for i in range(n_examples):
+        mse = np.mean((originals[i] - reconstructions[i])**2)
+        
+        axes[i].plot(originals[i], 'b', label=f'Original {signal}', linewidth=1.5)
+        axes[i].plot(reconstructions[i], 'r', label='Reconstructed', linewidth=1.5, alpha=0.8)
+        axes[i].fill_between(
+            range(sequence_length),
+            originals[i],
+            reconstructions[i],
+            color='lightcoral',
+            alpha=0.3,
+            label='Error'
+        )
+        axes[i].set_title(f'{signal} Sample - MSE: {mse:.6f}', fontsize=12)
+        axes[i].set_xlabel('Time (samples)', fontsize=10)
+        axes[i].set_ylabel('Normalized Amplitude', fontsize=10)
+        axes[i].legend(fontsize=10)
+        axes[i].grid(True, alpha=0.3)
+    
+    plt.tight_layout()
+    plt.savefig(chart_path, dpi=150, bbox_inches='tight')
+    plt.close()
+    
+    print(f"  Saved: reconstruction.png")
+
+
+def plot_threshold_distribution(train_loss, threshold, sigma, chart_path):
+    """Plot threshold distribution"""
+    plt = _pyplot()
+    
+    fig, axes = plt.subplots(1, 2, figsize=(14, 6))
+    
+    # Histogram
+    axes[0].hist(train_loss, bins=100, color='lightblue', edgecolor='black', alpha=0.7)
+    axes[0].axvline(threshold, color='r', linestyle='--', linewidth=2, 
+                   label=f'Threshold ({sigma}σ)')
+    axes[0].axvline(np.mean(train_loss), color='g', linestyle='--', linewidth=2, label='Mean')
+    axes[0].set_xlabel('Reconstruction Error (MSE)', fontsize=12)
+    axes[0].set_ylabel('Frequency', fontsize=12)
+    axes[0].set_title('Distribution of Reconstruction Errors', fontsize=14)
+    axes[0].legend(fontsize=11)
+    axes[0].grid(True, alpha=0.3)
+    
+    # Cumulative
+    axes[1].hist(train_loss, bins=100, color='lightblue', edgecolor='black', alpha=0.7,
+                cumulative=True, density=True)
+    axes[1].axhline(0.997, color='r', linestyle='--', linewidth=2, label='99.7% (3σ)')
+    axes[1].axvline(threshold, color='r', linestyle='--', linewidth=2, alpha=0.5)
+    axes[1].set_xlabel('Reconstruction Error (MSE)', fontsize=12)
+    axes[1].set_ylabel('Cumulative Probability', fontsize=12)
+    axes[1].set_title('Cumulative Distribution', fontsize=14)
+    axes[1].legend(fontsize=11)
+    axes[1].grid(True, alpha=0.3)
+    
+    plt.tight_layout()
+    plt.savefig(chart_path, dpi=150, bbox_inches='tight')
+    plt.close()
+    
+    print(f"  Saved: threshold_distribution.png")